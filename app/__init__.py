@@ -39,6 +39,10 @@ from app.bucketitems.views import bucketitems
 
 app.register_blueprint(bucketitems, url_prefix='/v1')
 
+from app.export.views import export
+
+app.register_blueprint(export, url_prefix='/v1')
+
 from app.docs.views import docs
 
 app.register_blueprint(docs)
@@ -0,0 +1,169 @@
+from app import app, db
+import hashlib
+import math
+import threading
+import time
+
+
+class BloomFilter:
+    """
+    Fixed size Bloom filter over strings.
+    Membership tests never give false negatives, a positive answer only means the
+    value is probably in the set.
+    """
+
+    def __init__(self, capacity, error_rate):
+        self.capacity = capacity
+        self.size = max(8, int(math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2))))
+        self.hash_count = max(1, int(round(self.size / capacity * math.log(2))))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, value):
+        """
+        Bit positions of a value, derived from a single SHA-256 digest by double hashing.
+        :param value: String
+        :return:
+        """
+        digest = hashlib.sha256(value.encode('utf-8')).digest()
+        first = int.from_bytes(digest[:8], 'big')
+        second = int.from_bytes(digest[8:16], 'big') | 1
+        return [(first + i * second) % self.size for i in range(self.hash_count)]
+
+    def add(self, value):
+        """
+        Add a value to the filter.
+        :param value: String
+        :return:
+        """
+        for position in self._positions(value):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, value):
+        bits = self.bits
+        for position in self._positions(value):
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+
+class BlacklistFilter:
+    """
+    Per worker Bloom filter of the blacklisted token digests.
+    It is filled from the blacklist_token table in a background thread when the worker starts and
+    is not used until then. Afterwards the recent rows are read at most once every
+    BLACKLIST_FILTER_SYNC_SECONDS. Ids are handed out before the rows commit, so a row can become
+    visible after rows with greater Ids. Every sync therefore reads again the last
+    BLACKLIST_FILTER_SYNC_OVERLAP Ids below the greatest one seen.
+    """
+
+    def __init__(self):
+        self.last_id = 0
+        self.synced_at = None
+        self.loaded = False
+        self._filter = None
+        self._lock = threading.Lock()
+        self._warming = None
+
+    @property
+    def filter(self):
+        if self._filter is None:
+            self._filter = BloomFilter(app.config['BLACKLIST_FILTER_CAPACITY'],
+                                       app.config['BLACKLIST_FILTER_ERROR_RATE'])
+        return self._filter
+
+    def sync_due(self):
+        """
+        Check whether new blacklist rows should be read from the database.
+        :return:
+        """
+        return self.synced_at is None or \
+            time.time() - self.synced_at >= app.config['BLACKLIST_FILTER_SYNC_SECONDS']
+
+    def _load(self, load_rows, after_id):
+        """
+        Add the rows with an Id greater than after_id to the filter.
+        :param load_rows: Callable returning (id, digest) rows with an Id greater than the one passed in
+        :param after_id: Id to read after
+        :return:
+        """
+        for row_id, digest in load_rows(after_id):
+            self.filter.add(digest)
+            self.last_id = max(self.last_id, row_id)
+        self.synced_at = time.time()
+
+    def warm(self, load_rows):
+        """
+        Fill the filter with the whole blacklist, after which it answers lookups.
+        :param load_rows: Callable returning (id, digest) rows with an Id greater than the one passed in
+        :return:
+        """
+        with self._lock:
+            if self.loaded:
+                return
+            self._load(load_rows, 0)
+            self.loaded = True
+
+    def start_warming(self, load_rows):
+        """
+        Fill the filter in a background thread with its own application context and database session,
+        so that no request waits for the whole table to be read.
+        :param load_rows: Callable returning (id, digest) rows with an Id greater than the one passed in
+        :return:
+        """
+        def run():
+            with app.app_context():
+                try:
+                    self.warm(load_rows)
+                finally:
+                    db.session.remove()
+
+        with self._lock:
+            if self.loaded or (self._warming is not None and self._warming.is_alive()):
+                return
+            self._warming = threading.Thread(target=run, daemon=True)
+            self._warming.start()
+
+    def sync(self, load_rows):
+        """
+        Add the rows blacklisted since the last sync to the filter, reading again the trailing
+        BLACKLIST_FILTER_SYNC_OVERLAP Ids for rows that committed late.
+        :param load_rows: Callable returning (id, digest) rows with an Id greater than the one passed in
+        :return:
+        """
+        with self._lock:
+            if not self.loaded or not self.sync_due():
+                return
+            self._load(load_rows, max(0, self.last_id - app.config['BLACKLIST_FILTER_SYNC_OVERLAP']))
+
+    def add(self, digest):
+        """
+        Add a token blacklisted by this worker without waiting for the next sync.
+        :param digest: Token digest
+        :return:
+        """
+        with self._lock:
+            self.filter.add(digest)
+
+    def might_contain(self, digest):
+        """
+        False when the token is certainly not blacklisted.
+        :param digest: Token digest
+        :return:
+        """
+        return digest in self.filter
+
+    def reset(self):
+        """
+        Forget all the tokens so the filter is rebuilt from the database.
+        :return:
+        """
+        with self._lock:
+            self._filter = None
+            self.last_id = 0
+            self.synced_at = None
+            self.loaded = False
+
+
+blacklist_filter = BlacklistFilter()
@@ -0,0 +1,58 @@
+from app import app
+from app.lru import LRUCache
+import time
+
+# Cached for users that do not exist, whose epoch is None
+MISSING = object()
+
+
+class TokenEpochCache:
+    """
+    Per worker LRU cache of the users' token epochs.
+    Entries are re-read from the database after AUTH_TOKEN_EPOCH_CACHE_TTL seconds, which bounds how
+    long another worker keeps accepting tokens revoked by a bump of the epoch.
+    """
+
+    def __init__(self):
+        self._cache = LRUCache('AUTH_TOKEN_EPOCH_CACHE_SIZE')
+
+    def get(self, user_id, load_epoch):
+        """
+        Return the current token epoch of a user.
+        :param user_id: User Id
+        :param load_epoch: Callable reading the epoch of a user from the database
+        :return: Token epoch or None if the user does not exist
+        """
+        epoch = self._cache.get(user_id, MISSING)
+        if epoch is not MISSING:
+            return epoch
+        epoch = load_epoch(user_id)
+        self.set(user_id, epoch)
+        return epoch
+
+    def set(self, user_id, epoch):
+        """
+        Store the current epoch of a user.
+        :param user_id: User Id
+        :param epoch: Token epoch
+        :return:
+        """
+        self._cache.set(user_id, epoch, time.time() + app.config['AUTH_TOKEN_EPOCH_CACHE_TTL'])
+
+    def forget(self, user_id):
+        """
+        Drop the epoch of a user so it is read again on the next check.
+        :param user_id: User Id
+        :return:
+        """
+        self._cache.pop(user_id)
+
+    def clear(self):
+        """
+        Remove all the entries.
+        :return:
+        """
+        self._cache.clear()
+
+
+token_epochs = TokenEpochCache()
@@ -0,0 +1,164 @@
+from app import app
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+import bcrypt
+import os
+import threading
+import time
+
+
+class HashingPoolSaturated(Exception):
+    """
+    Raised when the password hashing pool cannot take any more work.
+    """
+
+
+def _hash_password(password, rounds):
+    """
+    Hash a password, runs inside a pool process.
+    :param password: Password bytes
+    :param rounds: bcrypt cost
+    :return:
+    """
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds)).decode('utf-8')
+
+
+def _check_password(pw_hash, password):
+    """
+    Check a password against its hash, runs inside a pool process.
+    :param pw_hash: Hash bytes
+    :param password: Password bytes
+    :return:
+    """
+    return bcrypt.checkpw(password, pw_hash)
+
+
+class HashingPool:
+    """
+    Bounded pool of processes running the bcrypt work of a worker.
+    The calling request still waits for the hash, the pool caps how many threads of a threaded worker
+    (see the Procfile) are tied up by hashing: at most BCRYPT_POOL_SIZE hashes run at a time and
+    BCRYPT_POOL_QUEUE_SIZE more may wait, any work beyond that is rejected with HashingPoolSaturated. A request waits at most
+    BCRYPT_POOL_TIMEOUT seconds for its hash before it is rejected the same way.
+    With a pool size of 0 the hashing runs in the calling process.
+    """
+
+    def __init__(self):
+        self._executor = None
+        self._slots = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _start(self):
+        """
+        Start the pool on first use in every process, a forked worker must not share its parent's pool.
+        :return:
+        """
+        with self._lock:
+            if self._pid != os.getpid():
+                size = app.config['BCRYPT_POOL_SIZE']
+                self._executor = ProcessPoolExecutor(max_workers=size) if size > 0 else None
+                self._slots = threading.BoundedSemaphore(max(size, 1) + app.config['BCRYPT_POOL_QUEUE_SIZE'])
+                self._pid = os.getpid()
+
+    def run(self, fn, *args):
+        """
+        Run fn in the pool and wait for its result. The slot of the work is only given back once
+        it is done, even when the caller stopped waiting for it.
+        :param fn: Module level function
+        :param args: Function arguments
+        :return:
+        """
+        self._start()
+        if not self._slots.acquire(blocking=False):
+            raise HashingPoolSaturated()
+        if self._executor is None:
+            try:
+                return fn(*args)
+            finally:
+                self._slots.release()
+        try:
+            future = self._executor.submit(fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda done: self._slots.release())
+        try:
+            return future.result(timeout=app.config['BCRYPT_POOL_TIMEOUT'])
+        except TimeoutError:
+            future.cancel()
+            raise HashingPoolSaturated()
+
+    def shutdown(self):
+        """
+        Stop the pool processes, a new pool is started on the next use.
+        :return:
+        """
+        with self._lock:
+            if self._executor is not None and self._pid == os.getpid():
+                self._executor.shutdown(wait=True)
+            self._executor = None
+            self._pid = None
+
+
+hashing_pool = HashingPool()
+
+
+def _to_bytes(value):
+    if isinstance(value, str):
+        return value.encode('utf-8')
+    return value
+
+
+def generate_password_hash(password, rounds=None):
+    """
+    Hash a password in the hashing pool.
+    :param password: Password
+    :param rounds: bcrypt cost, defaults to BCRYPT_HASH_PREFIX
+    :return: Hash string
+    """
+    if rounds is None:
+        rounds = app.config['BCRYPT_HASH_PREFIX']
+    return hashing_pool.run(_hash_password, _to_bytes(password), rounds)
+
+
+def check_password_hash(pw_hash, password):
+    """
+    Check a password against its hash in the hashing pool.
+    :param pw_hash: Stored hash
+    :param password: Password
+    :return: True if the password matches
+    """
+    return hashing_pool.run(_check_password, _to_bytes(pw_hash), _to_bytes(password))
+
+
+def hash_cost(pw_hash):
+    """
+    Read the cost out of a bcrypt hash such as $2b$12$...
+    :param pw_hash: Stored hash
+    :return: Cost
+    """
+    return int(pw_hash.split('$')[2])
+
+
+def needs_rehash(pw_hash):
+    """
+    Check whether a hash was made with a cost other than the configured one.
+    :param pw_hash: Stored hash
+    :return:
+    """
+    return hash_cost(pw_hash) != app.config['BCRYPT_HASH_PREFIX']
+
+
+def time_hash(rounds, samples):
+    """
+    Time hashing a password in the current process.
+    :param rounds: bcrypt cost
+    :param samples: Number of hashes to time
+    :return: Median time in seconds
+    """
+    timings = []
+    for _ in range(samples):
+        start = time.perf_counter()
+        _hash_password(b'calibration password', rounds)
+        timings.append(time.perf_counter() - start)
+    return sorted(timings)[len(timings) // 2]
@@ -1,12 +1,121 @@
-from flask import request, make_response, jsonify
+from flask import request, make_response, jsonify, abort
+from werkzeug.exceptions import NotFound
+from sqlalchemy.exc import IntegrityError
+from app import app, db
 from app.models import User
+from app.lru import LRUCache
 from functools import wraps
+import hashlib
+import time
+
+
+class TokenCache:
+    """
+    Bounded LRU cache of auth tokens that have already been verified.
+    Entries are keyed by the token digest and hold the token payload together
+    with the time the entry stops being valid, which is the token expiry capped by
+    AUTH_TOKEN_CACHE_TTL so that tokens blacklisted by other workers are re-checked.
+    """
+
+    def __init__(self):
+        self._cache = LRUCache('AUTH_TOKEN_CACHE_SIZE')
+
+    @staticmethod
+    def digest(token):
+        """
+        Fixed size key for a token.
+        :param token: Auth Token
+        :return:
+        """
+        if isinstance(token, str):
+            token = token.encode('utf-8')
+        return hashlib.sha256(token).hexdigest()
+
+    def get(self, token):
+        """
+        Return the payload of a cached token or None if the token is not cached or its entry has expired.
+        :param token: Auth Token
+        :return: Token payload or None
+        """
+        return self._cache.get(self.digest(token))
+
+    def set(self, token, payload):
+        """
+        Cache a verified token, evicting the least recently used entry when the cache is full.
+        :param token: Auth Token
+        :param payload: Decoded token payload
+        :return:
+        """
+        valid_until = min(payload['exp'], time.time() + app.config.get('AUTH_TOKEN_CACHE_TTL', 0))
+        self._cache.set(self.digest(token), payload, valid_until)
+
+    def invalidate(self, token):
+        """
+        Drop a token from the cache, for example when it is blacklisted.
+        :param token: Auth Token
+        :return:
+        """
+        self._cache.pop(self.digest(token))
+
+    def clear(self):
+        """
+        Remove all the entries and reset the counters.
+        :return:
+        """
+        self._cache.clear()
+
+    def stats(self):
+        """
+        Cache hit and miss counters. Every hit is a token verification and a blacklist query saved.
+        :return: dict
+        """
+        return {
+            'hits': self._cache.hits,
+            'misses': self._cache.misses,
+            'size': len(self._cache)
+        }
+
+
+token_cache = TokenCache()
+
+
+class AuthenticatedUser:
+    """
+    The current user built from the verified token claims.
+    The user row is only loaded from the database the first time an attribute
+    other than a claim is used, for example the password. The request is answered
+    with 401 if the user no longer exists, as it is by the views reading the version of
+    the user's data.
+    """
+
+    def __init__(self, user_id):
+        self.id = user_id
+        self._user = None
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.load(), name)
+
+    def load(self):
+        """
+        Load the user row, the request is answered with 401 if the user no longer exists.
+        :return: User
+        """
+        if self._user is None:
+            self._user = User.get_by_id(self.id)
+            if self._user is None:
+                abort(401)
+        return self._user
 
 
 def token_required(f):
     """
     Decorator function to ensure that a resource is access by only authenticated users`
-    provided their auth tokens are valid
+    provided their auth tokens are valid.
+    The user row is not read up front. A view that finds nothing, or fails on a foreign key,
+    may be serving a user that no longer exists, so the user is looked up then and 401 returned
+    if it is gone.
     :param f:
     :return:
     """
@@ -31,19 +140,35 @@ def token_required(f):
                 'message': 'Token is missing'
             })), 401
 
-        try:
-            decode_response = User.decode_auth_token(token)
-            current_user = User.query.filter_by(id=decode_response).first()
-        except:
-            message = 'Invalid token'
-            if isinstance(decode_response, str):
-                message = decode_response
+        payload = token_cache.get(token)
+        if payload is None:
+            payload = User.decode_auth_token_payload(token, 'access')
+            if isinstance(payload, str):
+                return make_response(jsonify({
+                    'status': 'failed',
+                    'message': payload
+                })), 401
+            token_cache.set(token, payload)
+        elif 'epoch' in payload and User.is_token_revoked(token, payload):
+            token_cache.invalidate(token)
             return make_response(jsonify({
                 'status': 'failed',
-                'message': message
+                'message': 'Token was Blacklisted, Please login In'
             })), 401
 
-        return f(current_user, *args, **kwargs)
+        current_user = AuthenticatedUser(payload['sub'])
+        try:
+            res = make_response(f(current_user, *args, **kwargs))
+        except NotFound:
+            current_user.load()
+            raise
+        except IntegrityError:
+            db.session.rollback()
+            current_user.load()
+            raise
+        if res.status_code == 404:
+            current_user.load()
+        return res
 
     return decorated_function
 
@@ -62,17 +187,21 @@ def response(status, message, status_code):
     })), status_code
 
 
-def response_auth(status, message, token, status_code):
+def response_auth(status, message, token, status_code, refresh_token=None):
     """
     Make a Http response to send the auth token
     :param status: Status
     :param message: Message
     :param token: Authorization Token
     :param status_code: Http status code
+    :param refresh_token: Refresh Token
     :return: Http Json response
     """
-    return make_response(jsonify({
+    data = {
         'status': status,
         'message': message,
         'auth_token': token.decode("utf-8")
-    })), status_code
+    }
+    if refresh_token is not None:
+        data['refresh_token'] = refresh_token.decode("utf-8")
+    return make_response(jsonify(data)), status_code
@@ -0,0 +1,22 @@
+from app import app
+
+
+def get_signing_key():
+    """
+    Key Id and secret used to sign new tokens.
+    :return: (kid, secret)
+    """
+    kid = app.config['AUTH_SIGNING_KEY_ID']
+    return kid, app.config['AUTH_SIGNING_KEYS'][kid]
+
+
+def get_verification_key(kid):
+    """
+    Secret used to verify a token signed with the key kid.
+    Tokens without a kid header were signed with the SECRET_KEY.
+    :param kid: Key Id from the token header
+    :return: Secret or None when the key is not in the key ring
+    """
+    if kid is None:
+        return app.config['SECRET_KEY']
+    return app.config['AUTH_SIGNING_KEYS'].get(kid)
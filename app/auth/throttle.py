@@ -0,0 +1,195 @@
+from flask import request
+from werkzeug.utils import import_string
+from app import app
+from app.auth.helper import response
+from collections import deque
+from functools import wraps
+import math
+import threading
+import time
+import uuid
+
+
+class MemoryStore:
+    """
+    In process sliding window store of request times per key.
+    A store shared by several workers has to provide the same hit method, doing the check
+    and the recording of the request atomically.
+    """
+
+    def __init__(self):
+        self._requests = {}
+        self._lock = threading.Lock()
+        self._hits_since_sweep = 0
+
+    def hit(self, key, limit, window, now):
+        """
+        Record a request for the key unless it already made limit requests within the window.
+        :param key: Throttle key
+        :param limit: Requests allowed within the window
+        :param window: Window length in seconds
+        :param now: Current time in seconds
+        :return: 0 when the request is allowed otherwise the seconds until it would be
+        """
+        with self._lock:
+            self._sweep(window, now)
+            requests = self._requests.setdefault(key, deque())
+            while requests and requests[0] <= now - window:
+                requests.popleft()
+            if len(requests) >= limit:
+                return requests[0] + window - now
+            requests.append(now)
+            return 0
+
+    def _sweep(self, window, now):
+        """
+        Every so often drop the keys without a request in the window so memory stays bounded.
+        :param window: Window length in seconds
+        :param now: Current time in seconds
+        :return:
+        """
+        self._hits_since_sweep += 1
+        if self._hits_since_sweep < 1000:
+            return
+        self._hits_since_sweep = 0
+        for key in [key for key, requests in self._requests.items() if not requests or requests[-1] <= now - window]:
+            del self._requests[key]
+
+    def clear(self):
+        """
+        Forget all the recorded requests.
+        :return:
+        """
+        with self._lock:
+            self._requests.clear()
+
+
+class RedisStore:
+    """
+    Sliding window store shared by all the workers, kept in Redis at LOGIN_THROTTLE_REDIS_URL.
+    Every key is a sorted set of request times under KEY_PREFIX, checked and recorded by one Lua script
+    so that concurrent requests on different workers cannot both take the last slot.
+    """
+
+    KEY_PREFIX = 'throttle:'
+
+    # Returns the wait as a string, Redis would truncate a Lua number to an integer
+    SCRIPT = """
+    local window = tonumber(ARGV[2])
+    local now = tonumber(ARGV[3])
+    redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now - window)
+    if redis.call('ZCARD', KEYS[1]) >= tonumber(ARGV[1]) then
+        local oldest = redis.call('ZRANGE', KEYS[1], 0, 0, 'WITHSCORES')
+        return tostring(tonumber(oldest[2]) + window - now)
+    end
+    redis.call('ZADD', KEYS[1], now, ARGV[4])
+    redis.call('EXPIRE', KEYS[1], math.ceil(window))
+    return '0'
+    """
+
+    def __init__(self):
+        import redis
+        self._client = redis.StrictRedis.from_url(app.config['LOGIN_THROTTLE_REDIS_URL'])
+        self._hit = self._client.register_script(self.SCRIPT)
+
+    def hit(self, key, limit, window, now):
+        """
+        Record a request for the key unless it already made limit requests within the window.
+        :param key: Throttle key
+        :param limit: Requests allowed within the window
+        :param window: Window length in seconds
+        :param now: Current time in seconds
+        :return: 0 when the request is allowed otherwise the seconds until it would be
+        """
+        return float(self._hit(keys=[self.KEY_PREFIX + key], args=[limit, window, now, uuid.uuid4().hex]))
+
+    def clear(self, batch_size=1000):
+        """
+        Forget all the recorded requests, only the keys under KEY_PREFIX are scanned for and deleted.
+        :param batch_size: Number of keys scanned and deleted at a time
+        :return:
+        """
+        cursor = 0
+        while True:
+            cursor, keys = self._client.scan(cursor, match=self.KEY_PREFIX + '*', count=batch_size)
+            if keys:
+                self._client.delete(*keys)
+            if cursor == 0:
+                break
+
+
+class LoginThrottle:
+    """
+    Sliding window limits on the credential endpoints, keyed by email and by client IP.
+    The store is created from the LOGIN_THROTTLE_STORE import path on first use.
+    """
+
+    def __init__(self):
+        self._store = None
+
+    @property
+    def store(self):
+        if self._store is None:
+            self._store = import_string(app.config['LOGIN_THROTTLE_STORE'])()
+        return self._store
+
+    def check(self, email, client_ip):
+        """
+        Record an attempt and tell how long the client must wait if it is over a limit.
+        :param email: Email in the request payload, may be None
+        :param client_ip: Client IP address
+        :return: Seconds to wait, 0 when the attempt is allowed
+        """
+        window = app.config['LOGIN_THROTTLE_WINDOW']
+        now = time.time()
+        retry_after = self.store.hit('ip:{}'.format(client_ip), app.config['LOGIN_THROTTLE_IP_LIMIT'], window, now)
+        if not retry_after and isinstance(email, str):
+            retry_after = self.store.hit('email:{}'.format(email.strip().lower()),
+                                         app.config['LOGIN_THROTTLE_EMAIL_LIMIT'], window, now)
+        return retry_after
+
+    def reset(self):
+        """
+        Drop the store so that it is created again from the configuration.
+        :return:
+        """
+        self._store = None
+
+
+login_throttle = LoginThrottle()
+
+
+def client_ip():
+    """
+    Address of the client of the current request. Behind TRUSTED_PROXY_HOPS proxies, such as the Heroku
+    router, the remote address is the last proxy's and the client is the entry that many places from the
+    end of X-Forwarded-For, the entries before it may have been sent by the client itself.
+    :return: IP address
+    """
+    hops = app.config['TRUSTED_PROXY_HOPS']
+    route = request.access_route if 'X-Forwarded-For' in request.headers else []
+    if hops and len(route) >= hops:
+        return route[-hops]
+    return request.remote_addr
+
+
+def throttle_credentials(f):
+    """
+    Decorator rejecting requests over the login limits before any hashing or database query is done.
+    :param f:
+    :return:
+    """
+
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if app.config['LOGIN_THROTTLE_ENABLED']:
+            post_data = request.get_json(silent=True)
+            email = post_data.get('email') if isinstance(post_data, dict) else None
+            retry_after = login_throttle.check(email, client_ip())
+            if retry_after:
+                res, status_code = response('failed', 'Too many attempts, please try again later', 429)
+                res.headers['Retry-After'] = str(int(math.ceil(retry_after)))
+                return res, status_code
+        return f(*args, **kwargs)
+
+    return decorated_function
@@ -1,19 +1,34 @@
-from app import bcrypt
 from flask import Blueprint, request
+from app import app
 from flask.views import MethodView
 from app.models import User, BlackListToken
 from app.auth.helper import response, response_auth
 from sqlalchemy import exc
-from app.auth.helper import token_required
+from app.auth.helper import token_required, token_cache
+from app.auth.hashing import check_password_hash, needs_rehash
+from app.auth.throttle import throttle_credentials
+from app.auth.blacklist import blacklist_filter
+import datetime
 import re
 
 auth = Blueprint('auth', __name__)
 
 
+@auth.before_app_first_request
+def warm_blacklist_filter():
+    """
+    Start filling the blacklist filter of the worker when it serves its first request.
+    :return:
+    """
+    if app.config['BLACKLIST_FILTER_WARM_ON_START']:
+        blacklist_filter.start_warming(BlackListToken.get_digests_after)
+
+
 class RegisterUser(MethodView):
     """
     View function to register a user via the api
     """
+    decorators = [throttle_credentials]
 
     def post(self):
         """
@@ -27,8 +42,10 @@ class RegisterUser(MethodView):
             if re.match(r"[^@]+@[^@]+\.[^@]+", email) and len(password) > 4:
                 user = User.get_by_email(email)
                 if not user:
-                    token = User(email=email, password=password).save()
-                    return response_auth('success', 'Successfully registered', token, 201)
+                    user = User(email=email, password=password)
+                    token = user.save()
+                    return response_auth('success', 'Successfully registered', token, 201,
+                                         user.encode_auth_token(user.id, 'refresh'))
                 else:
                     return response('failed', 'Failed, User already exists, Please sign In', 400)
             return response('failed', 'Missing or wrong email format or password is less than four characters', 400)
@@ -36,6 +53,8 @@ class RegisterUser(MethodView):
 
 
 class LoginUser(MethodView):
+    decorators = [throttle_credentials]
+
     def post(self):
         """
         Login a user if the supplied credentials are correct.
@@ -47,8 +66,11 @@ class LoginUser(MethodView):
             password = post_data.get('password')
             if re.match(r"[^@]+@[^@]+\.[^@]+", email) and len(password) > 4:
                 user = User.query.filter_by(email=email).first()
-                if user and bcrypt.check_password_hash(user.password, password):
-                    return response_auth('success', 'Successfully logged In', user.encode_auth_token(user.id), 200)
+                if user and check_password_hash(user.password, password):
+                    if needs_rehash(user.password):
+                        user.reset_password(password)
+                    return response_auth('success', 'Successfully logged In', user.encode_auth_token(user.id), 200,
+                                         user.encode_auth_token(user.id, 'refresh'))
                 return response('failed', 'User does not exist or password is incorrect', 401)
             return response('failed', 'Missing or wrong email format or password is less than four characters', 401)
         return response('failed', 'Content-type must be json', 202)
@@ -61,7 +83,10 @@ class LogOutUser(MethodView):
 
     def post(self):
         """
-        Try to logout a user using a token
+        Try to logout a user using a token.
+        Logging out revokes every token of the user, tokens issued before token epochs
+        were introduced are blacklisted one by one. Other workers reject the access tokens once
+        their cached epoch of the user expires, after at most AUTH_TOKEN_EPOCH_CACHE_TTL seconds.
         :return:
         """
         auth_header = request.headers.get('Authorization')
@@ -71,18 +96,57 @@ class LogOutUser(MethodView):
             except IndexError:
                 return response('failed', 'Provide a valid auth token', 403)
             else:
-                decoded_token_response = User.decode_auth_token(auth_token)
+                decoded_token_response = User.decode_auth_token_payload(auth_token)
                 if not isinstance(decoded_token_response, str):
-                    token = BlackListToken(auth_token)
-                    token.blacklist()
+                    if 'epoch' in decoded_token_response:
+                        User.revoke_tokens(decoded_token_response['sub'])
+                    else:
+                        expires_on = datetime.datetime.utcfromtimestamp(decoded_token_response['exp'])
+                        digest = BlackListToken.token_digest(auth_token, decoded_token_response)
+                        token = BlackListToken(digest, expires_on)
+                        token.blacklist()
+                    token_cache.invalidate(auth_token)
                     return response('success', 'Successfully logged out', 200)
                 return response('failed', decoded_token_response, 401)
         return response('failed', 'Provide an authorization header', 403)
 
 
+class RefreshToken(MethodView):
+    """
+    Class to exchange a refresh token for a new access token
+    """
+
+    def post(self):
+        """
+        Issue a new access token if the refresh token in the Authorization header
+        is valid and has not been revoked.
+        :return:
+        """
+        auth_header = request.headers.get('Authorization')
+        if auth_header:
+            try:
+                refresh_token = auth_header.split(" ")[1]
+            except IndexError:
+                return response('failed', 'Provide a valid auth token', 403)
+            decoded_token_response = User.decode_auth_token_payload(refresh_token, 'refresh')
+            if isinstance(decoded_token_response, str):
+                return response('failed', decoded_token_response, 401)
+            user = User.get_by_id(decoded_token_response['sub'])
+            if not user:
+                return response('failed', 'Invalid token. Please sign in again', 401)
+            return response_auth('success', 'Successfully refreshed', user.encode_auth_token(user.id), 200)
+        return response('failed', 'Provide an authorization header', 403)
+
+
 @auth.route('/auth/reset/password', methods=['POST'])
 @token_required
 def reset_password(current_user):
+    """
+    Change the password of the user and revoke their tokens, new tokens are returned.
+    Other workers reject the old access tokens after at most AUTH_TOKEN_EPOCH_CACHE_TTL seconds.
+    :param current_user: User
+    :return: Http Json response
+    """
     if request.content_type == "application/json":
         data = request.get_json()
         old_password = data.get('oldPassword')
@@ -90,13 +154,16 @@ def reset_password(current_user):
         password_confirmation = data.get('passwordConfirmation')
         if not old_password or not new_password or not password_confirmation:
             return response('failed', "Missing required attributes", 400)
-        if bcrypt.check_password_hash(current_user.password, old_password.encode('utf-8')):
+        if check_password_hash(current_user.password, old_password):
             if not new_password == password_confirmation:
                 return response('failed', 'New Passwords do not match', 400)
             if not len(new_password) > 4:
                 return response('failed', 'New password should be greater than four characters long', 400)
             current_user.reset_password(new_password)
-            return response('success', 'Password reset successfully', 200)
+            User.revoke_tokens(current_user.id)
+            return response_auth('success', 'Password reset successfully',
+                                 current_user.encode_auth_token(current_user.id), 200,
+                                 current_user.encode_auth_token(current_user.id, 'refresh'))
         return response('failed', "Incorrect password", 401)
     return response('failed', 'Content type must be json', 400)
 
@@ -105,8 +172,10 @@ def reset_password(current_user):
 registration_view = RegisterUser.as_view('register')
 login_view = LoginUser.as_view('login')
 logout_view = LogOutUser.as_view('logout')
+refresh_view = RefreshToken.as_view('refresh')
 
 # Add rules for the api Endpoints
 auth.add_url_rule('/auth/register', view_func=registration_view, methods=['POST'])
 auth.add_url_rule('/auth/login', view_func=login_view, methods=['POST'])
 auth.add_url_rule('/auth/logout', view_func=logout_view, methods=['POST'])
+auth.add_url_rule('/auth/refresh', view_func=refresh_view, methods=['POST'])
@@ -1,6 +1,10 @@
 from flask import make_response, jsonify, url_for
 from app import app
-from app.models import Bucket
+from app.models import Bucket, User
+from app.fields import BUCKET_FIELDS, fields_param, project, row_json
+from app.pagination import paginate_offset, paginate_keyset, count_total
+from app.repository import find_latest_bucket_items
+from app.search import search_buckets
 
 
 def response_for_user_bucket(user_bucket):
@@ -31,6 +35,53 @@ def response_for_created_bucket(user_bucket, status_code):
     })), status_code
 
 
+def response_for_created_buckets(ids, names):
+    """
+    Method returning the response when many buckets have been created, in the order they were sent.
+    :param ids: Bucket Ids
+    :param names: Bucket names
+    :return: Http Response
+    """
+    return make_response(jsonify({
+        'status': 'success',
+        'buckets': [{'id': bucket_id, 'name': name} for bucket_id, name in zip(ids, names)]
+    })), 201
+
+
+def validate_buckets_payload(payload):
+    """
+    Check every element of a bulk bucket creation payload.
+    :param payload: List of bucket json objects
+    :return: The lowercased names and a list of errors with the index of the element at fault
+    """
+    names = []
+    errors = []
+    for index, element in enumerate(payload):
+        name = element.get('name') if isinstance(element, dict) else None
+        if not isinstance(element, dict):
+            errors.append({'index': index, 'message': 'Bucket must be a json object'})
+        elif not name or not isinstance(name, str):
+            errors.append({'index': index, 'message': 'Missing name attribute'})
+        else:
+            names.append(name.lower())
+    return names, errors
+
+
+def response_with_errors(message, errors, code):
+    """
+    Make a http response listing the elements of a bulk request that were rejected.
+    :param message: Response message
+    :param errors: List of errors with the index of the element at fault
+    :param code: Response status code
+    :return: Http Response
+    """
+    return make_response(jsonify({
+        'status': 'failed',
+        'message': message,
+        'errors': errors
+    })), code
+
+
 def response(status, message, code):
     """
     Helper method to make a http response
@@ -45,22 +96,37 @@ def response(status, message, code):
     })), code
 
 
-def get_user_bucket_json_list(user_buckets):
+def get_user_bucket_json_list(user_buckets, items_limit=None, fields=None):
     """
     Make json objects of the user buckets and add them to a list.
-    :param user_buckets: Bucket
+    When items_limit is set the newest items of every bucket are nested in it, loaded for
+    the whole page in one query.
+    :param user_buckets: Bucket, or rows of the fields when fields is set
+    :param items_limit: Items included per bucket, None to leave the items out
+    :param fields: Bucket fields to output, None for all of them
     :return:
     """
+    items = None
+    if items_limit is not None:
+        items = find_latest_bucket_items([user_bucket.id for user_bucket in user_buckets], items_limit)
     buckets = []
     for user_bucket in user_buckets:
-        buckets.append(user_bucket.json())
+        bucket_items = None if items is None else items[user_bucket.id]
+        if fields is None:
+            buckets.append(user_bucket.json(bucket_items))
+            continue
+        bucket = row_json(user_bucket, fields, BUCKET_FIELDS)
+        if bucket_items is not None:
+            bucket['items'] = [item.json() for item in bucket_items]
+        buckets.append(bucket)
     return buckets
 
 
-def response_with_pagination(buckets, previous, nex, count):
+def response_with_pagination(buckets, previous, nex, count, estimated=False):
     """
     Make a http response for BucketList get requests.
-    :param count: Pagination Total
+    :param estimated: Whether the total is an estimate
+    :param count: Pagination Total, None when it was left out
     :param nex: Next page Url if it exists
     :param previous: Previous page Url if it exists
     :param buckets: Bucket
@@ -71,38 +137,116 @@ def response_with_pagination(buckets, previous, nex, count):
         'previous': previous,
         'next': nex,
         'count': count,
+        'countEstimated': estimated,
         'buckets': buckets
     })), 200
 
 
-def paginate_buckets(user_id, page, q, user):
+def user_buckets_query(user_id, q, ranked=False, fields=None):
+    """
+    Query the buckets of the user, limited to the names matching the query parameter if it is set.
+    :param user_id: User Id
+    :param q: Query parameter
+    :param ranked: Order the matches by similarity to the query parameter
+    :param fields: Bucket fields to select, None for whole Buckets
+    :return: Query
     """
-    Get a user by Id, then get hold of their buckets and also paginate the results.
-    There is also an option to search for a bucket name if the query param is set.
+    query = project(Bucket.query.filter_by(user_id=user_id), fields, BUCKET_FIELDS)
+    if q:
+        query = search_buckets(query, q, ranked)
+    return query
+
+
+def bucket_counter(user_id, q):
+    """
+    Return a callable reading the maintained bucket count of the user, or None when a search
+    query makes the counter useless.
+    :param user_id: User Id
+    :param q: Query parameter
+    :return:
+    """
+    if q:
+        return None
+    return lambda: User.query.with_entities(User.bucket_count).filter_by(id=user_id).scalar()
+
+
+def paginate_buckets(user_id, page, q, total, fields=None, **values):
+    """
+    Get the buckets of the user with the given Id and paginate the results.
+    There is also an option to search for a bucket name if the query param is set, the closest names come first.
     Generate previous and next pagination urls
     :param q: Query parameter
     :param user_id: User Id
-    :param user: Current User
     :param page: Page number
-    :return: Pagination next url, previous url and the user buckets.
+    :param total: How to work out the total, one of TOTAL_MODES
+    :param fields: Bucket fields to select, None for whole Buckets
+    :param values: Other query parameters kept in the pagination urls
+    :return: The user buckets, next url, previous url, total and whether the total is an estimate
     """
-    if q:
-        pagination = Bucket.query.filter(Bucket.name.like("%" + q.lower().strip() + "%")).filter_by(user_id=user_id) \
-            .paginate(page=page, per_page=app.config['BUCKET_AND_ITEMS_PER_PAGE'], error_out=False)
-    else:
-        pagination = user.buckets.paginate(page=page, per_page=app.config['BUCKET_AND_ITEMS_PER_PAGE'],
-                                           error_out=False)
+    query = user_buckets_query(user_id, q, ranked=True, fields=fields)
+    values['fields'] = fields_param(fields)
+    if not q:
+        query = query.order_by(Bucket.id)
+    items, has_prev, has_next = paginate_offset(query, page, app.config['BUCKET_AND_ITEMS_PER_PAGE'])
     previous = None
-    if pagination.has_prev:
+    if has_prev:
         if q:
-            previous = url_for('bucket.bucketlist', q=q, page=page - 1, _external=True)
+            previous = url_for('bucket.bucketlist', q=q, page=page - 1, _external=True, **values)
         else:
-            previous = url_for('bucket.bucketlist', page=page - 1, _external=True)
+            previous = url_for('bucket.bucketlist', page=page - 1, _external=True, **values)
     nex = None
-    if pagination.has_next:
+    if has_next:
         if q:
-            nex = url_for('bucket.bucketlist', q=q, page=page + 1, _external=True)
+            nex = url_for('bucket.bucketlist', q=q, page=page + 1, _external=True, **values)
         else:
-            nex = url_for('bucket.bucketlist', page=page + 1, _external=True)
-    items = pagination.items
-    return items, nex, pagination, previous
+            nex = url_for('bucket.bucketlist', page=page + 1, _external=True, **values)
+    complete = len(items) if not has_prev and not has_next else None
+    count, estimated = count_total(query, total, bucket_counter(user_id, q), complete)
+    return items, nex, previous, count, estimated
+
+
+def paginate_buckets_by_cursor(user_id, cursor, q, total, fields=None, **values):
+    """
+    Get a page of the buckets of the user by seeking past the cursor on (create_at, id), so that
+    deep pages cost the same as the first one.
+    The previous and next urls carry the cursors of the neighbouring pages.
+    :param user_id: User Id
+    :param cursor: Cursor of the page, None for the first page
+    :param q: Query parameter
+    :param total: How to work out the total, one of TOTAL_MODES
+    :param fields: Bucket fields to select, None for whole Buckets
+    :param values: Other query parameters kept in the pagination urls
+    :return: The user buckets, next url, previous url, total and whether the total is an estimate
+    :raises ValueError: When the cursor is malformed
+    """
+    query = user_buckets_query(user_id, q, fields=fields)
+    values['fields'] = fields_param(fields)
+    items, next_cursor, previous_cursor = paginate_keyset(query, Bucket, cursor,
+                                                          app.config['BUCKET_AND_ITEMS_PER_PAGE'])
+    nex = None
+    if next_cursor:
+        nex = url_for('bucket.bucketlist', q=q, cursor=next_cursor, _external=True, **values)
+    previous = None
+    if previous_cursor:
+        previous = url_for('bucket.bucketlist', q=q, cursor=previous_cursor, _external=True, **values)
+    complete = len(items) if not cursor and not next_cursor else None
+    count, estimated = count_total(query, total, bucket_counter(user_id, q), complete)
+    return items, nex, previous, count, estimated
+
+
+def create_buckets(user_id, payload):
+    """
+    Create the Buckets of a json array and return their Ids in the order they were sent.
+    :param user_id: User Id
+    :param payload: List of bucket json objects
+    :return: Http Response
+    """
+    if not payload:
+        return response('failed', 'No buckets to create', 400)
+    limit = app.config['BULK_CREATE_LIMIT']
+    if len(payload) > limit:
+        return response('failed', 'At most {} buckets can be created per request'.format(limit), 413)
+    names, errors = validate_buckets_payload(payload)
+    if errors:
+        return response_with_errors('No buckets were created', errors, 400)
+    return response_for_created_buckets(Bucket.bulk_create(names, user_id), names)
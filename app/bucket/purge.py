@@ -0,0 +1,51 @@
+from app import app, db
+from app.models import Bucket
+import threading
+
+
+class BucketPurger:
+    """
+    Deletes detached buckets and their items in background threads, BUCKET_PURGE_BATCH_SIZE items per
+    transaction. A purge cut short by a restart is finished by the purge_detached_buckets command.
+    """
+
+    def __init__(self):
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def start(self, bucket_id):
+        """
+        Purge a detached bucket in a background thread.
+        :param bucket_id: Bucket Id
+        :return:
+        """
+        thread = threading.Thread(target=self._run, args=(bucket_id,), daemon=True)
+        with self._lock:
+            self._threads = [t for t in self._threads if t.is_alive()] + [thread]
+        thread.start()
+
+    def _run(self, bucket_id):
+        """
+        Purge a bucket with its own application context and database session.
+        :param bucket_id: Bucket Id
+        :return:
+        """
+        with app.app_context():
+            try:
+                Bucket.purge(bucket_id, app.config['BUCKET_PURGE_BATCH_SIZE'])
+            finally:
+                db.session.remove()
+
+    def join(self, timeout=None):
+        """
+        Wait for the running purges to finish.
+        :param timeout: Seconds to wait for each purge
+        :return:
+        """
+        with self._lock:
+            threads = list(self._threads)
+        for thread in threads:
+            thread.join(timeout)
+
+
+bucket_purger = BucketPurger()
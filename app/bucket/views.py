@@ -1,8 +1,15 @@
 from flask import Blueprint, request, abort
 from app.auth.helper import token_required
 from app.bucket.helper import response, response_for_created_bucket, response_for_user_bucket, response_with_pagination, \
-    get_user_bucket_json_list, paginate_buckets
-from app.models import User, Bucket
+    get_user_bucket_json_list, paginate_buckets, paginate_buckets_by_cursor, create_buckets
+from app import app
+from app.models import Bucket
+from app.cache import cached_response, cache_response
+from app.conditional import user_data_version, bucket_data_version, not_modified, conditional_response
+from app.fields import BUCKET_FIELDS, parse_fields, row_json
+from app.pagination import TOTAL_MODES
+from app.repository import find_user_bucket
+from app.bucket.purge import bucket_purger
 
 # Initialize blueprint
 bucket = Blueprint('bucket', __name__)
@@ -13,19 +20,54 @@ bucket = Blueprint('bucket', __name__)
 def bucketlist(current_user):
     """
     Return all the buckets owned by the user or limit them to 10.
-    Return an empty buckets object if user has no buckets
+    Return an empty buckets object if user has no buckets.
+    The total=none|exact|counter|estimate query parameter chooses how the count is worked out.
+    Passing pagination=cursor, or a cursor from a previous response, pages by cursor instead of page number.
+    include=items nests the newest items of every bucket, items_limit of them per bucket.
+    fields=id,name limits the buckets to the listed attributes and only their columns are selected.
+    A request whose If-None-Match holds the current ETag gets 304 Not Modified without the buckets being read,
+    pages already built for the current version of the user's data are served from the response cache.
     :param current_user:
     :return:
     """
-    user = User.get_by_id(current_user.id)
-    page = request.args.get('page', 1, type=int)
-    q = request.args.get('q', None, type=str)
+    version = user_data_version(current_user.id)
+    cached = cached_response(version)
+    if cached:
+        return cached
 
-    items, nex, pagination, previous = paginate_buckets(current_user.id, page, q, user)
+    q = request.args.get('q', None, type=str)
+    total = request.args.get('total', app.config['PAGINATION_TOTAL'], type=str)
+    if total not in TOTAL_MODES:
+        return response('failed', 'Invalid total, use one of ' + ', '.join(TOTAL_MODES), 400)
 
-    if items:
-        return response_with_pagination(get_user_bucket_json_list(items), previous, nex, pagination.total)
-    return response_with_pagination([], previous, nex, 0)
+    try:
+        fields = parse_fields(request.args.get('fields', None, type=str), BUCKET_FIELDS)
+    except ValueError as e:
+        return response('failed', str(e), 400)
+
+    include = request.args.get('include', None, type=str)
+    if include not in (None, 'items'):
+        return response('failed', 'Invalid include, use items', 400)
+    items_limit = None
+    if include:
+        items_limit = request.args.get('items_limit', app.config['INCLUDED_ITEMS_PER_BUCKET'], type=int)
+        if not 0 < items_limit <= app.config['INCLUDED_ITEMS_LIMIT']:
+            return response('failed', 'items_limit must be between 1 and {}'.format(
+                app.config['INCLUDED_ITEMS_LIMIT']), 400)
+
+    cursor = request.args.get('cursor', None, type=str)
+    if cursor or request.args.get('pagination') == 'cursor':
+        try:
+            items, nex, previous, count, estimated = paginate_buckets_by_cursor(
+                current_user.id, cursor, q, total, fields, include=include, items_limit=items_limit)
+        except ValueError:
+            return response('failed', 'Invalid cursor', 400)
+    else:
+        page = request.args.get('page', 1, type=int)
+        items, nex, previous, count, estimated = paginate_buckets(
+            current_user.id, page, q, total, fields, include=include, items_limit=items_limit)
+    return cache_response(response_with_pagination(get_user_bucket_json_list(items, items_limit, fields),
+                                                   previous, nex, count, estimated), version)
 
 
 @bucket.route('/bucketlists/', methods=['POST'])
@@ -33,11 +75,14 @@ def bucketlist(current_user):
 def create_bucketlist(current_user):
     """
     Create a Bucket from the sent json data.
+    A json array creates many buckets in one transaction, nothing is created if any element is invalid.
     :param current_user: Current User
     :return:
     """
     if request.content_type == 'application/json':
         data = request.get_json()
+        if isinstance(data, list):
+            return create_buckets(current_user.id, data)
         name = data.get('name')
         if name:
             user_bucket = Bucket(name.lower(), current_user.id)
@@ -52,6 +97,8 @@ def create_bucketlist(current_user):
 def get_bucket(current_user, bucket_id):
     """
     Return a user bucket with the supplied user Id.
+    The fields query parameter limits the bucket to the listed attributes.
+    The response carries an ETag and a request whose If-None-Match holds it gets 304 Not Modified.
     :param current_user: User
     :param bucket_id: Bucket Id
     :return:
@@ -60,11 +107,19 @@ def get_bucket(current_user, bucket_id):
         int(bucket_id)
     except ValueError:
         return response('failed', 'Please provide a valid Bucket Id', 400)
-    else:
-        user_bucket = User.get_by_id(current_user.id).buckets.filter_by(id=bucket_id).first()
-        if user_bucket:
-            return response_for_user_bucket(user_bucket.json())
+    try:
+        fields = parse_fields(request.args.get('fields', None, type=str), BUCKET_FIELDS)
+    except ValueError as e:
+        return response('failed', str(e), 400)
+    user_bucket = find_user_bucket(current_user.id, bucket_id, fields)
+    if not user_bucket:
         return response('failed', "Bucket not found", 404)
+    version = bucket_data_version(user_bucket)
+    unchanged = not_modified(version)
+    if unchanged:
+        return unchanged
+    return conditional_response(response_for_user_bucket(
+        user_bucket.json() if fields is None else row_json(user_bucket, fields, BUCKET_FIELDS)), version)
 
 
 @bucket.route('/bucketlists/<bucket_id>', methods=['PUT'])
@@ -85,7 +140,7 @@ def edit_bucket(current_user, bucket_id):
                 int(bucket_id)
             except ValueError:
                 return response('failed', 'Please provide a valid Bucket Id', 400)
-            user_bucket = User.get_by_id(current_user.id).buckets.filter_by(id=bucket_id).first()
+            user_bucket = find_user_bucket(current_user.id, bucket_id)
             if user_bucket:
                 user_bucket.update(name)
                 return response_for_created_bucket(user_bucket, 201)
@@ -99,6 +154,8 @@ def edit_bucket(current_user, bucket_id):
 def delete_bucket(current_user, bucket_id):
     """
     Deleting a User Bucket from the database if it exists.
+    Buckets with more than BUCKET_PURGE_THRESHOLD items are taken away from the user at once
+    and purged in the background.
     :param current_user:
     :param bucket_id:
     :return:
@@ -107,9 +164,13 @@ def delete_bucket(current_user, bucket_id):
         int(bucket_id)
     except ValueError:
         return response('failed', 'Please provide a valid Bucket Id', 400)
-    user_bucket = User.get_by_id(current_user.id).buckets.filter_by(id=bucket_id).first()
+    user_bucket = find_user_bucket(current_user.id, bucket_id)
     if not user_bucket:
         abort(404)
+    if user_bucket.item_count > app.config['BUCKET_PURGE_THRESHOLD']:
+        user_bucket.detach()
+        bucket_purger.start(int(bucket_id))
+        return response('success', 'Bucket is being deleted', 202)
     user_bucket.delete()
     return response('success', 'Bucket Deleted successfully', 200)
 
@@ -1,7 +1,10 @@
 from flask import jsonify, make_response, request, url_for
 from app import app
 from functools import wraps
-from app.models import User, BucketItem
+from app.models import Bucket, BucketItem
+from app.fields import ITEM_FIELDS, fields_param, project, row_json
+from app.pagination import paginate_offset, paginate_keyset, count_total
+from app.search import search_items, highlight
 
 
 def bucket_required(f):
@@ -37,27 +40,41 @@ def response(status, message, status_code):
     })), status_code
 
 
-def response_with_bucket_item(status, item, status_code):
+def response_with_bucket_item(status, item, status_code, fields=None):
     """
     Http response for response with a bucket item.
     :param status: Status Message
-    :param item: BucketItem
+    :param item: BucketItem, or row of the fields when fields is set
     :param status_code: Http Status Code
+    :param fields: Item fields to output, None for all of them
     :return:
     """
     return make_response(jsonify({
         'status': status,
-        'item': item.json()
+        'item': item.json() if fields is None else row_json(item, fields, ITEM_FIELDS)
     })), status_code
 
 
-def response_with_pagination(items, previous, nex, count):
+def get_item_json_list(items, fields=None):
+    """
+    Make json objects of the items and add them to a list.
+    :param items: BucketItem, or rows of the fields when fields is set
+    :param fields: Item fields to output, None for all of them
+    :return:
+    """
+    if fields is None:
+        return [item.json() for item in items]
+    return [row_json(item, fields, ITEM_FIELDS) for item in items]
+
+
+def response_with_pagination(items, previous, nex, count, estimated=False):
     """
     Get the Bucket items with the result paginated
     :param items: Items within the Bucket
     :param previous: Url to previous page if it exists
     :param nex: Url to next page if it exists
-    :param count: Pagination total
+    :param count: Pagination total, None when it was left out
+    :param estimated: Whether the total is an estimate
     :return: Http Json response
     """
     return make_response(jsonify({
@@ -65,22 +82,39 @@ def response_with_pagination(items, previous, nex, count):
         'previous': previous,
         'next': nex,
         'count': count,
+        'countEstimated': estimated,
         'items': items
     })), 200
 
 
-def get_user_bucket(current_user, bucket_id):
+def bucket_items_query(bucket_id, q, fields=None):
     """
-    Query the user to find and return the bucket specified by the bucket Id
+    Query the items of the bucket, limited to the names matching the query parameter if it is set.
     :param bucket_id: Bucket Id
-    :param current_user: User
+    :param q: Query parameter
+    :param fields: Item fields to select, None for whole BucketItems
+    :return: Query
+    """
+    query = project(BucketItem.query.filter_by(bucket_id=bucket_id), fields, ITEM_FIELDS)
+    if q:
+        query = query.filter(BucketItem.name.like("%" + q.lower().strip() + "%"))
+    return query
+
+
+def item_counter(bucket, q):
+    """
+    Return a callable reading the maintained item count of the bucket, or None when a search
+    query makes the counter useless.
+    :param bucket: Bucket
+    :param q: Query parameter
     :return:
     """
-    user_bucket = User.get_by_id(current_user.id).buckets.filter_by(id=bucket_id).first()
-    return user_bucket
+    if q:
+        return None
+    return lambda: bucket.item_count
 
 
-def get_paginated_items(bucket, bucket_id, page, q):
+def get_paginated_items(bucket, bucket_id, page, q, total, fields=None):
     """
     Get the items from the bucket and then paginate the results.
     Items can also be search when the query parameter is set.
@@ -89,28 +123,156 @@ def get_paginated_items(bucket, bucket_id, page, q):
     :param bucket: Bucket
     :param bucket_id: Bucket Id
     :param page: Page number
-    :return:
+    :param total: How to work out the total, one of TOTAL_MODES
+    :param fields: Item fields to select, None for whole BucketItems
+    :return: The items, next url, previous url, total and whether the total is an estimate
     """
-
-    if q:
-        pagination = BucketItem.query.filter(BucketItem.name.like("%" + q.lower().strip() + "%")) \
-            .order_by(BucketItem.create_at.desc()) \
-            .filter_by(bucket_id=bucket_id) \
-            .paginate(page=page, per_page=app.config['BUCKET_AND_ITEMS_PER_PAGE'], error_out=False)
-    else:
-        pagination = bucket.items.order_by(BucketItem.create_at.desc()).paginate(page=page, per_page=app.config[
-            'BUCKET_AND_ITEMS_PER_PAGE'], error_out=False)
+    query = bucket_items_query(bucket.id, q, fields)
+    items, has_prev, has_next = paginate_offset(query.order_by(BucketItem.create_at.desc()), page,
+                                                app.config['BUCKET_AND_ITEMS_PER_PAGE'])
 
     previous = None
-    if pagination.has_prev:
+    if has_prev:
         if q:
-            previous = url_for('items.get_items', q=q, bucket_id=bucket_id, page=page - 1, _external=True)
+            previous = url_for('items.get_items', q=q, bucket_id=bucket_id, page=page - 1,
+                               fields=fields_param(fields), _external=True)
         else:
-            previous = url_for('items.get_items', bucket_id=bucket_id, page=page - 1, _external=True)
+            previous = url_for('items.get_items', bucket_id=bucket_id, page=page - 1,
+                               fields=fields_param(fields), _external=True)
     nex = None
-    if pagination.has_next:
+    if has_next:
         if q:
-            nex = url_for('items.get_items', q=q, bucket_id=bucket_id, page=page + 1, _external=True)
+            nex = url_for('items.get_items', q=q, bucket_id=bucket_id, page=page + 1,
+                          fields=fields_param(fields), _external=True)
+        else:
+            nex = url_for('items.get_items', bucket_id=bucket_id, page=page + 1,
+                          fields=fields_param(fields), _external=True)
+    complete = len(items) if not has_prev and not has_next else None
+    count, estimated = count_total(query, total, item_counter(bucket, q), complete)
+    return items, nex, previous, count, estimated
+
+
+def get_items_by_cursor(bucket, cursor, q, total, fields=None):
+    """
+    Get a page of the items in the bucket, newest first, by seeking past the cursor on (create_at, id).
+    The previous and next urls carry the cursors of the neighbouring pages.
+    :param bucket: Bucket
+    :param cursor: Cursor of the page, None for the first page
+    :param q: Query parameter
+    :param total: How to work out the total, one of TOTAL_MODES
+    :param fields: Item fields to select, None for whole BucketItems
+    :return: The items, next url, previous url, total and whether the total is an estimate
+    :raises ValueError: When the cursor is malformed
+    """
+    query = bucket_items_query(bucket.id, q, fields)
+    items, next_cursor, previous_cursor = paginate_keyset(query, BucketItem, cursor,
+                                                          app.config['BUCKET_AND_ITEMS_PER_PAGE'], descending=True)
+    nex = url_for('items.get_items', bucket_id=bucket.id, q=q, cursor=next_cursor,
+                  fields=fields_param(fields), _external=True) if next_cursor else None
+    previous = url_for('items.get_items', bucket_id=bucket.id, q=q, cursor=previous_cursor,
+                       fields=fields_param(fields), _external=True) if previous_cursor else None
+    complete = len(items) if not cursor and not next_cursor else None
+    count, estimated = count_total(query, total, item_counter(bucket, q), complete)
+    return items, nex, previous, count, estimated
+
+
+def user_items_query(user_id):
+    """
+    Query the items in all the buckets of the user.
+    :param user_id: User Id
+    :return: Query
+    """
+    return BucketItem.query.join(Bucket, Bucket.id == BucketItem.bucket_id).filter(Bucket.user_id == user_id)
+
+
+def search_paginated_items(query, terms, page, total, endpoint, fields=None, **values):
+    """
+    Run a full-text search over the items of the query and paginate the ranked results.
+    Every item in the results carries a snippet of its matching text.
+    :param query: BucketItem query to search
+    :param terms: Search terms
+    :param page: Page number
+    :param total: How to work out the total, one of TOTAL_MODES
+    :param endpoint: Endpoint of the previous and next urls
+    :param fields: Item fields to select, None for whole BucketItems
+    :param values: Url values of the endpoint
+    :return: The items json, next url, previous url, total and whether the total is an estimate
+    """
+    results = search_items(project(query, fields, ITEM_FIELDS), terms)
+    values['fields'] = fields_param(fields)
+    rows, has_prev, has_next = paginate_offset(results, page, app.config['BUCKET_AND_ITEMS_PER_PAGE'])
+    previous = url_for(endpoint, search=terms, page=page - 1, _external=True, **values) if has_prev else None
+    nex = url_for(endpoint, search=terms, page=page + 1, _external=True, **values) if has_next else None
+    complete = len(rows) if not has_prev and not has_next else None
+    count, estimated = count_total(results.with_entities(BucketItem.id), total, None, complete)
+    items = []
+    for row in rows:
+        item_json = row[0].json() if fields is None else row_json(row, fields, ITEM_FIELDS)
+        item_json['snippet'] = highlight(row.snippet)
+        items.append(item_json)
+    return items, nex, previous, count, estimated
+
+
+def validate_items_batch(payload):
+    """
+    Check every create and update of an items batch payload.
+    :param payload: Json object with create and update lists
+    :return: Creates as (name, description), updates as (index, item Id, name, description) and
+    a list of errors with the operation and index of the element at fault
+    """
+    creates, updates, errors = [], [], []
+    for index, element in enumerate(payload.get('create') or []):
+        name = element.get('name') if isinstance(element, dict) else None
+        if not name or not isinstance(name, str):
+            errors.append({'operation': 'create', 'index': index, 'message': 'No name or value attribute found'})
+        else:
+            creates.append((name.lower(), element.get('description', None)))
+    for index, element in enumerate(payload.get('update') or []):
+        name = element.get('name') if isinstance(element, dict) else None
+        item_id = element.get('id') if isinstance(element, dict) else None
+        if not isinstance(item_id, int) or isinstance(item_id, bool):
+            errors.append({'operation': 'update', 'index': index, 'message': 'Provide a valid item Id'})
+        elif not name or not isinstance(name, str):
+            errors.append({'operation': 'update', 'index': index, 'message': 'No name or value attribute found'})
         else:
-            nex = url_for('items.get_items', bucket_id=bucket_id, page=page + 1, _external=True)
-    return pagination.items, nex, pagination, previous
+            updates.append((index, item_id, name, element.get('description', None)))
+    return creates, updates, errors
+
+
+def write_items_batch(bucket, payload):
+    """
+    Create and update the items of a batch in one transaction after validating all of them.
+    Nothing is written if any element is invalid or updates an item that is not in the bucket.
+    :param bucket: Bucket
+    :param payload: Json object with create and update lists
+    :return: Http Response
+    """
+    if not isinstance(payload, dict) or not isinstance(payload.get('create', []), list) \
+            or not isinstance(payload.get('update', []), list):
+        return response('failed', 'Provide create and update lists', 400)
+    size = len(payload.get('create') or []) + len(payload.get('update') or [])
+    if not size:
+        return response('failed', 'No items to create or update', 400)
+    limit = app.config['BULK_ITEMS_LIMIT']
+    if size > limit:
+        return response('failed', 'At most {} items can be written per request'.format(limit), 413)
+
+    creates, updates, errors = validate_items_batch(payload)
+    if updates:
+        existing = set(item_id for item_id, in BucketItem.query.with_entities(BucketItem.id).filter(
+            BucketItem.bucket_id == bucket.id, BucketItem.id.in_([item_id for _, item_id, _, _ in updates])))
+        errors.extend({'operation': 'update', 'index': index, 'message': 'Item not found'}
+                      for index, item_id, _, _ in updates if item_id not in existing)
+    if errors:
+        return make_response(jsonify({
+            'status': 'failed',
+            'message': 'No items were written',
+            'errors': errors
+        })), 400
+
+    ids = BucketItem.bulk_write(bucket.id, creates, [update[1:] for update in updates])
+    return make_response(jsonify({
+        'status': 'success',
+        'created': [{'index': index, 'id': item_id} for index, item_id in enumerate(ids)],
+        'updated': [{'index': index, 'id': item_id} for index, item_id, _, _ in updates]
+    })), 200
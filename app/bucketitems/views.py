@@ -1,9 +1,16 @@
 from flask import Blueprint, request, abort
 from app.auth.helper import token_required
-from app.bucketitems.helper import bucket_required, response, get_user_bucket, response_with_bucket_item, \
-    response_with_pagination, get_paginated_items
+from app.bucketitems.helper import bucket_required, response, response_with_bucket_item, \
+    response_with_pagination, get_paginated_items, get_items_by_cursor, user_items_query, search_paginated_items, \
+    write_items_batch, get_item_json_list
 from sqlalchemy import exc
+from app import app
 from app.models import BucketItem
+from app.cache import cached_response, cache_response
+from app.conditional import user_data_version, bucket_data_version, not_modified, conditional_response
+from app.fields import ITEM_FIELDS, parse_fields
+from app.pagination import TOTAL_MODES
+from app.repository import find_user_bucket, find_user_bucket_item
 
 bucketitems = Blueprint('items', __name__)
 
@@ -16,27 +23,86 @@ def get_items(current_user, bucket_id):
     A user`s items belonging to a Bucket specified by the bucket_id are returned if the Bucket Id
     is valid and belongs to the user.
     An empty item list is returned if the bucket has no items.
+    Passing pagination=cursor, or a cursor from a previous response, pages by cursor instead of page number.
+    The total=none|exact|counter|estimate query parameter chooses how the count is worked out.
+    The search query parameter runs a full-text search over the item names and descriptions instead,
+    the best matches come first.
+    fields=id,name limits the items to the listed attributes and only their columns are selected.
+    A request whose If-None-Match holds the current ETag gets 304 Not Modified without the items being read,
+    pages already built for the current version of the bucket are served from the response cache.
     :param current_user: User
     :param bucket_id: Bucket Id
     :return: List of Items
     """
+    try:
+        fields = parse_fields(request.args.get('fields', None, type=str), ITEM_FIELDS)
+    except ValueError as e:
+        return response('failed', str(e), 400)
+
     # Get the user Bucket
-    bucket = get_user_bucket(current_user, bucket_id)
+    bucket = find_user_bucket(current_user.id, bucket_id)
     if bucket is None:
         return response('failed', 'Bucket not found', 404)
+    version = bucket_data_version(bucket)
+    cached = cached_response(version)
+    if cached:
+        return cached
 
     # Get items in the bucket
-    page = request.args.get('page', 1, type=int)
     q = request.args.get('q', None, type=str)
-    items, nex, pagination, previous = get_paginated_items(bucket, bucket_id, page, q)
+    total = request.args.get('total', app.config['PAGINATION_TOTAL'], type=str)
+    if total not in TOTAL_MODES:
+        return response('failed', 'Invalid total, use one of ' + ', '.join(TOTAL_MODES), 400)
+
+    search = request.args.get('search', None, type=str)
+    if search:
+        page = request.args.get('page', 1, type=int)
+        return cache_response(response_with_pagination(*search_paginated_items(
+            bucket.items, search, page, total, 'items.get_items', fields, bucket_id=bucket_id)), version)
+
+    cursor = request.args.get('cursor', None, type=str)
+    if cursor or request.args.get('pagination') == 'cursor':
+        try:
+            items, nex, previous, count, estimated = get_items_by_cursor(bucket, cursor, q, total, fields)
+        except ValueError:
+            return response('failed', 'Invalid cursor', 400)
+    else:
+        page = request.args.get('page', 1, type=int)
+        items, nex, previous, count, estimated = get_paginated_items(bucket, bucket_id, page, q, total, fields)
+    return cache_response(response_with_pagination(get_item_json_list(items, fields), previous, nex, count,
+                                                   estimated), version)
+
+
+@bucketitems.route('/items/search', methods=['GET'])
+@token_required
+def search_user_items(current_user):
+    """
+    Full-text search over the names and descriptions of the items in all the user`s Buckets.
+    The best matches come first and every item carries a snippet of its matching text.
+    The fields query parameter limits the items to the listed attributes.
+    A request whose If-None-Match holds the current ETag gets 304 Not Modified without the search being run,
+    results already built for the current version of the user's data are served from the response cache.
+    :param current_user: User
+    :return: List of Items
+    """
+    search = request.args.get('search', None, type=str)
+    if not search:
+        return response('failed', 'Provide the search terms', 400)
+    version = user_data_version(current_user.id)
+    cached = cached_response(version)
+    if cached:
+        return cached
+    try:
+        fields = parse_fields(request.args.get('fields', None, type=str), ITEM_FIELDS)
+    except ValueError as e:
+        return response('failed', str(e), 400)
+    total = request.args.get('total', app.config['PAGINATION_TOTAL'], type=str)
+    if total not in TOTAL_MODES:
+        return response('failed', 'Invalid total, use one of ' + ', '.join(TOTAL_MODES), 400)
 
-    # Make a list of items
-    if items:
-        result = []
-        for item in items:
-            result.append(item.json())
-        return response_with_pagination(result, previous, nex, pagination.total)
-    return response_with_pagination([], previous, nex, 0)
+    page = request.args.get('page', 1, type=int)
+    return cache_response(response_with_pagination(*search_paginated_items(
+        user_items_query(current_user.id), search, page, total, 'items.search_user_items', fields)), version)
 
 
 @bucketitems.route('/bucketlists/<bucket_id>/items/<item_id>/', methods=['GET'])
@@ -46,6 +112,8 @@ def get_item(current_user, bucket_id, item_id):
     """
     An item can be returned from the Bucket if the item and Bucket exist and below to the user.
     The Bucket and Item Ids must be valid.
+    The fields query parameter limits the item to the listed attributes.
+    The response carries an ETag and a request whose If-None-Match holds it gets 304 Not Modified.
     :param current_user: User
     :param bucket_id: Bucket Id
     :param item_id: Item Id
@@ -56,17 +124,22 @@ def get_item(current_user, bucket_id, item_id):
         int(item_id)
     except ValueError:
         return response('failed', 'Provide a valid item Id', 202)
+    try:
+        fields = parse_fields(request.args.get('fields', None, type=str), ITEM_FIELDS)
+    except ValueError as e:
+        return response('failed', str(e), 400)
 
-    # Get the user Bucket
-    bucket = get_user_bucket(current_user, bucket_id)
+    # Get the item and the user Bucket holding it
+    bucket, item = find_user_bucket_item(current_user.id, bucket_id, item_id, fields)
     if bucket is None:
         return response('failed', 'User has no Bucket with Id ' + bucket_id, 404)
-
-    # Delete the item from the bucket
-    item = bucket.items.filter_by(id=item_id).first()
     if not item:
         abort(404)
-    return response_with_bucket_item('success', item, 200)
+    version = bucket_data_version(bucket)
+    unchanged = not_modified(version)
+    if unchanged:
+        return unchanged
+    return conditional_response(response_with_bucket_item('success', item, 200, fields), version)
 
 
 @bucketitems.route('/bucketlists/<bucket_id>/items/', methods=['POST'])
@@ -88,7 +161,7 @@ def post(current_user, bucket_id):
         return response('failed', 'No name or value attribute found', 401)
 
     # Get the user Bucket
-    bucket = get_user_bucket(current_user, bucket_id)
+    bucket = find_user_bucket(current_user.id, bucket_id)
     if bucket is None:
         return response('failed', 'User has no Bucket with Id ' + bucket_id, 202)
 
@@ -98,6 +171,27 @@ def post(current_user, bucket_id):
     return response_with_bucket_item('success', item, 200)
 
 
+@bucketitems.route('/bucketlists/<bucket_id>/items/batch', methods=['POST'])
+@token_required
+@bucket_required
+def batch(current_user, bucket_id):
+    """
+    Create and update many items of a Bucket in one request. The payload holds a create list of
+    items and an update list of items with their Ids. Nothing is written if any of them is invalid.
+    :param current_user: User
+    :param bucket_id: Bucket Id
+    :return: Http Response with the Ids of the created and updated items
+    """
+    if not request.content_type == 'application/json':
+        return response('failed', 'Content-type must be application/json', 401)
+
+    # Get the user Bucket
+    bucket = find_user_bucket(current_user.id, bucket_id)
+    if bucket is None:
+        return response('failed', 'User has no Bucket with Id ' + bucket_id, 404)
+    return write_items_batch(bucket, request.get_json())
+
+
 @bucketitems.route('/bucketlists/<bucket_id>/items/<item_id>/', methods=['PUT'])
 @token_required
 @bucket_required
@@ -119,13 +213,10 @@ def edit_item(current_user, bucket_id, item_id):
     except ValueError:
         return response('failed', 'Provide a valid item Id', 202)
 
-    # Get the user Bucket
-    bucket = get_user_bucket(current_user, bucket_id)
+    # Get the item and the user Bucket holding it
+    bucket, item = find_user_bucket_item(current_user.id, bucket_id, item_id)
     if bucket is None:
         return response('failed', 'User has no Bucket with Id ' + bucket_id, 202)
-
-    # Get the item
-    item = bucket.items.filter_by(id=item_id).first()
     if not item:
         abort(404)
 
@@ -162,13 +253,12 @@ def delete(current_user, bucket_id, item_id):
     except ValueError:
         return response('failed', 'Provide a valid item Id', 202)
 
-    # Get the user Bucket
-    bucket = get_user_bucket(current_user, bucket_id)
+    # Get the item and the user Bucket holding it
+    bucket, item = find_user_bucket_item(current_user.id, bucket_id, item_id)
     if bucket is None:
         return response('failed', 'User has no Bucket with Id ' + bucket_id, 202)
 
     # Delete the item from the bucket
-    item = bucket.items.filter_by(id=item_id).first()
     if not item:
         abort(404)
     item.delete()
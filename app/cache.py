@@ -0,0 +1,179 @@
+from flask import make_response, request
+from werkzeug.utils import import_string
+from app import app
+from app.conditional import not_modified, conditional_response
+from app.lru import LRUCache
+import hashlib
+import time
+
+# Prefix of the cache keys, the Redis backend only ever clears keys starting with it
+KEY_PREFIX = 'response:'
+
+
+class MemoryBackend:
+    """
+    In process LRU store of response bodies, at most RESPONSE_CACHE_SIZE of them per worker.
+    A backend shared by several workers has to provide the same get, set and clear methods.
+    """
+
+    def __init__(self):
+        self._cache = LRUCache('RESPONSE_CACHE_SIZE')
+
+    def get(self, key):
+        """
+        Return a stored body or None if it is missing or has expired.
+        :param key: Cache key
+        :return: Response body or None
+        """
+        return self._cache.get(key)
+
+    def set(self, key, body, timeout):
+        """
+        Store a body, evicting the least recently used one when the store is full.
+        :param key: Cache key
+        :param body: Response body
+        :param timeout: Seconds the body is kept
+        :return:
+        """
+        self._cache.set(key, body, time.time() + timeout)
+
+    def clear(self):
+        """
+        Remove all the entries.
+        :return:
+        """
+        self._cache.clear()
+
+
+class RedisBackend:
+    """
+    Store of response bodies shared by all the workers, kept in Redis at RESPONSE_CACHE_REDIS_URL.
+    Needs the redis package, entries expire on their own so nothing has to be deleted on writes.
+    All the keys start with KEY_PREFIX, so the database can be shared with other data.
+    """
+
+    def __init__(self):
+        import redis
+        self._client = redis.StrictRedis.from_url(app.config['RESPONSE_CACHE_REDIS_URL'])
+
+    def get(self, key):
+        """
+        Return a stored body or None if it is missing or has expired.
+        :param key: Cache key
+        :return: Response body or None
+        """
+        return self._client.get(key)
+
+    def set(self, key, body, timeout):
+        """
+        Store a body for timeout seconds.
+        :param key: Cache key
+        :param body: Response body
+        :param timeout: Seconds the body is kept
+        :return:
+        """
+        self._client.set(key, body, ex=timeout)
+
+    def clear(self, batch_size=1000):
+        """
+        Remove all the cached responses. Only the keys starting with KEY_PREFIX are scanned for with
+        SCAN MATCH, batch_size at a time, and each batch is deleted in one command.
+        :param batch_size: Number of keys scanned and deleted at a time
+        :return:
+        """
+        cursor = 0
+        while True:
+            cursor, keys = self._client.scan(cursor, match=KEY_PREFIX + '*', count=batch_size)
+            if keys:
+                self._client.delete(*keys)
+            if cursor == 0:
+                break
+
+
+class ResponseCache:
+    """
+    Cache of list responses keyed by the version of the data they show, the page size and the request url.
+    The versions are bumped in the same transaction as every write to the buckets and items, so a page
+    is never served once its data has changed and the entries of older versions simply expire or fall
+    out of the store. The backend is created from the RESPONSE_CACHE_BACKEND import path on first use.
+    """
+
+    def __init__(self):
+        self._backend = None
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            self._backend = import_string(app.config['RESPONSE_CACHE_BACKEND'])()
+        return self._backend
+
+    @staticmethod
+    def key(version):
+        """
+        Cache key of the current request for a version of the data.
+        :param version: (version key, changed at)
+        :return: Cache key
+        """
+        data = '{}:{}:{}'.format(version[0], app.config['BUCKET_AND_ITEMS_PER_PAGE'], request.url)
+        return KEY_PREFIX + hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+    def get(self, version):
+        """
+        Return the cached response of the current request for a version of the data.
+        :param version: (version key, changed at)
+        :return: Http response or None
+        """
+        if not app.config['RESPONSE_CACHE_ENABLED']:
+            return None
+        body = self.backend.get(self.key(version))
+        if body is None:
+            return None
+        return app.response_class(body, mimetype='application/json')
+
+    def set(self, version, response):
+        """
+        Cache a successful response to the current request for a version of the data.
+        :param version: (version key, changed at)
+        :param response: Http response or (response, status code)
+        :return: Http response
+        """
+        response = make_response(response)
+        if app.config['RESPONSE_CACHE_ENABLED'] and response.status_code == 200:
+            self.backend.set(self.key(version), response.get_data(), app.config['RESPONSE_CACHE_TIMEOUT'])
+        return response
+
+    def reset(self):
+        """
+        Drop the backend so that it is created again from the configuration.
+        :return:
+        """
+        self._backend = None
+
+
+response_cache = ResponseCache()
+
+
+def cached_response(version):
+    """
+    Answer a list request without running it: 304 Not Modified when the client holds the current version
+    and the cached page when it was already built for this version.
+    :param version: (version key, changed at)
+    :return: Http response or None when the page has to be built
+    """
+    unchanged = not_modified(version)
+    if unchanged:
+        return unchanged
+    cached = response_cache.get(version)
+    if cached is None:
+        return None
+    return conditional_response(cached, version)
+
+
+def cache_response(response, version):
+    """
+    Cache a freshly built list page and add the conditional request headers to it.
+    :param response: Http response or (response, status code)
+    :param version: (version key, changed at)
+    :return: Http response
+    """
+    return conditional_response(response_cache.set(version, response), version)
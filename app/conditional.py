@@ -0,0 +1,67 @@
+from flask import make_response, request, abort
+from app.repository import find_user_version
+import hashlib
+
+
+def make_etag(key):
+    """
+    Make the ETag of a response from the version key of its data and the request path with its
+    query string, since pages, searches and fields of the same data have different bodies.
+    :param key: Version key of the data
+    :return: ETag
+    """
+    return hashlib.sha1('{}:{}'.format(key, request.full_path).encode('utf-8')).hexdigest()
+
+
+def user_data_version(user_id):
+    """
+    Version of all the buckets and items of a user, read with one query on the primary key.
+    The query also tells that the user of the token still exists, the request is answered with 401 otherwise.
+    :param user_id: User Id
+    :return: (version key, changed at)
+    """
+    row = find_user_version(user_id)
+    if row is None:
+        abort(401)
+    version, changed_at = row
+    return 'user-{}-{}-{}'.format(user_id, version, changed_at), changed_at
+
+
+def bucket_data_version(bucket):
+    """
+    Version of a bucket and its items, carried by the bucket row itself.
+    The change time is part of the key so that a bucket Id reused by the database starts a new history.
+    :param bucket: Bucket, or a row with its id, version and changed_at
+    :return: (version key, changed at)
+    """
+    return 'bucket-{}-{}-{}'.format(bucket.id, bucket.version, bucket.changed_at), bucket.changed_at
+
+
+def not_modified(version):
+    """
+    Answer with 304 Not Modified when the If-None-Match header of the request holds the ETag of the
+    current version of the data. The version has to be read before the data so that a concurrent write
+    can only make the ETag older than the body, never newer.
+    :param version: (version key, changed at)
+    :return: Http response or None when the client copy is stale
+    """
+    if make_etag(version[0]) not in request.if_none_match:
+        return None
+    return conditional_response(make_response('', 304), version)
+
+
+def conditional_response(response, version):
+    """
+    Add the ETag and Last-Modified headers of the data version to a successful response.
+    :param response: Http response or (response, status code)
+    :param version: (version key, changed at)
+    :return: Http response
+    """
+    response = make_response(response)
+    if response.status_code not in (200, 304):
+        return response
+    key, changed_at = version
+    response.set_etag(make_etag(key))
+    if changed_at is not None:
+        response.last_modified = changed_at
+    return response
@@ -0,0 +1,102 @@
+from app import app, db
+from app.models import Bucket, BucketItem
+from app.pagination import encode_cursor_data, decode_cursor_data
+import json
+import zlib
+
+
+def encode_export_cursor(bucket_id, item_id):
+    """
+    Make an opaque cursor pointing after a line of the export.
+    :param bucket_id: Bucket Id of the line
+    :param item_id: Item Id of the line, 0 for the line of the bucket itself
+    :return: Cursor string
+    """
+    return encode_cursor_data({'b': bucket_id, 'i': item_id})
+
+
+def decode_export_cursor(cursor):
+    """
+    Read the position of an export cursor.
+    :param cursor: Cursor string
+    :return: (Bucket Id, Item Id)
+    :raises ValueError: When the cursor is malformed
+    """
+    data = decode_cursor_data(cursor)
+    try:
+        return int(data['b']), int(data['i'])
+    except (TypeError, KeyError) as e:
+        raise ValueError(str(e))
+
+
+def export_rows(user_id, position):
+    """
+    Query the buckets of the user with their items in export order, buckets by Id and the items of
+    each bucket by Id. Rows are fetched EXPORT_BATCH_SIZE at a time from a server-side cursor where the
+    database has one, so memory use does not grow with the size of the data.
+    :param user_id: User Id
+    :param position: (Bucket Id, Item Id) to resume after, None to start at the beginning
+    :return: Query of (Bucket, BucketItem or None) rows
+    """
+    query = db.session.query(Bucket, BucketItem) \
+        .outerjoin(BucketItem, BucketItem.bucket_id == Bucket.id) \
+        .filter(Bucket.user_id == user_id)
+    if position is not None:
+        bucket_id, item_id = position
+        query = query.filter(db.or_(Bucket.id > bucket_id, db.and_(Bucket.id == bucket_id, BucketItem.id > item_id)))
+    return query.order_by(Bucket.id, BucketItem.id).yield_per(app.config['EXPORT_BATCH_SIZE'])
+
+
+def export_line(kind, cursor, data):
+    """
+    Make a line of the export.
+    :param kind: 'bucket', 'item' or 'end'
+    :param cursor: Cursor to resume after the line, None for the last line
+    :param data: Json of the bucket or item
+    :return: NDJSON line
+    """
+    line = {'type': kind}
+    if cursor is not None:
+        line['cursor'] = cursor
+        line[kind] = data
+    return json.dumps(line, separators=(',', ':')) + '\n'
+
+
+def export_lines(user_id, position):
+    """
+    Generate the NDJSON lines of the export, every bucket before its items. Each line carries the cursor
+    resuming right after it and an 'end' line tells that the export is complete.
+    The rows are only queried once the first line is asked for, so that the query runs while the body
+    is streamed.
+    :param user_id: User Id
+    :param position: (Bucket Id, Item Id) the export resumes after, the line of that bucket was already sent
+    :return: Generator of lines
+    """
+    last_bucket_id = position[0] if position is not None else None
+    for bucket, item in export_rows(user_id, position):
+        if bucket.id != last_bucket_id:
+            last_bucket_id = bucket.id
+            yield export_line('bucket', encode_export_cursor(bucket.id, 0), bucket.json())
+        if item is not None:
+            yield export_line('item', encode_export_cursor(bucket.id, item.id), item.json())
+    yield export_line('end', None, None)
+
+
+def export_chunks(lines, compress):
+    """
+    Group the lines into chunks of EXPORT_BATCH_SIZE lines, gzip compressed when asked for.
+    Every compressed chunk is flushed so that the client can decode it as soon as it arrives.
+    :param lines: Generator of lines
+    :param compress: Whether to gzip the chunks
+    :return: Generator of bytes
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS) if compress else None
+    chunk = []
+    for line in lines:
+        chunk.append(line)
+        if len(chunk) == app.config['EXPORT_BATCH_SIZE']:
+            data = ''.join(chunk).encode('utf-8')
+            chunk = []
+            yield compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH) if compressor else data
+    data = ''.join(chunk).encode('utf-8')
+    yield compressor.compress(data) + compressor.flush() if compressor else data
@@ -0,0 +1,31 @@
+from flask import Blueprint, Response, request, stream_with_context
+from app.auth.helper import token_required, response
+from app.export.helper import decode_export_cursor, export_lines, export_chunks
+
+# Initialize blueprint
+export = Blueprint('export', __name__)
+
+
+@export.route('/export', methods=['GET'])
+@token_required
+def export_data(current_user):
+    """
+    Stream all the buckets and items of the user as NDJSON, one bucket or item per line.
+    The cursor of any line passed as the cursor query parameter resumes the export right after it.
+    The export is gzip compressed when the client accepts it.
+    :param current_user: User
+    :return: Streamed Http response
+    """
+    cursor = request.args.get('cursor', None, type=str)
+    try:
+        position = decode_export_cursor(cursor) if cursor else None
+    except ValueError:
+        return response('failed', 'Invalid cursor', 400)
+
+    compress = request.accept_encodings['gzip'] > 0
+    lines = export_lines(current_user.id, position)
+    res = Response(stream_with_context(export_chunks(lines, compress)), mimetype='application/x-ndjson')
+    res.headers['Vary'] = 'Accept-Encoding'
+    if compress:
+        res.headers['Content-Encoding'] = 'gzip'
+    return res
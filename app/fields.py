@@ -0,0 +1,89 @@
+from app.models import Bucket, BucketItem
+from collections import OrderedDict
+import datetime
+
+# Json attributes a client can ask for with the fields query parameter and the columns behind them
+BUCKET_FIELDS = OrderedDict([
+    ('id', Bucket.id),
+    ('name', Bucket.name),
+    ('createdAt', Bucket.create_at),
+    ('modifiedAt', Bucket.modified_at),
+    ('itemCount', Bucket.item_count)
+])
+ITEM_FIELDS = OrderedDict([
+    ('id', BucketItem.id),
+    ('name', BucketItem.name),
+    ('description', BucketItem.description),
+    ('bucketId', BucketItem.bucket_id),
+    ('createdAt', BucketItem.create_at),
+    ('modifiedAt', BucketItem.modified_at)
+])
+
+# Columns selected whatever the fields, cursors are made from them
+KEY_FIELDS = ('id', 'createdAt')
+
+
+def parse_fields(value, available):
+    """
+    Read the comma separated fields query parameter.
+    :param value: Query parameter
+    :param available: BUCKET_FIELDS or ITEM_FIELDS
+    :return: List of field names in the order of available, None when all the fields are wanted
+    :raises ValueError: When a field is unknown
+    """
+    if not value:
+        return None
+    requested = {field.strip() for field in value.split(',') if field.strip()}
+    if not requested or not requested.issubset(available):
+        raise ValueError('Invalid fields, use any of ' + ', '.join(available))
+    return [field for field in available if field in requested]
+
+
+def fields_param(fields):
+    """
+    Write fields back as a query parameter for the pagination urls.
+    :param fields: List of field names or None
+    :return: Query parameter or None
+    """
+    return ','.join(fields) if fields else None
+
+
+def projection(fields, available):
+    """
+    Columns to select for the fields, labelled with the model attribute names so that rows can be
+    read like model instances.
+    :param fields: List of field names
+    :param available: BUCKET_FIELDS or ITEM_FIELDS
+    :return: List of labelled columns
+    """
+    return [column.label(column.key) for field, column in available.items()
+            if field in fields or field in KEY_FIELDS]
+
+
+def project(query, fields, available):
+    """
+    Select only the columns of the fields instead of whole model instances. The query then returns
+    plain rows and no ORM objects are built.
+    :param query: Bucket or BucketItem query
+    :param fields: List of field names, None to leave the query as it is
+    :param available: BUCKET_FIELDS or ITEM_FIELDS
+    :return: Query
+    """
+    if fields is None:
+        return query
+    return query.with_entities(*projection(fields, available))
+
+
+def row_json(row, fields, available):
+    """
+    Json representation of the requested fields of a projected row.
+    :param row: Row selected with projection()
+    :param fields: List of field names
+    :param available: BUCKET_FIELDS or ITEM_FIELDS
+    :return:
+    """
+    result = {}
+    for field in fields:
+        value = getattr(row, available[field].key)
+        result[field] = value.isoformat() if isinstance(value, datetime.datetime) else value
+    return result
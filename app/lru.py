@@ -0,0 +1,78 @@
+from app import app
+from collections import OrderedDict
+import threading
+import time
+
+
+class LRUCache:
+    """
+    Bounded in process LRU cache whose entries expire at a time given when they are stored.
+    The bound is read from the size_setting configuration value every time an entry is stored,
+    the least recently used entries are evicted beyond it and nothing is stored when it is 0.
+    """
+
+    def __init__(self, size_setting):
+        self.size_setting = size_setting
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """
+        Return a stored value or default if it is missing or has expired.
+        :param key: Cache key
+        :param default: Value returned on a miss
+        :return: Value or default
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] <= time.time():
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value, expires_at):
+        """
+        Store a value, evicting the least recently used entries when the cache is full.
+        :param key: Cache key
+        :param value: Value
+        :param expires_at: Time in seconds at which the entry stops being valid
+        :return:
+        """
+        max_size = app.config.get(self.size_setting, 0)
+        if max_size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > max_size:
+                self._entries.popitem(last=False)
+
+    def pop(self, key):
+        """
+        Drop an entry.
+        :param key: Cache key
+        :return:
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        """
+        Remove all the entries and reset the counters.
+        :return:
+        """
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
@@ -1,6 +1,63 @@
-from app import app, db, bcrypt
+from app import app, db
+from app.auth.blacklist import blacklist_filter
+from app.auth.hashing import generate_password_hash
+from app.auth.epochs import token_epochs
+from app.auth.keys import get_signing_key, get_verification_key
+from sqlalchemy import event
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.engine import Engine
 import datetime
+import hashlib
 import jwt
+import sqlite3
+import uuid
+
+
+@event.listens_for(Engine, 'connect')
+def enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+    """
+    SQLite only enforces foreign keys, and so runs the ON DELETE cascades, when every connection asks for it.
+    :param dbapi_connection: DBAPI connection
+    :param connection_record:
+    :return:
+    """
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA foreign_keys=ON')
+        cursor.close()
+
+
+def item_search_vector(name, description):
+    """
+    Expression computing the full-text search vector of an item on PostgreSQL.
+    Other databases keep their own full-text index up to date and store no vector.
+    :param name: Item name
+    :param description: Item description
+    :return: SQL expression or None
+    """
+    if db.engine.dialect.name != 'postgresql':
+        return None
+    return db.func.to_tsvector(app.config['SEARCH_LANGUAGE'], db.func.concat_ws(' ', name, description))
+
+
+def find_counter_drift(model, counter, child_key, batch_size):
+    """
+    Find the rows whose counter differs from a count of their child rows, a range of Ids at a time
+    so that no statement counts the whole child table at once.
+    :param model: Parent model
+    :param counter: Counter column of the parent
+    :param child_key: Child column referencing the parent
+    :param batch_size: Parent rows checked per statement
+    :return: List of (Id, stored count, actual count)
+    """
+    actual = db.select([db.func.count()]).where(child_key == model.id).as_scalar()
+    last_id = db.session.query(db.func.max(model.id)).scalar() or 0
+    drift = []
+    for low in range(0, last_id, batch_size):
+        drift.extend(tuple(row) for row in db.session.query(model.id, counter, actual)
+                     .filter(model.id > low, model.id <= low + batch_size, counter != actual)
+                     .order_by(model.id))
+    return drift
 
 
 class User(db.Model):
@@ -13,13 +70,19 @@ class User(db.Model):
     email = db.Column(db.String(255), unique=True, nullable=False)
     password = db.Column(db.String(255), nullable=False)
     registered_on = db.Column(db.DateTime, nullable=False)
+    token_epoch = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    bucket_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # Bumped by every write to the buckets of the user or their items
+    version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    changed_at = db.Column(db.DateTime, nullable=True)
     buckets = db.relationship('Bucket', backref='bucket', lazy='dynamic')
 
     def __init__(self, email, password):
         self.email = email
-        self.password = bcrypt.generate_password_hash(password, app.config.get('BCRYPT_LOG_ROUNDS')) \
-            .decode('utf-8')
+        self.password = generate_password_hash(password)
         self.registered_on = datetime.datetime.now()
+        self.token_epoch = 0
+        self.bucket_count = 0
 
     def save(self):
         """
@@ -31,24 +94,37 @@ class User(db.Model):
         db.session.commit()
         return self.encode_auth_token(self.id)
 
-    def encode_auth_token(self, user_id):
+    def encode_auth_token(self, user_id, token_type='access'):
         """
-        Encode the Auth token
+        Encode the Auth token.
+        Access tokens are short lived, refresh tokens live for AUTH_TOKEN_EXPIRY_DAYS and are
+        exchanged for new access tokens. Tokens are signed with the current key of the key ring.
+        The epoch of the user is cached so that the first requests made with the token need no query.
         :param user_id: User's Id
+        :param token_type: 'access' or 'refresh'
         :return:
         """
         try:
+            if token_type == 'refresh':
+                lifetime = datetime.timedelta(days=app.config.get('AUTH_TOKEN_EXPIRY_DAYS'),
+                                              seconds=app.config.get('AUTH_TOKEN_EXPIRY_SECONDS'))
+            else:
+                lifetime = datetime.timedelta(seconds=app.config.get('AUTH_ACCESS_TOKEN_EXPIRY_SECONDS'))
             payload = {
-                'exp': datetime.datetime.utcnow() + datetime.timedelta(days=app.config.get('AUTH_TOKEN_EXPIRY_DAYS'),
-                                                                       seconds=app.config.get(
-                                                                           'AUTH_TOKEN_EXPIRY_SECONDS')),
+                'exp': datetime.datetime.utcnow() + lifetime,
                 'iat': datetime.datetime.utcnow(),
-                'sub': user_id
+                'sub': user_id,
+                'jti': uuid.uuid4().hex,
+                'epoch': self.token_epoch,
+                'type': token_type
             }
+            token_epochs.set(user_id, self.token_epoch)
+            kid, key = get_signing_key()
             return jwt.encode(
                 payload,
-                app.config['SECRET_KEY'],
-                algorithm='HS256'
+                key,
+                algorithm='HS256',
+                headers={'kid': kid}
             )
         except Exception as e:
             return e
@@ -60,17 +136,88 @@ class User(db.Model):
         :param token: Auth Token
         :return:
         """
+        payload = User.decode_auth_token_payload(token)
+        if isinstance(payload, str):
+            return payload
+        return payload['sub']
+
+    @staticmethod
+    def decode_auth_token_payload(token, token_type=None):
+        """
+        Decode the token, make sure it has not been revoked and return its payload.
+        :param token: Auth Token
+        :param token_type: Expected token type, tokens issued before token types accept 'access'
+        :return: Token payload or an error message
+        """
         try:
-            payload = jwt.decode(token, app.config['SECRET_KEY'], algorithms='HS256')
-            is_token_blacklisted = BlackListToken.check_blacklist(token)
-            if is_token_blacklisted:
+            key = get_verification_key(jwt.get_unverified_header(token).get('kid'))
+            if key is None:
+                raise jwt.InvalidTokenError('Unknown signing key')
+            payload = jwt.decode(token, key, algorithms=['HS256'])
+            if token_type is not None and payload.get('type', 'access') != token_type:
+                raise jwt.InvalidTokenError('Wrong token type')
+            if User.is_token_revoked(token, payload):
                 return 'Token was Blacklisted, Please login In'
-            return payload['sub']
+            return payload
         except jwt.ExpiredSignatureError:
             return 'Signature expired, Please sign in again'
         except jwt.InvalidTokenError:
             return 'Invalid token. Please sign in again'
 
+    @staticmethod
+    def is_token_revoked(token, payload):
+        """
+        Check whether a verified token has been revoked.
+        Access tokens are compared with the user's epoch cached by this worker, which is read again from the
+        database after AUTH_TOKEN_EPOCH_CACHE_TTL seconds, so a revocation made on another worker applies
+        here within that time. Refresh tokens are compared with the user's epoch in the database.
+        Tokens issued before token types use the cached epoch too and tokens without an epoch the blacklist.
+        :param token: Auth Token
+        :param payload: Decoded token payload
+        :return:
+        """
+        if payload.get('type') == 'refresh':
+            return User.get_token_epoch(payload['sub']) != payload['epoch']
+        if 'epoch' in payload:
+            return not User.is_token_epoch_current(payload['sub'], payload['epoch'])
+        return BlackListToken.check_blacklist(BlackListToken.token_digest(token, payload))
+
+    @staticmethod
+    def is_token_epoch_current(user_id, epoch):
+        """
+        Check a token epoch against the user's current one, cached per worker.
+        A token newer than the cached epoch means the cache is stale and the epoch is read again.
+        :param user_id: User Id
+        :param epoch: Token 'epoch' claim
+        :return:
+        """
+        current_epoch = token_epochs.get(user_id, User.get_token_epoch)
+        if current_epoch is not None and epoch > current_epoch:
+            token_epochs.forget(user_id)
+            current_epoch = token_epochs.get(user_id, User.get_token_epoch)
+        return current_epoch == epoch
+
+    @staticmethod
+    def get_token_epoch(user_id):
+        """
+        Read the token epoch of a user from the database.
+        :param user_id: User Id
+        :return: Token epoch or None
+        """
+        return db.session.query(User.token_epoch).filter_by(id=user_id).scalar()
+
+    @staticmethod
+    def revoke_tokens(user_id):
+        """
+        Revoke every token issued to the user so far by bumping their token epoch.
+        :param user_id: User Id
+        :return:
+        """
+        User.query.filter_by(id=user_id).update({User.token_epoch: User.token_epoch + 1},
+                                                synchronize_session=False)
+        db.session.commit()
+        token_epochs.set(user_id, User.get_token_epoch(user_id))
+
     @staticmethod
     def get_by_id(user_id):
         """
@@ -89,14 +236,53 @@ class User(db.Model):
         """
         return User.query.filter_by(email=email).first()
 
+    @staticmethod
+    def hash_cost_distribution():
+        """
+        Count the users by the bcrypt cost of their password hash.
+        :return: List of (cost, number of users)
+        """
+        cost = db.func.substr(User.password, 5, 2)
+        rows = db.session.query(cost, db.func.count(User.id)).group_by(cost).order_by(cost).all()
+        return [(int(row_cost), count) for row_cost, count in rows]
+
+    @staticmethod
+    def record_change(user_id, buckets=0):
+        """
+        Bump the version of the data of a user and adjust the bucket count in the current transaction.
+        :param user_id: User Id
+        :param buckets: Change in the number of buckets
+        :return:
+        """
+        User.query.filter_by(id=user_id).update({
+            User.bucket_count: User.bucket_count + buckets,
+            User.version: User.version + 1,
+            User.changed_at: datetime.datetime.utcnow()
+        }, synchronize_session=False)
+
+    @staticmethod
+    def check_bucket_counts(batch_size, repair=False):
+        """
+        Compare the bucket count of every user with the buckets they own and optionally repair the drift.
+        Repairs adjust the counter by the difference so that concurrent writes are not lost.
+        :param batch_size: Users checked per statement
+        :param repair: Whether to fix the counts
+        :return: List of (User Id, stored count, actual count)
+        """
+        drift = find_counter_drift(User, User.bucket_count, Bucket.user_id, batch_size)
+        if repair:
+            for user_id, stored, actual in drift:
+                User.record_change(user_id, buckets=actual - stored)
+            db.session.commit()
+        return drift
+
     def reset_password(self, new_password):
         """
         Update/reset the user password.
         :param new_password: New User Password
         :return:
         """
-        self.password = bcrypt.generate_password_hash(new_password, app.config.get('BCRYPT_LOG_ROUNDS')) \
-            .decode('utf-8')
+        self.password = generate_password_hash(new_password)
         db.session.commit()
 
 
@@ -107,12 +293,14 @@ class BlackListToken(db.Model):
     __tablename__ = 'blacklist_token'
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
-    token = db.Column(db.String(255), unique=True, nullable=False)
+    digest = db.Column(db.String(64), unique=True, nullable=False)
     blacklisted_on = db.Column(db.DateTime, nullable=False)
+    expires_on = db.Column(db.DateTime, nullable=True, index=True)
 
-    def __init__(self, token):
-        self.token = token
+    def __init__(self, digest, expires_on=None):
+        self.digest = digest
         self.blacklisted_on = datetime.datetime.now()
+        self.expires_on = expires_on
 
     def blacklist(self):
         """
@@ -121,46 +309,148 @@ class BlackListToken(db.Model):
         """
         db.session.add(self)
         db.session.commit()
+        blacklist_filter.add(self.digest)
 
     @staticmethod
-    def check_blacklist(token):
+    def token_digest(token, payload):
         """
-        Check to find out whether a token has already been blacklisted.
+        Fixed size key of a token in the blacklist. It is derived from the 'jti' claim,
+        tokens issued before the claim was added fall back to the whole token.
         :param token: Authorization token
+        :param payload: Decoded token payload
+        :return: Hex digest
+        """
+        return hashlib.sha256(payload.get('jti', token).encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def check_blacklist(digest):
+        """
+        Check to find out whether a token has already been blacklisted.
+        Once the blacklist filter is loaded the database is only queried when it reports a possible match.
+        :param digest: Token digest
         :return:
         """
-        response = BlackListToken.query.filter_by(token=token).first()
+        if blacklist_filter.loaded:
+            blacklist_filter.sync(BlackListToken.get_digests_after)
+            if not blacklist_filter.might_contain(digest):
+                return False
+        response = BlackListToken.query.filter_by(digest=digest).first()
         if response:
             return True
         return False
 
+    @staticmethod
+    def get_digests_after(last_id):
+        """
+        Stream the (id, digest) pairs of the rows added after the row with the given Id.
+        :param last_id: Last Id seen
+        :return:
+        """
+        return db.session.query(BlackListToken.id, BlackListToken.digest) \
+            .filter(BlackListToken.id > last_id) \
+            .order_by(BlackListToken.id) \
+            .yield_per(1000)
+
+    @staticmethod
+    def delete_expired(batch_size):
+        """
+        Delete the blacklisted tokens whose expiry has passed, committing after every batch
+        so that no lock is held for long. Rows without an expiry are removed once they are older
+        than the longest lifetime of a token.
+        :param batch_size: Number of rows deleted per transaction
+        :return: Number of rows removed
+        """
+        token_lifetime = datetime.timedelta(days=app.config.get('AUTH_TOKEN_EXPIRY_DAYS'),
+                                            seconds=app.config.get('AUTH_TOKEN_EXPIRY_SECONDS'))
+        expired = db.or_(
+            BlackListToken.expires_on < datetime.datetime.utcnow(),
+            db.and_(BlackListToken.expires_on.is_(None),
+                    BlackListToken.blacklisted_on < datetime.datetime.now() - token_lifetime)
+        )
+        removed = 0
+        while True:
+            ids = [row.id for row in db.session.query(BlackListToken.id).filter(expired).limit(batch_size)]
+            if not ids:
+                return removed
+            BlackListToken.query.filter(BlackListToken.id.in_(ids)).delete(synchronize_session=False)
+            db.session.commit()
+            removed += len(ids)
+
+    @staticmethod
+    def index_size():
+        """
+        Size in bytes of the indexes on the blacklist table, None when the database cannot tell.
+        :return:
+        """
+        if db.engine.dialect.name != 'postgresql':
+            return None
+        return db.session.execute("SELECT pg_indexes_size('blacklist_token')").scalar()
+
 
 class Bucket(db.Model):
     """
     Class to represent the BucketList model
     """
     __tablename__ = 'buckets'
+    __table_args__ = (
+        # Ownership checks and numbered pages, cursor pages
+        db.Index('ix_buckets_user_id_id', 'user_id', 'id'),
+        db.Index('ix_buckets_user_id_create_at_id', 'user_id', 'create_at', 'id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     name = db.Column(db.String(255), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
     create_at = db.Column(db.DateTime, nullable=False)
     modified_at = db.Column(db.DateTime, nullable=False)
-    items = db.relationship('BucketItem', backref='item', lazy='dynamic')
+    item_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # Bumped by every write to the bucket or its items
+    version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    changed_at = db.Column(db.DateTime, nullable=True)
+    items = db.relationship('BucketItem', backref='item', lazy='dynamic', passive_deletes=True)
 
     def __init__(self, name, user_id):
         self.name = name
         self.user_id = user_id
         self.create_at = datetime.datetime.utcnow()
         self.modified_at = datetime.datetime.utcnow()
+        self.item_count = 0
+        self.version = 0
+        self.changed_at = self.modified_at
 
     def save(self):
         """
-        Persist a bucket in the database
+        Persist a bucket in the database and count it against its owner in the same transaction
         :return:
         """
         db.session.add(self)
+        User.record_change(self.user_id, buckets=1)
+        db.session.commit()
+
+    @staticmethod
+    def bulk_create(names, user_id):
+        """
+        Persist many buckets of a user in one transaction and count them against the user.
+        PostgreSQL inserts them with one multi-row statement returning their ids, other databases
+        insert them one at a time within the transaction.
+        :param names: Bucket names
+        :param user_id: User Id
+        :return: Ids of the buckets in the order of the names
+        """
+        if db.engine.dialect.name == 'postgresql':
+            now = datetime.datetime.utcnow()
+            rows = [{'name': name, 'user_id': user_id, 'create_at': now, 'modified_at': now, 'item_count': 0,
+                     'version': 0, 'changed_at': now} for name in names]
+            ids = [row[0] for row in db.session.execute(
+                Bucket.__table__.insert().values(rows).returning(Bucket.__table__.c.id))]
+        else:
+            buckets = [Bucket(name, user_id) for name in names]
+            db.session.add_all(buckets)
+            db.session.flush()
+            ids = [bucket.id for bucket in buckets]
+        User.record_change(user_id, buckets=len(ids))
         db.session.commit()
+        return ids
 
     def update(self, name):
         """
@@ -169,27 +459,112 @@ class Bucket(db.Model):
         :return:
         """
         self.name = name
+        self.modified_at = datetime.datetime.utcnow()
+        self.version = Bucket.version + 1
+        self.changed_at = self.modified_at
+        User.record_change(self.user_id)
         db.session.commit()
 
     def delete(self):
         """
-        Delete a Bucket from the database
+        Delete a Bucket from the database, its items are removed by the ON DELETE CASCADE of their foreign key
+        without being loaded
         :return:
         """
         db.session.delete(self)
+        User.record_change(self.user_id, buckets=-1)
         db.session.commit()
 
-    def json(self):
+    def detach(self):
+        """
+        Take the Bucket away from its owner so that it can be purged in the background.
+        :return:
+        """
+        User.record_change(self.user_id, buckets=-1)
+        self.user_id = None
+        db.session.commit()
+
+    @staticmethod
+    def purge(bucket_id, batch_size):
+        """
+        Delete a Bucket and its items, batch_size items per transaction so that no transaction holds
+        its locks for long however large the bucket is.
+        :param bucket_id: Bucket Id
+        :param batch_size: Items deleted per transaction
+        :return: Number of items deleted
+        """
+        removed = 0
+        while True:
+            batch = db.select([BucketItem.id]).where(BucketItem.bucket_id == bucket_id).limit(batch_size)
+            deleted = BucketItem.query.filter(BucketItem.id.in_(batch)).delete(synchronize_session=False)
+            db.session.commit()
+            removed += deleted
+            if deleted < batch_size:
+                break
+        Bucket.query.filter_by(id=bucket_id).delete(synchronize_session=False)
+        db.session.commit()
+        return removed
+
+    @staticmethod
+    def record_change(bucket_id, items=0):
+        """
+        Bump the versions of a bucket and of its owner's data and adjust the item count in the current transaction.
+        :param bucket_id: Bucket Id
+        :param items: Change in the number of items
+        :return:
+        """
+        now = datetime.datetime.utcnow()
+        Bucket.query.filter_by(id=bucket_id).update({
+            Bucket.item_count: Bucket.item_count + items,
+            Bucket.version: Bucket.version + 1,
+            Bucket.changed_at: now
+        }, synchronize_session=False)
+        owner = db.select([Bucket.user_id]).where(Bucket.id == bucket_id).as_scalar()
+        User.query.filter(User.id == owner).update({
+            User.version: User.version + 1,
+            User.changed_at: now
+        }, synchronize_session=False)
+
+    @staticmethod
+    def check_item_counts(batch_size, repair=False):
+        """
+        Compare the item count of every bucket with its items and optionally repair the drift.
+        Repairs adjust the counter by the difference so that concurrent writes are not lost.
+        :param batch_size: Buckets checked per statement
+        :param repair: Whether to fix the counts
+        :return: List of (Bucket Id, stored count, actual count)
+        """
+        drift = find_counter_drift(Bucket, Bucket.item_count, BucketItem.bucket_id, batch_size)
+        if repair:
+            for bucket_id, stored, actual in drift:
+                Bucket.record_change(bucket_id, items=actual - stored)
+            db.session.commit()
+        return drift
+
+    @staticmethod
+    def get_detached_ids():
+        """
+        Ids of the Buckets detached from their owners whose purge has not finished.
+        :return: List of Bucket Ids
+        """
+        return [bucket_id for bucket_id, in Bucket.query.with_entities(Bucket.id).filter(Bucket.user_id.is_(None))]
+
+    def json(self, items=None):
         """
         Json representation of the bucket model.
+        :param items: BucketItems nested under the bucket, left out when None
         :return:
         """
-        return {
+        bucket = {
             'id': self.id,
             'name': self.name,
             'createdAt': self.create_at.isoformat(),
-            'modifiedAt': self.modified_at.isoformat()
+            'modifiedAt': self.modified_at.isoformat(),
+            'itemCount': self.item_count
         }
+        if items is not None:
+            bucket['items'] = [item.json() for item in items]
+        return bucket
 
 
 class BucketItem(db.Model):
@@ -198,13 +573,18 @@ class BucketItem(db.Model):
     """
 
     __tablename__ = 'bucketitems'
+    __table_args__ = (
+        # Item listings, read backwards for the newest first order
+        db.Index('ix_bucketitems_bucket_id_create_at_id', 'bucket_id', 'create_at', 'id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     name = db.Column(db.String(255), nullable=False)
     description = db.Column(db.Text, nullable=True)
-    bucket_id = db.Column(db.Integer, db.ForeignKey('buckets.id'))
+    bucket_id = db.Column(db.Integer, db.ForeignKey('buckets.id', ondelete='CASCADE'))
     create_at = db.Column(db.DateTime, nullable=False)
     modified_at = db.Column(db.DateTime, nullable=False)
+    search_vector = db.Column(db.Text().with_variant(postgresql.TSVECTOR(), 'postgresql'), nullable=True)
 
     def __init__(self, name, description, bucket_id):
         self.name = name
@@ -215,11 +595,56 @@ class BucketItem(db.Model):
 
     def save(self):
         """
-        Persist Item into the database
+        Persist Item into the database and count it against its bucket in the same transaction
         :return:
         """
+        self.search_vector = item_search_vector(self.name, self.description)
         db.session.add(self)
+        Bucket.record_change(self.bucket_id, items=1)
+        db.session.commit()
+
+    @staticmethod
+    def bulk_write(bucket_id, creates, updates):
+        """
+        Create and update many items of a bucket in one transaction.
+        New items are inserted with one multi-row statement returning their ids on PostgreSQL and
+        one at a time elsewhere, the updates are sent as a single executemany.
+        :param bucket_id: Bucket Id
+        :param creates: List of (name, description)
+        :param updates: List of (item Id, name, description), a None description is left unchanged
+        :return: Ids of the created items in order
+        """
+        table = BucketItem.__table__
+        ids = []
+        now = datetime.datetime.utcnow()
+        if creates:
+            if db.engine.dialect.name == 'postgresql':
+                rows = [{'name': name, 'description': description, 'bucket_id': bucket_id,
+                         'create_at': now, 'modified_at': now} for name, description in creates]
+                ids = [row[0] for row in db.session.execute(table.insert().values(rows).returning(table.c.id))]
+            else:
+                items = [BucketItem(name, description, bucket_id) for name, description in creates]
+                db.session.add_all(items)
+                db.session.flush()
+                ids = [item.id for item in items]
+        if updates:
+            db.session.execute(
+                table.update()
+                .where(db.and_(table.c.id == db.bindparam('item_id'), table.c.bucket_id == bucket_id))
+                .values(name=db.bindparam('item_name'),
+                        description=db.func.coalesce(db.bindparam('item_description', type_=db.Text),
+                                                     table.c.description),
+                        modified_at=now),
+                [{'item_id': item_id, 'item_name': name, 'item_description': description}
+                 for item_id, name, description in updates])
+        search_vector = item_search_vector(table.c.name, table.c.description)
+        if search_vector is not None:
+            db.session.execute(table.update()
+                               .where(table.c.id.in_(ids + [item_id for item_id, _, _ in updates]))
+                               .values(search_vector=search_vector))
+        Bucket.record_change(bucket_id, items=len(ids))
         db.session.commit()
+        return ids
 
     def update(self, name, description=None):
         """
@@ -231,6 +656,9 @@ class BucketItem(db.Model):
         self.name = name
         if description is not None:
             self.description = description
+        self.modified_at = datetime.datetime.utcnow()
+        self.search_vector = item_search_vector(self.name, self.description)
+        Bucket.record_change(self.bucket_id)
         db.session.commit()
 
     def delete(self):
@@ -239,6 +667,7 @@ class BucketItem(db.Model):
         :return:
         """
         db.session.delete(self)
+        Bucket.record_change(self.bucket_id, items=-1)
         db.session.commit()
 
     def json(self):
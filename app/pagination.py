@@ -0,0 +1,152 @@
+from app import app, db
+import base64
+import datetime
+import json
+
+
+def encode_cursor_data(data):
+    """
+    Encode json data as an opaque url safe cursor.
+    :param data: Json serialisable data
+    :return: Cursor string
+    """
+    return base64.urlsafe_b64encode(json.dumps(data).encode('utf-8')).decode('utf-8').rstrip('=')
+
+
+def decode_cursor_data(cursor):
+    """
+    Read the json data of a cursor made with encode_cursor_data.
+    :param cursor: Cursor string
+    :return: Json data
+    :raises ValueError: When the cursor is malformed
+    """
+    try:
+        return json.loads(base64.urlsafe_b64decode((cursor + '=' * (-len(cursor) % 4)).encode('utf-8')).decode('utf-8'))
+    except (TypeError, UnicodeDecodeError, base64.binascii.Error) as e:
+        raise ValueError(str(e))
+
+
+def encode_cursor(row, direction):
+    """
+    Make an opaque cursor pointing after ('next') or before ('prev') a row.
+    :param row: Bucket or BucketItem
+    :param direction: 'next' or 'prev'
+    :return: Cursor string
+    """
+    return encode_cursor_data({'k': [row.create_at.strftime('%Y-%m-%dT%H:%M:%S.%f'), row.id], 'd': direction})
+
+
+def decode_cursor(cursor):
+    """
+    Read the (create_at, id) position and direction of a cursor.
+    :param cursor: Cursor string
+    :return: ((create_at, id), direction)
+    :raises ValueError: When the cursor is malformed
+    """
+    data = decode_cursor_data(cursor)
+    try:
+        create_at = datetime.datetime.strptime(data['k'][0], '%Y-%m-%dT%H:%M:%S.%f')
+        direction = data['d']
+        if direction not in ('next', 'prev'):
+            raise ValueError('Unknown cursor direction')
+        return (create_at, int(data['k'][1])), direction
+    except (TypeError, KeyError, IndexError) as e:
+        raise ValueError(str(e))
+
+
+TOTAL_MODES = ('none', 'exact', 'counter', 'estimate')
+
+
+def paginate_offset(query, page, per_page):
+    """
+    Get a page of rows by page number. One extra row is read to tell whether a next page exists,
+    so unlike Flask-SQLAlchemy paginate() no count query is issued.
+    :param query: Query to paginate
+    :param page: Page number
+    :param per_page: Page size
+    :return: (rows, has previous page, has next page)
+    """
+    page = max(page, 1)
+    rows = query.limit(per_page + 1).offset((page - 1) * per_page).all()
+    return rows[:per_page], page > 1, len(rows) > per_page
+
+
+def estimate_count(query):
+    """
+    Ask the PostgreSQL planner how many rows the query returns, without running it.
+    :param query: Query
+    :return: Estimated row count or None when the database cannot estimate
+    """
+    if db.engine.dialect.name != 'postgresql':
+        return None
+    compiled = query.order_by(None).statement.compile(dialect=db.engine.dialect)
+    plan = db.session.connection().execute('EXPLAIN (FORMAT JSON) ' + str(compiled), compiled.params).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+def count_total(query, mode, counter=None, complete=None):
+    """
+    Work out the total for a paginated response in the way the client asked for.
+    'none' leaves it out, 'counter' reads a maintained counter, 'estimate' uses the planner
+    estimate when it is above PAGINATION_ESTIMATE_THRESHOLD and 'exact' runs a count query.
+    Modes that cannot be answered fall back to an exact count.
+    :param query: Query being paginated
+    :param mode: One of TOTAL_MODES
+    :param counter: Callable returning the maintained counter, None when no counter covers the query
+    :param complete: Number of rows when the page holds all of them, None otherwise
+    :return: (total, whether it is an estimate)
+    """
+    if mode == 'none':
+        return None, False
+    if complete is not None:
+        return complete, False
+    if mode == 'counter' and counter is not None:
+        return counter(), False
+    if mode == 'estimate':
+        estimate = estimate_count(query)
+        if estimate is not None and estimate >= app.config['PAGINATION_ESTIMATE_THRESHOLD']:
+            return estimate, True
+    return query.order_by(None).count(), False
+
+
+def paginate_keyset(query, model, cursor, per_page, descending=False):
+    """
+    Paginate a query by seeking on (create_at, id) instead of using an offset, so that
+    every page costs the same as the first one.
+    :param query: Query to paginate
+    :param model: Bucket or BucketItem
+    :param cursor: Cursor of the page, None for the first page
+    :param per_page: Page size
+    :param descending: Whether the newest rows come first
+    :return: (rows, next cursor, previous cursor)
+    :raises ValueError: When the cursor is malformed
+    """
+    position, direction = decode_cursor(cursor) if cursor else (None, 'next')
+    forward = direction == 'next'
+    ascending = forward != descending
+    key = db.tuple_(model.create_at, model.id)
+    if position is not None:
+        bound = db.tuple_(db.literal(position[0], db.DateTime), db.literal(position[1], db.Integer))
+        query = query.filter(key > bound if ascending else key < bound)
+    if ascending:
+        query = query.order_by(model.create_at.asc(), model.id.asc())
+    else:
+        query = query.order_by(model.create_at.desc(), model.id.desc())
+
+    rows = query.limit(per_page + 1).all()
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if not forward:
+        rows.reverse()
+
+    next_cursor = previous_cursor = None
+    if rows:
+        has_next = has_more if forward else True
+        has_previous = position is not None if forward else has_more
+        if has_next:
+            next_cursor = encode_cursor(rows[-1], 'next')
+        if has_previous:
+            previous_cursor = encode_cursor(rows[0], 'prev')
+    return rows, next_cursor, previous_cursor
@@ -0,0 +1,79 @@
+from app import db
+from app.fields import BUCKET_FIELDS, ITEM_FIELDS, projection
+from app.models import User, Bucket, BucketItem
+
+
+def find_user_bucket(user_id, bucket_id, fields=None):
+    """
+    Find a bucket owned by the user in one query.
+    :param user_id: User Id
+    :param bucket_id: Bucket Id
+    :param fields: Bucket fields to select, None for the whole Bucket
+    :return: Bucket, row of the fields and the version of the bucket or None
+    """
+    query = Bucket.query.filter_by(id=bucket_id, user_id=user_id)
+    if fields is not None:
+        query = query.with_entities(*projection(fields, BUCKET_FIELDS), Bucket.version, Bucket.changed_at)
+    return query.first()
+
+
+def find_user_version(user_id):
+    """
+    Read the version of the data of a user in one query.
+    :param user_id: User Id
+    :return: (version, changed at) or None if the user does not exist
+    """
+    return User.query.with_entities(User.version, User.changed_at).filter_by(id=user_id).first()
+
+
+def find_user_bucket_item(user_id, bucket_id, item_id, fields=None):
+    """
+    Find item X in bucket Y owned by user Z in one query.
+    The item is outer joined to the bucket so a missing bucket can be told apart from a missing item.
+    :param user_id: User Id
+    :param bucket_id: Bucket Id
+    :param item_id: Item Id
+    :param fields: Item fields to select, None for the whole BucketItem
+    :return: (Bucket, BucketItem or row of the fields), the bucket is None when the user has no such bucket and
+    the item is None when the bucket has no such item
+    """
+    if fields is not None:
+        row = db.session.query(Bucket, *projection(fields, ITEM_FIELDS)) \
+            .outerjoin(BucketItem, db.and_(BucketItem.bucket_id == Bucket.id, BucketItem.id == item_id)) \
+            .filter(Bucket.id == bucket_id, Bucket.user_id == user_id) \
+            .first()
+        if row is None:
+            return None, None
+        return row[0], row if row.id is not None else None
+
+    row = db.session.query(Bucket, BucketItem) \
+        .outerjoin(BucketItem, db.and_(BucketItem.bucket_id == Bucket.id, BucketItem.id == item_id)) \
+        .filter(Bucket.id == bucket_id, Bucket.user_id == user_id) \
+        .first()
+    if row is None:
+        return None, None
+    return row
+
+
+def find_latest_bucket_items(bucket_ids, limit):
+    """
+    Find the newest items of many buckets in one query. A row_number() window over each bucket,
+    in the order of the item listing, keeps the first limit items of every bucket.
+    :param bucket_ids: Bucket Ids
+    :param limit: Items kept per bucket
+    :return: Dictionary of Bucket Id to its list of BucketItems, newest first
+    """
+    items = {bucket_id: [] for bucket_id in bucket_ids}
+    if not items:
+        return items
+    position = db.func.row_number().over(partition_by=BucketItem.bucket_id,
+                                         order_by=(BucketItem.create_at.desc(), BucketItem.id.desc()))
+    ranked = db.session.query(BucketItem.id.label('id'), position.label('position')) \
+        .filter(BucketItem.bucket_id.in_(list(items))) \
+        .subquery('ranked_items')
+    query = BucketItem.query.join(ranked, ranked.c.id == BucketItem.id) \
+        .filter(ranked.c.position <= limit) \
+        .order_by(BucketItem.bucket_id, ranked.c.position)
+    for item in query:
+        items[item.bucket_id].append(item)
+    return items
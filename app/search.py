@@ -0,0 +1,147 @@
+from app import app, db
+from app.models import Bucket, BucketItem
+from sqlalchemy import DDL, event
+import html
+import re
+
+# Terms shorter than a trigram cannot use the search indexes and keep the plain substring scan
+MIN_INDEXED_TERM_LENGTH = 3
+
+# Control characters the database wraps around the matches of a snippet, replaced by <b> tags once the text is escaped
+MATCH_START = '\x02'
+MATCH_STOP = '\x03'
+
+# PostgreSQL: a trigram GIN index answers the substring match and similarity() ranks the results.
+event.listen(Bucket.__table__, 'before_create',
+             DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm').execute_if(dialect='postgresql'))
+event.listen(Bucket.__table__, 'after_create',
+             DDL('CREATE INDEX ix_buckets_name_trgm ON buckets USING gin (name gin_trgm_ops)')
+             .execute_if(dialect='postgresql'))
+
+# SQLite: an FTS5 trigram table (SQLite 3.34 or later) over the bucket names, kept in step by triggers.
+for statement in (
+        "CREATE VIRTUAL TABLE buckets_fts USING fts5(name, content='buckets', content_rowid='id', tokenize='trigram')",
+        "CREATE TRIGGER buckets_fts_insert AFTER INSERT ON buckets BEGIN "
+        "INSERT INTO buckets_fts(rowid, name) VALUES (new.id, new.name); END",
+        "CREATE TRIGGER buckets_fts_delete AFTER DELETE ON buckets BEGIN "
+        "INSERT INTO buckets_fts(buckets_fts, rowid, name) VALUES ('delete', old.id, old.name); END",
+        "CREATE TRIGGER buckets_fts_update AFTER UPDATE OF name ON buckets BEGIN "
+        "INSERT INTO buckets_fts(buckets_fts, rowid, name) VALUES ('delete', old.id, old.name); "
+        "INSERT INTO buckets_fts(rowid, name) VALUES (new.id, new.name); END"):
+    event.listen(Bucket.__table__, 'after_create', DDL(statement).execute_if(dialect='sqlite'))
+event.listen(Bucket.__table__, 'before_drop', DDL('DROP TABLE IF EXISTS buckets_fts').execute_if(dialect='sqlite'))
+
+# PostgreSQL: the items carry a tsvector set by BucketItem.save and update, indexed with GIN.
+event.listen(BucketItem.__table__, 'after_create',
+             DDL('CREATE INDEX ix_bucketitems_search_vector ON bucketitems USING gin (search_vector)')
+             .execute_if(dialect='postgresql'))
+
+# SQLite: an FTS5 table over the item names and descriptions, kept in step by triggers.
+for statement in (
+        "CREATE VIRTUAL TABLE bucketitems_fts USING fts5(name, description, content='bucketitems', "
+        "content_rowid='id')",
+        "CREATE TRIGGER bucketitems_fts_insert AFTER INSERT ON bucketitems BEGIN "
+        "INSERT INTO bucketitems_fts(rowid, name, description) VALUES (new.id, new.name, new.description); END",
+        "CREATE TRIGGER bucketitems_fts_delete AFTER DELETE ON bucketitems BEGIN "
+        "INSERT INTO bucketitems_fts(bucketitems_fts, rowid, name, description) "
+        "VALUES ('delete', old.id, old.name, old.description); END",
+        "CREATE TRIGGER bucketitems_fts_update AFTER UPDATE OF name, description ON bucketitems BEGIN "
+        "INSERT INTO bucketitems_fts(bucketitems_fts, rowid, name, description) "
+        "VALUES ('delete', old.id, old.name, old.description); "
+        "INSERT INTO bucketitems_fts(rowid, name, description) VALUES (new.id, new.name, new.description); END"):
+    event.listen(BucketItem.__table__, 'after_create', DDL(statement).execute_if(dialect='sqlite'))
+event.listen(BucketItem.__table__, 'before_drop',
+             DDL('DROP TABLE IF EXISTS bucketitems_fts').execute_if(dialect='sqlite'))
+
+
+def search_term(q):
+    """
+    Normalise a search query the way bucket names are stored.
+    :param q: Query parameter
+    :return: Search term
+    """
+    return q.lower().strip()
+
+
+def search_buckets(query, q, ranked=True):
+    """
+    Limit a bucket query to the names containing the search term, through the trigram index of the database.
+    :param query: Bucket query
+    :param q: Query parameter
+    :param ranked: Order the results by similarity to the term, the most similar first
+    :return: Query
+    """
+    term = search_term(q)
+    dialect = db.engine.dialect.name
+    if len(term) < MIN_INDEXED_TERM_LENGTH or dialect not in ('postgresql', 'sqlite'):
+        return query.filter(Bucket.name.like('%' + term + '%'))
+
+    if dialect == 'postgresql':
+        query = query.filter(Bucket.name.like('%' + term + '%'))
+        if ranked:
+            query = query.order_by(db.func.similarity(Bucket.name, term).desc(), Bucket.id)
+        return query
+
+    matches = db.select([db.column('rowid'), db.column('rank')]) \
+        .select_from(db.table('buckets_fts')) \
+        .where(db.text('buckets_fts MATCH :bucket_term').bindparams(bucket_term='"' + term.replace('"', '""') + '"')) \
+        .alias('bucket_matches')
+    query = query.join(matches, matches.c.rowid == Bucket.id)
+    if ranked:
+        query = query.order_by(matches.c.rank, Bucket.id)
+    return query
+
+
+def scan_buckets(query, q):
+    """
+    Limit a bucket query to the names containing the search term with a plain LIKE scan.
+    Only used to compare against search_buckets.
+    :param query: Bucket query
+    :param q: Query parameter
+    :return: Query
+    """
+    return query.filter(Bucket.name.like('%' + search_term(q) + '%'))
+
+
+def search_items(query, terms):
+    """
+    Limit an item query to the items whose name or description contains all the words of the terms,
+    best matches first. Each result comes with a snippet of the matching text, the matches wrapped in
+    MATCH_START and MATCH_STOP, to be turned into markup with highlight().
+    :param query: BucketItem query
+    :param terms: Search terms
+    :return: Query of (BucketItem, snippet) rows
+    """
+    words = re.findall(r'\w+', terms.lower())
+    if not words:
+        return query.add_columns(db.literal_column("''").label('snippet')).filter(db.false())
+
+    if db.engine.dialect.name == 'postgresql':
+        language = app.config['SEARCH_LANGUAGE']
+        tsquery = db.func.plainto_tsquery(language, ' '.join(words))
+        snippet = db.func.ts_headline(language, db.func.concat_ws(' ', BucketItem.name, BucketItem.description),
+                                      tsquery, 'StartSel={}, StopSel={}, MaxWords=20, MinWords=5'.format(
+                                          MATCH_START, MATCH_STOP))
+        return query.filter(BucketItem.search_vector.op('@@')(tsquery)) \
+            .add_columns(snippet.label('snippet')) \
+            .order_by(db.func.ts_rank(BucketItem.search_vector, tsquery).desc(), BucketItem.id)
+
+    snippet = db.func.snippet(db.literal_column('bucketitems_fts'), -1, MATCH_START, MATCH_STOP, '...', 12)
+    matches = db.select([db.column('rowid'), db.column('rank'), snippet.label('snippet')]) \
+        .select_from(db.table('bucketitems_fts')) \
+        .where(db.text('bucketitems_fts MATCH :item_terms')
+               .bindparams(item_terms=' '.join('"{}"'.format(word) for word in words))) \
+        .alias('item_matches')
+    return query.join(matches, matches.c.rowid == BucketItem.id) \
+        .add_columns(matches.c.snippet) \
+        .order_by(matches.c.rank, BucketItem.id)
+
+
+def highlight(snippet):
+    """
+    Make the HTML of a snippet: the item text is escaped and only then are the matches wrapped in <b> tags,
+    so markup in the names and descriptions is shown as text.
+    :param snippet: Snippet with the matches between MATCH_START and MATCH_STOP
+    :return: HTML
+    """
+    return html.escape(snippet or '').replace(MATCH_START, '<b>').replace(MATCH_STOP, '</b>')
@@ -1,5 +1,16 @@
 from app import app
 from app.bucketitems.helper import response
+from app.auth.hashing import HashingPoolSaturated
+
+
+@app.errorhandler(401)
+def unauthorized(e):
+    """
+    Return a custom message when the user of a valid token no longer exists.
+    :param e: Exception
+    :return: Http Response
+    """
+    return response('failed', 'Invalid token', 401)
 
 
 @app.errorhandler(404)
@@ -30,3 +41,15 @@ def internal_server_error(e):
     :return:
     """
     return response('failed', 'Internal server error', 500)
+
+
+@app.errorhandler(HashingPoolSaturated)
+def hashing_pool_saturated(e):
+    """
+    Shed password hashing work when the hashing pool is full so that the other endpoints keep responding.
+    :param e: Exception
+    :return:
+    """
+    res, status_code = response('failed', 'The server is busy, please try again later', 503)
+    res.headers['Retry-After'] = str(app.config['BCRYPT_POOL_RETRY_AFTER'])
+    return res, status_code
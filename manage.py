@@ -1,12 +1,23 @@
 from flask_script import Manager
 from flask_migrate import Migrate, MigrateCommand
 from app import app, db, models
-from app.models import User, Bucket, BucketItem
+from app.models import User, Bucket, BucketItem, BlackListToken
+from app.auth.blacklist import blacklist_filter
+from app.auth.hashing import time_hash, hashing_pool
+from app.auth.throttle import login_throttle
+from app.search import search_buckets, scan_buckets
 import unittest
 import coverage
 import os
 import forgery_py as faker
 from random import randint
+import datetime
+import hashlib
+import json
+import resource
+import time
+import uuid
+from sqlalchemy import event
 from sqlalchemy.exc import IntegrityError
 
 # Initializing the manager
@@ -62,13 +73,331 @@ def dummy():
         # Add items to the bucket
         buckt = Bucket.query.filter_by(id=randint(1, Bucket.query.count() - 1)).first()
         item = BucketItem(faker.name.company_name(), faker.lorem_ipsum.word(), buckt.id)
-        db.session.add(item)
         try:
-            db.session.commit()
+            item.save()
         except IntegrityError:
             db.session.rollback()
 
 
+def _time_blacklist_checks(digests):
+    """
+    Time BlackListToken.check_blacklist for each digest and count the database queries it sends.
+    :param digests: Token digests to check
+    :return: (mean latency in microseconds, number of queries)
+    """
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        start = time.perf_counter()
+        for digest in digests:
+            BlackListToken.check_blacklist(digest)
+        seconds = time.perf_counter() - start
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+    return seconds / len(digests) * 1e6, len(statements)
+
+
+@manager.option('-t', '--tokens', dest='tokens', type=int, default=100000, help='Number of blacklisted tokens')
+@manager.option('-p', '--probes', dest='probes', type=int, default=10000, help='Number of lookups to time')
+def blacklist_filter_benchmark(tokens, probes):
+    """
+    Compare BlackListToken.check_blacklist with the blacklist filter loaded and without it, against a
+    blacklist_token table holding the given number of tokens. The database queries sent for tokens
+    that are not blacklisted are the false positives of the filter.
+    Adds the tokens to the configured database and removes them afterwards.
+    :param tokens: Number of blacklisted tokens
+    :param probes: Number of lookups of each kind
+    :return:
+    """
+    blacklisted = [hashlib.sha256(uuid.uuid4().bytes).hexdigest() for _ in range(tokens)]
+    try:
+        now = datetime.datetime.now()
+        for start in range(0, tokens, 5000):
+            db.session.execute(BlackListToken.__table__.insert(), [
+                {'digest': digest, 'blacklisted_on': now, 'expires_on': None}
+                for digest in blacklisted[start:start + 5000]])
+            db.session.commit()
+        if db.engine.dialect.name == 'postgresql':
+            db.session.execute('ANALYZE blacklist_token')
+            db.session.commit()
+
+        unknown = [hashlib.sha256(uuid.uuid4().bytes).hexdigest() for _ in range(probes)]
+        known = [blacklisted[randint(0, tokens - 1)] for _ in range(probes)]
+
+        blacklist_filter.reset()
+        start = time.perf_counter()
+        blacklist_filter.warm(BlackListToken.get_digests_after)
+        warm_seconds = time.perf_counter() - start
+        filter_unknown = _time_blacklist_checks(unknown)
+        filter_known = _time_blacklist_checks(known)
+        bloom = blacklist_filter.filter
+
+        blacklist_filter.reset()
+        database_unknown = _time_blacklist_checks(unknown)
+        database_known = _time_blacklist_checks(known)
+
+        print('Blacklisted tokens: {}, lookups: {}, database: {}'.format(tokens, probes, db.engine.dialect.name))
+        print('Filter capacity:    {}, {:.2f} MB, {} hash functions, loaded in {:.2f} s'.format(
+            bloom.capacity, len(bloom.bits) / 1024 ** 2, bloom.hash_count, warm_seconds))
+        print('Not blacklisted, filter:     {:8.2f} us, {:6d} queries, false positive rate {:.5f}'.format(
+            filter_unknown[0], filter_unknown[1], filter_unknown[1] / probes))
+        print('Not blacklisted, no filter:  {:8.2f} us, {:6d} queries'.format(*database_unknown))
+        print('Blacklisted, filter:         {:8.2f} us, {:6d} queries'.format(*filter_known))
+        print('Blacklisted, no filter:      {:8.2f} us, {:6d} queries'.format(*database_known))
+    finally:
+        blacklist_filter.reset()
+        db.session.rollback()
+        for start in range(0, tokens, 5000):
+            BlackListToken.query.filter(BlackListToken.digest.in_(blacklisted[start:start + 5000])) \
+                .delete(synchronize_session=False)
+            db.session.commit()
+
+
+@manager.option('-b', '--batch', dest='batch', type=int, default=1000, help='Rows deleted per transaction')
+@manager.option('-i', '--interval', dest='interval', type=int, default=0,
+                help='Keep running and purge every INTERVAL seconds')
+def purge_blacklist(batch, interval):
+    """
+    Delete the blacklisted tokens that have expired and report the index size before and after.
+    :param batch: Rows deleted per transaction
+    :param interval: Seconds between runs, run once when 0
+    :return:
+    """
+    while True:
+        size_before = BlackListToken.index_size()
+        removed = BlackListToken.delete_expired(batch)
+        size_after = BlackListToken.index_size()
+        print('Removed {} expired tokens, index size {} -> {} bytes'.format(
+            removed,
+            'n/a' if size_before is None else size_before,
+            'n/a' if size_after is None else size_after))
+        if interval <= 0:
+            return
+        time.sleep(interval)
+
+
+@manager.option('-b', '--batch', dest='batch', type=int, default=1000, help='Items deleted per transaction')
+def purge_detached_buckets(batch):
+    """
+    Finish deleting the buckets whose background purge was cut short, for example by a restart.
+    :param batch: Items deleted per transaction
+    :return:
+    """
+    for bucket_id in Bucket.get_detached_ids():
+        removed = Bucket.purge(bucket_id, batch)
+        print('Purged bucket {} with {} items'.format(bucket_id, removed))
+
+
+@manager.option('-b', '--batch', dest='batch', type=int, default=1000, help='Rows checked per statement')
+@manager.option('-r', '--repair', dest='repair', action='store_true', default=False, help='Fix the counts that drifted')
+def check_counters(batch, repair):
+    """
+    Compare the bucket counts of the users and the item counts of the buckets with the rows they count.
+    :param batch: Rows checked per statement
+    :param repair: Whether to fix the counts that drifted
+    :return:
+    """
+    for name, drift in (('User', User.check_bucket_counts(batch, repair)),
+                        ('Bucket', Bucket.check_item_counts(batch, repair))):
+        for row_id, stored, actual in drift:
+            print('{} {}: counter {}, actual {}'.format(name, row_id, stored, actual))
+        print('{} counters drifted: {}{}'.format(name, len(drift), ', repaired' if repair and drift else ''))
+
+
+@manager.option('-t', '--target-ms', dest='target_ms', type=int, default=250, help='Target hashing time')
+@manager.option('-s', '--samples', dest='samples', type=int, default=3, help='Hashes timed per cost')
+def calibrate_bcrypt(target_ms, samples):
+    """
+    Time bcrypt on this host for increasing costs and recommend the highest cost within the target time.
+    :param target_ms: Target hashing time in milliseconds
+    :param samples: Hashes timed per cost
+    :return:
+    """
+    recommended = 4
+    for rounds in range(4, 32):
+        elapsed_ms = time_hash(rounds, samples) * 1000
+        print('Cost {:2d}: {:8.1f} ms'.format(rounds, elapsed_ms))
+        if elapsed_ms > target_ms:
+            break
+        recommended = rounds
+    print('Recommended BCRYPT_HASH_PREFIX for {} ms: {} (configured: {})'.format(
+        target_ms, recommended, app.config['BCRYPT_HASH_PREFIX']))
+
+
+@manager.command
+def bcrypt_costs():
+    """
+    Show how many users have password hashes of each bcrypt cost.
+    Hashes made with another cost than the configured one are replaced when the user logs in.
+    :return:
+    """
+    for cost, count in User.hash_cost_distribution():
+        marker = '' if cost == app.config['BCRYPT_HASH_PREFIX'] else ' (rehashed on next login)'
+        print('Cost {:2d}: {} users{}'.format(cost, count, marker))
+
+
+def _run_login_attack(client, emails, attempts):
+    """
+    Send failed login attempts cycling over the emails from a single client IP and measure
+    the CPU used by this process and the hashing pool.
+    :param client: Test client
+    :param emails: Targeted emails
+    :param attempts: Number of attempts
+    :return: (CPU seconds, wall seconds, responses by status code)
+    """
+    hashing_pool.shutdown()
+    login_throttle.reset()
+    self_before = resource.getrusage(resource.RUSAGE_SELF)
+    children_before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    start = time.perf_counter()
+    statuses = {}
+    for i in range(attempts):
+        res = client.post('v1/auth/login', content_type='application/json',
+                          environ_base={'REMOTE_ADDR': '203.0.113.7'},
+                          data=json.dumps(dict(email=emails[i % len(emails)], password='wrong-password')))
+        statuses[res.status_code] = statuses.get(res.status_code, 0) + 1
+    wall = time.perf_counter() - start
+    # Joining the pool processes adds their CPU time to RUSAGE_CHILDREN
+    hashing_pool.shutdown()
+    self_after = resource.getrusage(resource.RUSAGE_SELF)
+    children_after = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu = sum(after.ru_utime + after.ru_stime - before.ru_utime - before.ru_stime
+              for before, after in ((self_before, self_after), (children_before, children_after)))
+    return cpu, wall, statuses
+
+
+@manager.option('-a', '--attempts', dest='attempts', type=int, default=200, help='Login attempts per run')
+@manager.option('-e', '--emails', dest='emails', type=int, default=10, help='Number of targeted users')
+def login_load_test(attempts, emails):
+    """
+    Replay a credential stuffing pattern against the login endpoint with and without the login throttle.
+    Creates the targeted users in the configured database and removes them afterwards.
+    :param attempts: Login attempts per run
+    :param emails: Number of targeted users
+    :return:
+    """
+    throttle_enabled = app.config['LOGIN_THROTTLE_ENABLED']
+    targets = ['load-test-{}@bucketmail.com'.format(i) for i in range(emails)]
+    for email in targets:
+        if not User.get_by_email(email):
+            User(email, 'correct-password').save()
+    client = app.test_client()
+    try:
+        for enabled in (False, True):
+            app.config['LOGIN_THROTTLE_ENABLED'] = enabled
+            cpu, wall, statuses = _run_login_attack(client, targets, attempts)
+            print('Throttle {:3}: {:6.2f} s CPU, {:6.2f} s wall, responses {}'.format(
+                'on' if enabled else 'off', cpu, wall, sorted(statuses.items())))
+    finally:
+        app.config['LOGIN_THROTTLE_ENABLED'] = throttle_enabled
+        User.query.filter(User.email.in_(targets)).delete(synchronize_session=False)
+        db.session.commit()
+
+
+def _time_queries(make_query, terms):
+    """
+    Time fetching the first page of results for each term.
+    :param make_query: Callable building the query for a term
+    :param terms: Search terms
+    :return: (median, 95th percentile) in milliseconds
+    """
+    timings = []
+    for term in terms:
+        start = time.perf_counter()
+        make_query(term).limit(app.config['BUCKET_AND_ITEMS_PER_PAGE']).all()
+        make_query(term).order_by(None).count()
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return timings[len(timings) // 2], timings[int(len(timings) * 0.95)]
+
+
+@manager.option('-b', '--buckets', dest='buckets', type=int, default=100000, help='Buckets of the benchmark user')
+@manager.option('-q', '--queries', dest='queries', type=int, default=50, help='Searches to time')
+def bucket_search_benchmark(buckets, queries):
+    """
+    Compare the bucket name search index with a LIKE scan for a user with many buckets.
+    Creates the user and buckets in the configured database and removes them afterwards.
+    :param buckets: Buckets of the benchmark user
+    :param queries: Searches to time
+    :return:
+    """
+    user = User('search-benchmark@bucketmail.com', 'benchmark-password')
+    user.save()
+    try:
+        now = datetime.datetime.utcnow()
+        names = ['{} {}'.format(faker.name.industry(), faker.name.company_name()).lower() for _ in range(buckets)]
+        for start in range(0, buckets, 5000):
+            db.session.execute(Bucket.__table__.insert(), [
+                {'name': name, 'user_id': user.id, 'create_at': now, 'modified_at': now, 'item_count': 0}
+                for name in names[start:start + 5000]])
+            db.session.commit()
+        if db.engine.dialect.name == 'postgresql':
+            db.session.execute('ANALYZE buckets')
+            db.session.commit()
+
+        terms = []
+        for _ in range(queries):
+            name = names[randint(0, buckets - 1)]
+            offset = randint(0, max(len(name) - 4, 0))
+            terms.append(name[offset:offset + 4])
+        user_buckets = Bucket.query.filter_by(user_id=user.id)
+        like = _time_queries(lambda term: scan_buckets(user_buckets, term).order_by(Bucket.id), terms)
+        index = _time_queries(lambda term: search_buckets(user_buckets, term), terms)
+        print('Buckets: {}, searches: {}, database: {}'.format(buckets, queries, db.engine.dialect.name))
+        print('LIKE scan:     median {:8.2f} ms, p95 {:8.2f} ms'.format(*like))
+        print('Search index:  median {:8.2f} ms, p95 {:8.2f} ms'.format(*index))
+    finally:
+        db.session.rollback()
+        Bucket.query.filter_by(user_id=user.id).delete(synchronize_session=False)
+        User.query.filter_by(id=user.id).delete(synchronize_session=False)
+        db.session.commit()
+
+
+@manager.option('-n', '--items', dest='items', type=int, default=500, help='Items written by each path')
+def item_batch_benchmark(items):
+    """
+    Compare the per item cost of creating items one request at a time with batch requests.
+    Creates a user and a bucket in the configured database and removes them afterwards.
+    :param items: Items written by each path
+    :return:
+    """
+    user = User('batch-benchmark@bucketmail.com', 'benchmark-password')
+    user.save()
+    bucket = Bucket('batch benchmark', user.id)
+    bucket.save()
+    headers = dict(Authorization='Bearer ' + user.encode_auth_token(user.id).decode())
+    url = '/v1/bucketlists/{}/items/'.format(bucket.id)
+    client = app.test_client()
+    try:
+        start = time.perf_counter()
+        for i in range(items):
+            client.post(url, headers=headers, content_type='application/json',
+                        data=json.dumps(dict(name='single {}'.format(i), description=faker.lorem_ipsum.sentence())))
+        single_seconds = time.perf_counter() - start
+
+        limit = app.config['BULK_ITEMS_LIMIT']
+        start = time.perf_counter()
+        for offset in range(0, items, limit):
+            client.post(url + 'batch', headers=headers, content_type='application/json', data=json.dumps({
+                'create': [dict(name='batch {}'.format(i), description=faker.lorem_ipsum.sentence())
+                           for i in range(offset, min(offset + limit, items))]}))
+        batch_seconds = time.perf_counter() - start
+
+        print('Items per path: {}, database: {}'.format(items, db.engine.dialect.name))
+        print('Single item requests: {:8.3f} ms per item'.format(single_seconds / items * 1000))
+        print('Batch requests:       {:8.3f} ms per item'.format(batch_seconds / items * 1000))
+    finally:
+        db.session.rollback()
+        BucketItem.query.filter_by(bucket_id=bucket.id).delete(synchronize_session=False)
+        Bucket.query.filter_by(id=bucket.id).delete(synchronize_session=False)
+        User.query.filter_by(id=user.id).delete(synchronize_session=False)
+        db.session.commit()
+
+
 # Run the manager
 if __name__ == '__main__':
     manager.run()
@@ -0,0 +1,48 @@
+"""Index the ownership filter of the buckets
+
+Revision ID: 0b7d4c92e6a3
+Revises: e91f7b3c58d2
+Create Date: 2026-10-18 17:20:09.716254
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '0b7d4c92e6a3'
+down_revision = 'e91f7b3c58d2'
+branch_labels = None
+depends_on = None
+
+# The (create_at, id) listing orders are indexed with the cursor pagination
+indexes = [
+    ('ix_buckets_user_id_id', 'buckets', ['user_id', 'id']),
+]
+
+
+def end_transaction():
+    """
+    CREATE and DROP INDEX CONCURRENTLY cannot run inside a transaction block, so on PostgreSQL the
+    transaction alembic opened is committed first. Building the indexes concurrently keeps the
+    tables writable while they are built.
+    :return: Whether the indexes can be built concurrently
+    """
+    if op.get_bind().dialect.name != 'postgresql':
+        return False
+    op.execute('COMMIT')
+    return True
+
+
+def upgrade():
+    concurrently = end_transaction()
+    for name, table, columns in indexes:
+        op.create_index(name, table, columns, postgresql_concurrently=concurrently)
+
+
+def downgrade():
+    concurrently = end_transaction()
+    for name, table, columns in reversed(indexes):
+        if concurrently:
+            op.execute('DROP INDEX CONCURRENTLY IF EXISTS ' + name)
+        else:
+            op.drop_index(name, table_name=table)
@@ -0,0 +1,49 @@
+"""Index the cursor pagination seeks
+
+Revision ID: 2e6b9d4a7c13
+Revises: c7a5e3d19f48
+Create Date: 2026-10-18 14:38:27.519406
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '2e6b9d4a7c13'
+down_revision = 'c7a5e3d19f48'
+branch_labels = None
+depends_on = None
+
+# Cursor pages seek on (create_at, id) within the buckets of a user and the items of a bucket
+indexes = [
+    ('ix_buckets_user_id_create_at_id', 'buckets', ['user_id', 'create_at', 'id']),
+    ('ix_bucketitems_bucket_id_create_at_id', 'bucketitems', ['bucket_id', 'create_at', 'id']),
+]
+
+
+def end_transaction():
+    """
+    CREATE and DROP INDEX CONCURRENTLY cannot run inside a transaction block, so on PostgreSQL the
+    transaction alembic opened is committed first. Building the indexes concurrently keeps the
+    tables writable while they are built.
+    :return: Whether the indexes can be built concurrently
+    """
+    if op.get_bind().dialect.name != 'postgresql':
+        return False
+    op.execute('COMMIT')
+    return True
+
+
+def upgrade():
+    concurrently = end_transaction()
+    for name, table, columns in indexes:
+        op.create_index(name, table, columns, postgresql_concurrently=concurrently)
+
+
+def downgrade():
+    concurrently = end_transaction()
+    for name, table, columns in reversed(indexes):
+        if concurrently:
+            op.execute('DROP INDEX CONCURRENTLY IF EXISTS ' + name)
+        else:
+            op.drop_index(name, table_name=table)
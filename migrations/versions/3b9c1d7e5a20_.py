@@ -0,0 +1,26 @@
+"""Record the expiry of blacklisted tokens
+
+Revision ID: 3b9c1d7e5a20
+Revises: f365bba04f17
+Create Date: 2026-10-18 09:12:40.511203
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3b9c1d7e5a20'
+down_revision = 'f365bba04f17'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('blacklist_token', sa.Column('expires_on', sa.DateTime(), nullable=True))
+    op.create_index(op.f('ix_blacklist_token_expires_on'), 'blacklist_token', ['expires_on'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_blacklist_token_expires_on'), table_name='blacklist_token')
+    op.drop_column('blacklist_token', 'expires_on')
@@ -0,0 +1,76 @@
+"""Keep bucket counts on users and item counts on buckets
+
+Revision ID: 5d2b8f4e7a61
+Revises: 2e6b9d4a7c13
+Create Date: 2026-10-18 15:12:44.305817
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5d2b8f4e7a61'
+down_revision = '2e6b9d4a7c13'
+branch_labels = None
+depends_on = None
+
+users = sa.table('users',
+                 sa.column('id', sa.Integer),
+                 sa.column('bucket_count', sa.Integer))
+buckets = sa.table('buckets',
+                   sa.column('id', sa.Integer),
+                   sa.column('user_id', sa.Integer),
+                   sa.column('item_count', sa.Integer))
+bucketitems = sa.table('bucketitems',
+                       sa.column('id', sa.Integer),
+                       sa.column('bucket_id', sa.Integer))
+
+
+def end_transaction():
+    """
+    On PostgreSQL commit the transaction alembic opened, so that each backfill batch is committed on its own
+    and its row locks are released instead of being held until the whole migration ends.
+    :return: Whether the batches are committed one at a time
+    """
+    if op.get_bind().dialect.name != 'postgresql':
+        return False
+    op.execute('COMMIT')
+    return True
+
+
+def backfill(connection, table, column, child_key, commit, batch_size=1000):
+    """
+    Set a counter column from a count of the child rows, a range of parent Ids at a time.
+    :param connection: Connection
+    :param table: Parent table
+    :param column: Counter column
+    :param child_key: Child column referencing the parent
+    :param commit: Whether to commit after each batch
+    :param batch_size: Parent rows per update
+    :return:
+    """
+    last_id = connection.execute(sa.select([sa.func.max(table.c.id)])).scalar() or 0
+    for low in range(0, last_id, batch_size):
+        count = sa.select([sa.func.count()]).where(child_key == table.c.id).as_scalar()
+        connection.execute(
+            table.update()
+            .where(sa.and_(table.c.id > low, table.c.id <= low + batch_size))
+            .values({column: count}))
+        if commit:
+            op.execute('COMMIT')
+
+
+def upgrade():
+    op.add_column('users', sa.Column('bucket_count', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('buckets', sa.Column('item_count', sa.Integer(), server_default='0', nullable=False))
+
+    commit = end_transaction()
+    connection = op.get_bind()
+    backfill(connection, users, 'bucket_count', buckets.c.user_id, commit)
+    backfill(connection, buckets, 'item_count', bucketitems.c.bucket_id, commit)
+
+
+def downgrade():
+    op.drop_column('buckets', 'item_count')
+    op.drop_column('users', 'bucket_count')
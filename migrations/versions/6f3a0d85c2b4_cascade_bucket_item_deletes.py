@@ -0,0 +1,65 @@
+"""Delete the items of a bucket with it
+
+Revision ID: 6f3a0d85c2b4
+Revises: 0b7d4c92e6a3
+Create Date: 2026-10-18 18:31:52.410877
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6f3a0d85c2b4'
+down_revision = '0b7d4c92e6a3'
+branch_labels = None
+depends_on = None
+
+naming_convention = {'fk': '%(table_name)s_%(column_0_name)s_fkey'}
+
+# Recreating the table on SQLite drops its triggers
+sqlite_triggers = [
+    "CREATE TRIGGER bucketitems_fts_insert AFTER INSERT ON bucketitems BEGIN "
+    "INSERT INTO bucketitems_fts(rowid, name, description) VALUES (new.id, new.name, new.description); END",
+    "CREATE TRIGGER bucketitems_fts_delete AFTER DELETE ON bucketitems BEGIN "
+    "INSERT INTO bucketitems_fts(bucketitems_fts, rowid, name, description) "
+    "VALUES ('delete', old.id, old.name, old.description); END",
+    "CREATE TRIGGER bucketitems_fts_update AFTER UPDATE OF name, description ON bucketitems BEGIN "
+    "INSERT INTO bucketitems_fts(bucketitems_fts, rowid, name, description) "
+    "VALUES ('delete', old.id, old.name, old.description); "
+    "INSERT INTO bucketitems_fts(rowid, name, description) VALUES (new.id, new.name, new.description); END",
+]
+
+
+def replace_foreign_key(ondelete):
+    """
+    Recreate the foreign key from the items to their bucket with the given ON DELETE action.
+    PostgreSQL adds it NOT VALID and commits, which only holds the exclusive lock briefly, then
+    validates it in a transaction of its own that lets writes go on while the existing rows are
+    checked. SQLite has to copy the table.
+    :param ondelete: ON DELETE action or None
+    :return:
+    """
+    connection = op.get_bind()
+    if connection.dialect.name == 'postgresql':
+        op.drop_constraint('bucketitems_bucket_id_fkey', 'bucketitems', type_='foreignkey')
+        op.execute('ALTER TABLE bucketitems ADD CONSTRAINT bucketitems_bucket_id_fkey FOREIGN KEY (bucket_id) '
+                   'REFERENCES buckets (id){} NOT VALID'.format(' ON DELETE ' + ondelete if ondelete else ''))
+        op.execute('COMMIT')
+        op.execute('ALTER TABLE bucketitems VALIDATE CONSTRAINT bucketitems_bucket_id_fkey')
+        return
+
+    with op.batch_alter_table('bucketitems', naming_convention=naming_convention) as batch_op:
+        batch_op.drop_constraint('bucketitems_bucket_id_fkey', type_='foreignkey')
+        batch_op.create_foreign_key('bucketitems_bucket_id_fkey', 'buckets', ['bucket_id'], ['id'], ondelete=ondelete)
+    if connection.dialect.name == 'sqlite':
+        for statement in sqlite_triggers:
+            op.execute(statement)
+
+
+def upgrade():
+    replace_foreign_key('CASCADE')
+
+
+def downgrade():
+    replace_foreign_key(None)
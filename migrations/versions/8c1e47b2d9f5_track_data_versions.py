@@ -0,0 +1,31 @@
+"""Track change versions of the users' data and of buckets
+
+Revision ID: 8c1e47b2d9f5
+Revises: 6f3a0d85c2b4
+Create Date: 2026-10-18 19:47:08.912334
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8c1e47b2d9f5'
+down_revision = '6f3a0d85c2b4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('users', sa.Column('version', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('users', sa.Column('changed_at', sa.DateTime(), nullable=True))
+    op.add_column('buckets', sa.Column('version', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('buckets', sa.Column('changed_at', sa.DateTime(), nullable=True))
+    op.execute('UPDATE buckets SET changed_at = modified_at')
+
+
+def downgrade():
+    op.drop_column('buckets', 'changed_at')
+    op.drop_column('buckets', 'version')
+    op.drop_column('users', 'changed_at')
+    op.drop_column('users', 'version')
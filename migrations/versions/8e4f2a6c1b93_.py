@@ -0,0 +1,61 @@
+"""Key the token blacklist by a fixed size digest
+
+Revision ID: 8e4f2a6c1b93
+Revises: 3b9c1d7e5a20
+Create Date: 2026-10-18 11:40:02.873516
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import hashlib
+
+
+# revision identifiers, used by Alembic.
+revision = '8e4f2a6c1b93'
+down_revision = '3b9c1d7e5a20'
+branch_labels = None
+depends_on = None
+
+blacklist_token = sa.table('blacklist_token',
+                           sa.column('id', sa.Integer),
+                           sa.column('token', sa.String),
+                           sa.column('digest', sa.String))
+
+
+def upgrade():
+    op.add_column('blacklist_token', sa.Column('digest', sa.String(length=64), nullable=True))
+
+    # Existing tokens have no jti claim, so their digest is taken over the whole token
+    connection = op.get_bind()
+    last_id = 0
+    while True:
+        rows = connection.execute(
+            sa.select([blacklist_token.c.id, blacklist_token.c.token])
+            .where(blacklist_token.c.id > last_id)
+            .order_by(blacklist_token.c.id)
+            .limit(1000)).fetchall()
+        if not rows:
+            break
+        connection.execute(
+            blacklist_token.update()
+            .where(blacklist_token.c.id == sa.bindparam('row_id'))
+            .values(digest=sa.bindparam('row_digest')),
+            [{'row_id': row_id, 'row_digest': hashlib.sha256(token.encode('utf-8')).hexdigest()}
+             for row_id, token in rows])
+        last_id = rows[-1][0]
+
+    with op.batch_alter_table('blacklist_token') as batch_op:
+        batch_op.alter_column('digest', existing_type=sa.String(length=64), nullable=False)
+        batch_op.create_unique_constraint('uq_blacklist_token_digest', ['digest'])
+        batch_op.drop_column('token')
+
+
+def downgrade():
+    # Tokens cannot be recovered from their digests, the digests are kept in the token column
+    op.add_column('blacklist_token', sa.Column('token', sa.String(length=255), nullable=True))
+    op.execute(blacklist_token.update().values(token=blacklist_token.c.digest))
+    with op.batch_alter_table('blacklist_token') as batch_op:
+        batch_op.alter_column('token', existing_type=sa.String(length=255), nullable=False)
+        batch_op.create_unique_constraint('blacklist_token_token_key', ['token'])
+        batch_op.drop_constraint('uq_blacklist_token_digest', type_='unique')
+        batch_op.drop_column('digest')
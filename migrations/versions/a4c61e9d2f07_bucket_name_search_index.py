@@ -0,0 +1,53 @@
+"""Index bucket names for substring search
+
+Revision ID: a4c61e9d2f07
+Revises: 5d2b8f4e7a61
+Create Date: 2026-10-18 15:58:10.624193
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'a4c61e9d2f07'
+down_revision = '5d2b8f4e7a61'
+branch_labels = None
+depends_on = None
+
+sqlite_upgrade = [
+    "CREATE VIRTUAL TABLE buckets_fts USING fts5(name, content='buckets', content_rowid='id', tokenize='trigram')",
+    "CREATE TRIGGER buckets_fts_insert AFTER INSERT ON buckets BEGIN "
+    "INSERT INTO buckets_fts(rowid, name) VALUES (new.id, new.name); END",
+    "CREATE TRIGGER buckets_fts_delete AFTER DELETE ON buckets BEGIN "
+    "INSERT INTO buckets_fts(buckets_fts, rowid, name) VALUES ('delete', old.id, old.name); END",
+    "CREATE TRIGGER buckets_fts_update AFTER UPDATE OF name ON buckets BEGIN "
+    "INSERT INTO buckets_fts(buckets_fts, rowid, name) VALUES ('delete', old.id, old.name); "
+    "INSERT INTO buckets_fts(rowid, name) VALUES (new.id, new.name); END",
+    "INSERT INTO buckets_fts(buckets_fts) VALUES ('rebuild')",
+]
+
+sqlite_downgrade = [
+    "DROP TRIGGER buckets_fts_update",
+    "DROP TRIGGER buckets_fts_delete",
+    "DROP TRIGGER buckets_fts_insert",
+    "DROP TABLE buckets_fts",
+]
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        op.execute('CREATE INDEX ix_buckets_name_trgm ON buckets USING gin (name gin_trgm_ops)')
+    elif dialect == 'sqlite':
+        for statement in sqlite_upgrade:
+            op.execute(statement)
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        op.execute('DROP INDEX ix_buckets_name_trgm')
+    elif dialect == 'sqlite':
+        for statement in sqlite_downgrade:
+            op.execute(statement)
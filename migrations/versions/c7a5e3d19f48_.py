@@ -0,0 +1,24 @@
+"""Add a token epoch to users
+
+Revision ID: c7a5e3d19f48
+Revises: 8e4f2a6c1b93
+Create Date: 2026-10-18 14:05:27.190462
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c7a5e3d19f48'
+down_revision = '8e4f2a6c1b93'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('users', sa.Column('token_epoch', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade():
+    op.drop_column('users', 'token_epoch')
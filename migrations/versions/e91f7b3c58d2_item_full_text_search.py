@@ -0,0 +1,75 @@
+"""Index item names and descriptions for full-text search
+
+Revision ID: e91f7b3c58d2
+Revises: a4c61e9d2f07
+Create Date: 2026-10-18 16:47:31.508326
+
+"""
+from alembic import op
+from flask import current_app
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'e91f7b3c58d2'
+down_revision = 'a4c61e9d2f07'
+branch_labels = None
+depends_on = None
+
+sqlite_upgrade = [
+    "CREATE VIRTUAL TABLE bucketitems_fts USING fts5(name, description, content='bucketitems', content_rowid='id')",
+    "CREATE TRIGGER bucketitems_fts_insert AFTER INSERT ON bucketitems BEGIN "
+    "INSERT INTO bucketitems_fts(rowid, name, description) VALUES (new.id, new.name, new.description); END",
+    "CREATE TRIGGER bucketitems_fts_delete AFTER DELETE ON bucketitems BEGIN "
+    "INSERT INTO bucketitems_fts(bucketitems_fts, rowid, name, description) "
+    "VALUES ('delete', old.id, old.name, old.description); END",
+    "CREATE TRIGGER bucketitems_fts_update AFTER UPDATE OF name, description ON bucketitems BEGIN "
+    "INSERT INTO bucketitems_fts(bucketitems_fts, rowid, name, description) "
+    "VALUES ('delete', old.id, old.name, old.description); "
+    "INSERT INTO bucketitems_fts(rowid, name, description) VALUES (new.id, new.name, new.description); END",
+    "INSERT INTO bucketitems_fts(bucketitems_fts) VALUES ('rebuild')",
+]
+
+sqlite_downgrade = [
+    "DROP TRIGGER bucketitems_fts_update",
+    "DROP TRIGGER bucketitems_fts_delete",
+    "DROP TRIGGER bucketitems_fts_insert",
+    "DROP TABLE bucketitems_fts",
+]
+
+bucketitems = sa.table('bucketitems',
+                       sa.column('id', sa.Integer),
+                       sa.column('name', sa.String),
+                       sa.column('description', sa.Text),
+                       sa.column('search_vector', postgresql.TSVECTOR))
+
+
+def upgrade():
+    op.add_column('bucketitems', sa.Column('search_vector', sa.Text().with_variant(postgresql.TSVECTOR(), 'postgresql'),
+                                           nullable=True))
+    connection = op.get_bind()
+    if connection.dialect.name == 'postgresql':
+        # The vectors have to be built with the language the search queries use
+        language = current_app.config['SEARCH_LANGUAGE']
+        last_id = connection.execute(sa.select([sa.func.max(bucketitems.c.id)])).scalar() or 0
+        for low in range(0, last_id, 1000):
+            connection.execute(
+                bucketitems.update()
+                .where(sa.and_(bucketitems.c.id > low, bucketitems.c.id <= low + 1000))
+                .values(search_vector=sa.func.to_tsvector(
+                    language, sa.func.concat_ws(' ', bucketitems.c.name, bucketitems.c.description))))
+        op.execute('CREATE INDEX ix_bucketitems_search_vector ON bucketitems USING gin (search_vector)')
+    elif connection.dialect.name == 'sqlite':
+        for statement in sqlite_upgrade:
+            op.execute(statement)
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        op.execute('DROP INDEX ix_bucketitems_search_vector')
+    elif dialect == 'sqlite':
+        for statement in sqlite_downgrade:
+            op.execute(statement)
+    op.drop_column('bucketitems', 'search_vector')
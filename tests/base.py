@@ -1,5 +1,12 @@
 from app import app, db
+from app.auth.helper import token_cache
+from app.auth.blacklist import blacklist_filter
+from app.auth.throttle import login_throttle
+from app.auth.epochs import token_epochs
+from app.cache import response_cache
 from flask_testing import TestCase
+from contextlib import contextmanager
+from sqlalchemy import event
 import json
 
 
@@ -19,6 +26,11 @@ class BaseTestCase(TestCase):
         """
         db.create_all()
         db.session.commit()
+        token_cache.clear()
+        blacklist_filter.reset()
+        login_throttle.reset()
+        token_epochs.clear()
+        response_cache.reset()
 
     def tearDown(self):
         """
@@ -28,6 +40,71 @@ class BaseTestCase(TestCase):
         db.session.remove()
         db.drop_all()
 
+    @contextmanager
+    def count_queries(self):
+        """
+        Context manager collecting the SQL statements sent to the database, without their parameters.
+        The list is filled when the block exits, its len() is the number of queries.
+        :return: List of statements
+        """
+        statements = []
+        with self.capture_queries() as queries:
+            yield statements
+        statements.extend(statement for statement, _ in queries)
+
+    @contextmanager
+    def capture_queries(self):
+        """
+        Context manager collecting the SQL statements sent to the database with their parameters
+        :return: List of (statement, parameters)
+        """
+        queries = []
+
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            queries.append((statement, parameters))
+
+        event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            yield queries
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+
+    def query_plan(self, statement, parameters):
+        """
+        Ask the database how it runs a statement. Sequential scans are disabled on PostgreSQL so that
+        the plan shows whether an index can serve the query on the tiny test tables.
+        :param statement: SQL statement
+        :param parameters: Statement parameters
+        :return: Plan text
+        """
+        connection = db.engine.raw_connection()
+        try:
+            cursor = connection.cursor()
+            if db.engine.dialect.name == 'sqlite':
+                cursor.execute('EXPLAIN QUERY PLAN ' + statement, parameters)
+                return '\n'.join(row[-1] for row in cursor.fetchall())
+            cursor.execute('SET enable_seqscan = off')
+            cursor.execute('EXPLAIN ' + statement, parameters)
+            return '\n'.join(row[0] for row in cursor.fetchall())
+        finally:
+            connection.rollback()
+            connection.close()
+
+    def list_query_plan(self, url, token, table):
+        """
+        Request a list endpoint and return the plan of the query that read the listed rows.
+        :param url: List endpoint url
+        :param token: Auth token
+        :param table: Table of the listed rows
+        :return: Plan text
+        """
+        with self.capture_queries() as queries:
+            response = self.client.get(url, headers=dict(Authorization='Bearer ' + token))
+        self.assertEqual(response.status_code, 200)
+        statement, parameters = [(statement, parameters) for statement, parameters in queries
+                                 if 'FROM ' + table in statement and 'LIMIT' in statement][-1]
+        return self.query_plan(statement, parameters)
+
     def register_user(self, email, password):
         """
         Helper method for registering a user with dummy data
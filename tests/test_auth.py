@@ -1,9 +1,18 @@
 from tests.base import BaseTestCase
-from app.models import User
+from app.models import User, BlackListToken
+from app.auth.blacklist import BloomFilter, blacklist_filter
+from app.auth.hashing import hashing_pool, generate_password_hash, hash_cost, HashingPool, HashingPoolSaturated
+from app.auth.helper import token_cache, AuthenticatedUser
+from app.auth.epochs import token_epochs
 from app import db
 import unittest
 import json
 import time
+import datetime
+import hashlib
+import jwt
+import bcrypt
+import threading
 
 
 class TestAuthBluePrint(BaseTestCase):
@@ -288,6 +297,459 @@ class TestAuthBluePrint(BaseTestCase):
             self.assertTrue(data['status'] == 'failed')
             self.assertTrue(data['message'] == 'Signature expired, Please sign in again')
 
+    def test_token_required_method_caches_verified_tokens(self):
+        """
+        Test that a verified token is served from the token cache on the next request
+        :return:
+        """
+        with self.client:
+            token = self.register_and_login_in_user()['auth_token']
+            for _ in range(2):
+                response = self.client.get(
+                    'v1/bucketlists/',
+                    headers=dict(Authorization='Bearer ' + token)
+                )
+                self.assertEqual(response.status_code, 200)
+            stats = token_cache.stats()
+            self.assertEqual(stats['misses'], 1)
+            self.assertEqual(stats['hits'], 1)
+            self.assertEqual(stats['size'], 1)
+
+    def test_cached_token_is_dropped_on_log_out(self):
+        """
+        Test that logging out removes the token from the token cache
+        :return:
+        """
+        with self.client:
+            token = self.register_and_login_in_user()['auth_token']
+            self.client.get('v1/bucketlists/', headers=dict(Authorization='Bearer ' + token))
+            self.assertEqual(token_cache.stats()['size'], 1)
+            self.logout_user(token)
+            self.assertEqual(token_cache.stats()['size'], 0)
+            response = self.client.get('v1/bucketlists/', headers=dict(Authorization='Bearer ' + token))
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 401)
+            self.assertTrue(data['message'] == 'Token was Blacklisted, Please login In')
+
+    def test_blacklist_filter_skips_the_database_for_unknown_tokens(self):
+        """
+        Test that a token missing from the blacklist filter is not looked up in the database
+        :return:
+        """
+        BlackListToken('blacklisted-token').blacklist()
+        blacklist_filter.warm(BlackListToken.get_digests_after)
+        with self.count_queries() as statements:
+            self.assertFalse(BlackListToken.check_blacklist('unknown-token'))
+        self.assertEqual(len(statements), 0)
+        with self.count_queries() as statements:
+            self.assertTrue(BlackListToken.check_blacklist('blacklisted-token'))
+        self.assertEqual(len(statements), 1)
+
+    def test_blacklist_is_queried_until_the_filter_is_loaded(self):
+        """
+        Test that a blacklisted token is found in the database while the filter is still empty
+        :return:
+        """
+        db.session.add(BlackListToken('blacklisted-token'))
+        db.session.commit()
+        self.assertFalse(blacklist_filter.loaded)
+        self.assertTrue(BlackListToken.check_blacklist('blacklisted-token'))
+        self.assertFalse(BlackListToken.check_blacklist('unknown-token'))
+
+    def test_blacklist_filter_sync_reads_rows_that_committed_late(self):
+        """
+        Test that a row committed after a row with a greater Id is still added to the filter
+        :return:
+        """
+        for digest in ('first', 'second', 'third'):
+            BlackListToken(digest).blacklist()
+        late = BlackListToken.query.filter_by(digest='second').one()
+        db.session.delete(late)
+        db.session.commit()
+        blacklist_filter.reset()
+        blacklist_filter.warm(BlackListToken.get_digests_after)
+        self.assertFalse(blacklist_filter.might_contain('late'))
+
+        late = BlackListToken('late')
+        late.id = 2
+        db.session.add(late)
+        db.session.commit()
+        blacklist_filter.synced_at = None
+        self.assertTrue(BlackListToken.check_blacklist('late'))
+        self.assertTrue(blacklist_filter.might_contain('late'))
+
+    def test_log_out_records_token_expiry(self):
+        """
+        Test that the expiry of a logged out token without an epoch claim is stored with the blacklisted token
+        :return:
+        """
+        with self.client:
+            self.register_and_login_in_user()
+            token = self.get_legacy_token(jti=True)
+            self.assertEqual(self.logout_user(token).status_code, 200)
+            blacklisted = BlackListToken.query.one()
+            self.assertIsNotNone(blacklisted.expires_on)
+            self.assertTrue(blacklisted.expires_on > datetime.datetime.utcnow())
+
+    def test_expired_blacklisted_tokens_are_deleted(self):
+        """
+        Test that only the blacklisted tokens which have expired are deleted
+        :return:
+        """
+        now = datetime.datetime.utcnow()
+        for i in range(5):
+            BlackListToken('expired-{}'.format(i), now - datetime.timedelta(seconds=1)).blacklist()
+        BlackListToken('valid', now + datetime.timedelta(days=1)).blacklist()
+        legacy = BlackListToken('legacy')
+        legacy.blacklisted_on = datetime.datetime.now() - datetime.timedelta(days=31)
+        legacy.blacklist()
+        self.assertEqual(BlackListToken.delete_expired(2), 6)
+        self.assertEqual([token.digest for token in BlackListToken.query.all()], ['valid'])
+
+    def test_log_out_blacklists_the_token_digest(self):
+        """
+        Test that the blacklist stores the digest of the token jti claim rather than the token
+        :return:
+        """
+        with self.client:
+            self.register_and_login_in_user()
+            token = self.get_legacy_token(jti=True)
+            self.logout_user(token)
+            payload = jwt.decode(token, self.app.config['SECRET_KEY'], algorithms='HS256')
+            blacklisted = BlackListToken.query.one()
+            self.assertEqual(len(blacklisted.digest), 64)
+            self.assertEqual(blacklisted.digest, hashlib.sha256(payload['jti'].encode('utf-8')).hexdigest())
+
+    def test_log_out_blacklists_tokens_without_jti_by_their_digest(self):
+        """
+        Test that a token issued before the jti claim is blacklisted by the digest of the whole token
+        :return:
+        """
+        with self.client:
+            self.register_and_login_in_user()
+            token = self.get_legacy_token(jti=False)
+            self.logout_user(token)
+            self.assertEqual(BlackListToken.query.one().digest, hashlib.sha256(token.encode('utf-8')).hexdigest())
+            response = self.client.get('v1/bucketlists/', headers=dict(Authorization='Bearer ' + token))
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 401)
+            self.assertTrue(data['message'] == 'Token was Blacklisted, Please login In')
+
+    def test_log_out_revokes_every_token_of_the_user(self):
+        """
+        Test that logging out bumps the token epoch so all the user's tokens stop working without a blacklist row
+        :return:
+        """
+        with self.client:
+            first_token = self.register_and_login_in_user()['auth_token']
+            second_token = json.loads(self.login_user('john@gmail.com', '123456').data.decode())['auth_token']
+            self.client.get('v1/bucketlists/', headers=dict(Authorization='Bearer ' + second_token))
+            self.assertEqual(self.logout_user(first_token).status_code, 200)
+            self.assertEqual(BlackListToken.query.count(), 0)
+            self.assertEqual(User.get_by_id(1).token_epoch, 1)
+            for token in (first_token, second_token):
+                response = self.client.get('v1/bucketlists/', headers=dict(Authorization='Bearer ' + token))
+                self.assertEqual(response.status_code, 401)
+            new_token = json.loads(self.login_user('john@gmail.com', '123456').data.decode())['auth_token']
+            response = self.client.get('v1/bucketlists/', headers=dict(Authorization='Bearer ' + new_token))
+            self.assertEqual(response.status_code, 200)
+
+    def test_revocation_by_another_worker_applies_once_the_cached_epoch_expires(self):
+        """
+        Test that an access token revoked by another worker keeps working here only until the cached epoch is
+        read again
+        :return:
+        """
+        with self.client:
+            token = self.register_and_login_in_user()['auth_token']
+            User.query.filter_by(id=1).update({User.token_epoch: User.token_epoch + 1})
+            db.session.commit()
+            response = self.client.get('v1/bucketlists/', headers=dict(Authorization='Bearer ' + token))
+            self.assertEqual(response.status_code, 200)
+            token_epochs.clear()
+            response = self.client.get('v1/bucketlists/', headers=dict(Authorization='Bearer ' + token))
+            self.assertEqual(response.status_code, 401)
+
+    def test_password_reset_revokes_existing_tokens(self):
+        """
+        Test that resetting the password revokes the existing tokens and returns a new one
+        :return:
+        """
+        with self.client:
+            token = self.register_and_login_in_user()['auth_token']
+            response = self.client.post(
+                'v1/auth/reset/password',
+                headers=dict(Authorization='Bearer ' + token),
+                content_type='application/json',
+                data=json.dumps(dict(oldPassword='123456', newPassword='098765',
+                                     passwordConfirmation='098765')))
+            new_token = json.loads(response.data.decode())['auth_token']
+            response = self.client.get('v1/bucketlists/', headers=dict(Authorization='Bearer ' + token))
+            self.assertEqual(response.status_code, 401)
+            response = self.client.get('v1/bucketlists/', headers=dict(Authorization='Bearer ' + new_token))
+            self.assertEqual(response.status_code, 200)
+
+    def test_bloom_filter_has_no_false_negatives(self):
+        """
+        Test that every value added to the Bloom filter is reported as present
+        :return:
+        """
+        bloom = BloomFilter(1000, 0.01)
+        values = ['token-{}'.format(i) for i in range(1000)]
+        for value in values:
+            bloom.add(value)
+        self.assertTrue(all(value in bloom for value in values))
+        false_positives = sum(1 for i in range(1000) if 'other-{}'.format(i) in bloom)
+        self.assertLess(false_positives, 50)
+
+    def test_login_is_rejected_when_hashing_pool_is_saturated(self):
+        """
+        Test that a 503 response with a Retry-After header is returned when the hashing pool is full
+        :return:
+        """
+        self.register_user('john@gmail.com', '123456')
+        hashing_pool.run(abs, 0)
+        slots = 0
+        while hashing_pool._slots.acquire(blocking=False):
+            slots += 1
+        try:
+            with self.client:
+                response = self.login_user('john@gmail.com', '123456')
+                data = json.loads(response.data.decode())
+                self.assertEqual(response.status_code, 503)
+                self.assertEqual(response.headers['Retry-After'], str(self.app.config['BCRYPT_POOL_RETRY_AFTER']))
+                self.assertTrue(data['status'] == 'failed')
+                self.assertTrue(data['message'] == 'The server is busy, please try again later')
+        finally:
+            for _ in range(slots):
+                hashing_pool._slots.release()
+        self.assertEqual(slots, max(self.app.config['BCRYPT_POOL_SIZE'], 1) + self.app.config['BCRYPT_POOL_QUEUE_SIZE'])
+        self.assertEqual(self.login_user('john@gmail.com', '123456').status_code, 200)
+
+    def test_hashing_pool_stops_waiting_after_the_timeout(self):
+        """
+        Test that work taking longer than the timeout is rejected and keeps its slot until it is done
+        :return:
+        """
+        size, timeout = self.app.config['BCRYPT_POOL_SIZE'], self.app.config['BCRYPT_POOL_TIMEOUT']
+        self.app.config['BCRYPT_POOL_SIZE'], self.app.config['BCRYPT_POOL_TIMEOUT'] = 1, 0.1
+        pool = HashingPool()
+        try:
+            self.assertEqual(pool.run(abs, -1), 1)
+            with self.assertRaises(HashingPoolSaturated):
+                pool.run(time.sleep, 1)
+            self.assertEqual(pool._slots._value, self.app.config['BCRYPT_POOL_QUEUE_SIZE'])
+        finally:
+            pool.shutdown()
+            self.app.config['BCRYPT_POOL_SIZE'], self.app.config['BCRYPT_POOL_TIMEOUT'] = size, timeout
+        self.assertEqual(pool._slots._value, 1 + self.app.config['BCRYPT_POOL_QUEUE_SIZE'])
+
+    def test_concurrent_logins_beyond_the_hashing_pool_get_503(self):
+        """
+        Test that logins arriving together on the threads of a worker are turned away once the real pool
+        and its queue are full, and that the others succeed
+        :return:
+        """
+        self.register_user('john@gmail.com', '123456')
+        user = User.get_by_email('john@gmail.com')
+        user.password = bcrypt.hashpw(b'123456', bcrypt.gensalt(12)).decode('utf-8')
+        db.session.commit()
+        config = {'BCRYPT_POOL_SIZE': 1, 'BCRYPT_POOL_QUEUE_SIZE': 0, 'LOGIN_THROTTLE_ENABLED': False}
+        previous = {key: self.app.config[key] for key in config}
+        self.app.config.update(config)
+        hashing_pool.shutdown()
+        logins = 4
+        barrier = threading.Barrier(logins)
+        statuses = []
+
+        def login():
+            client = self.app.test_client()
+            barrier.wait()
+            statuses.append(client.post('v1/auth/login', content_type='application/json',
+                                        data=json.dumps(dict(email='john@gmail.com', password='123456'))).status_code)
+
+        try:
+            threads = [threading.Thread(target=login) for _ in range(logins)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            hashing_pool.shutdown()
+            self.app.config.update(previous)
+        self.assertIn(200, statuses)
+        self.assertIn(503, statuses)
+        self.assertEqual(len(statuses), logins)
+
+    def test_login_rehashes_password_with_the_configured_cost(self):
+        """
+        Test that a password hashed with another cost is rehashed with the configured cost on login
+        :return:
+        """
+        user = User('john@gmail.com', '123456')
+        user.password = generate_password_hash('123456', self.app.config['BCRYPT_HASH_PREFIX'] + 1)
+        db.session.add(user)
+        db.session.commit()
+        with self.client:
+            response = self.login_user('john@gmail.com', '123456')
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual(hash_cost(User.get_by_email('john@gmail.com').password), self.app.config['BCRYPT_HASH_PREFIX'])
+        self.assertEqual(self.login_user('john@gmail.com', '123456').status_code, 200)
+
+    def test_login_attempts_are_throttled_per_email(self):
+        """
+        Test that login attempts for an email over the limit are rejected without checking the password
+        :return:
+        """
+        self.register_user('john@gmail.com', '123456')
+        with self.client:
+            for _ in range(self.app.config['LOGIN_THROTTLE_EMAIL_LIMIT'] - 1):
+                self.assertEqual(self.login_user('john@gmail.com', 'wrong-password').status_code, 401)
+            with self.count_queries() as statements:
+                response = self.login_user('john@gmail.com', '123456')
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 429)
+            self.assertEqual(len(statements), 0)
+            self.assertTrue(int(response.headers['Retry-After']) > 0)
+            self.assertTrue(data['status'] == 'failed')
+            self.assertTrue(data['message'] == 'Too many attempts, please try again later')
+            self.assertEqual(self.login_user('jane@gmail.com', '123456').status_code, 401)
+
+    def test_login_attempts_are_throttled_per_client_ip(self):
+        """
+        Test that a client IP is throttled across different emails
+        :return:
+        """
+        with self.client:
+            for i in range(self.app.config['LOGIN_THROTTLE_IP_LIMIT']):
+                self.assertEqual(self.login_user('john{}@gmail.com'.format(i), '123456').status_code, 401)
+            self.assertEqual(self.login_user('jane@gmail.com', '123456').status_code, 429)
+            response = self.client.post(
+                'v1/auth/login',
+                content_type='application/json',
+                environ_base={'REMOTE_ADDR': '10.0.0.2'},
+                data=json.dumps(dict(email='jane@gmail.com', password='123456')))
+            self.assertEqual(response.status_code, 401)
+
+    def test_login_attempts_are_throttled_per_forwarded_client_ip(self):
+        """
+        Test that clients behind the trusted proxy are told apart by the X-Forwarded-For entry the proxy added
+        :return:
+        """
+        with self.client:
+            for i in range(self.app.config['LOGIN_THROTTLE_IP_LIMIT']):
+                response = self.client.post(
+                    'v1/auth/login',
+                    content_type='application/json',
+                    headers={'X-Forwarded-For': '1.2.3.4, 203.0.113.7'},
+                    data=json.dumps(dict(email='john{}@gmail.com'.format(i), password='123456')))
+                self.assertEqual(response.status_code, 401)
+            for forwarded_for, status_code in (('5.6.7.8, 203.0.113.7', 429), ('203.0.113.8', 401)):
+                response = self.client.post(
+                    'v1/auth/login',
+                    content_type='application/json',
+                    headers={'X-Forwarded-For': forwarded_for},
+                    data=json.dumps(dict(email='jane@gmail.com', password='123456')))
+                self.assertEqual(response.status_code, status_code, forwarded_for)
+
+    def test_authenticated_user_loads_the_user_row_on_demand(self):
+        """
+        Test that the current user proxy only queries the database for attributes other than the Id
+        :return:
+        """
+        self.register_user('john@gmail.com', '123456')
+        with self.count_queries() as statements:
+            current_user = AuthenticatedUser(1)
+            self.assertEqual(current_user.id, 1)
+        self.assertEqual(len(statements), 0)
+        with self.count_queries() as statements:
+            self.assertEqual(current_user.email, 'john@gmail.com')
+            self.assertEqual(current_user.email, 'john@gmail.com')
+        self.assertEqual(len(statements), 1)
+
+    def test_refresh_token_is_exchanged_for_an_access_token(self):
+        """
+        Test that a refresh token returns a new access token which grants access to user resources
+        :return:
+        """
+        with self.client:
+            login_data = self.register_and_login_in_user()
+            response = self.refresh_token(login_data['refresh_token'])
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(data['status'] == 'success')
+            self.assertTrue(data['message'] == 'Successfully refreshed')
+            response = self.client.get('v1/bucketlists/', headers=dict(Authorization='Bearer ' + data['auth_token']))
+            self.assertEqual(response.status_code, 200)
+
+    def test_tokens_cannot_be_used_in_place_of_each_other(self):
+        """
+        Test that a refresh token cannot access user resources and an access token cannot be refreshed
+        :return:
+        """
+        with self.client:
+            login_data = self.register_and_login_in_user()
+            response = self.client.get(
+                'v1/bucketlists/', headers=dict(Authorization='Bearer ' + login_data['refresh_token']))
+            self.assertEqual(response.status_code, 401)
+            response = self.refresh_token(login_data['auth_token'])
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 401)
+            self.assertTrue(data['message'] == 'Invalid token. Please sign in again')
+
+    def test_refresh_token_is_revoked_on_log_out(self):
+        """
+        Test that a refresh token stops working once the user logs out
+        :return:
+        """
+        with self.client:
+            login_data = self.register_and_login_in_user()
+            self.logout_user(login_data['auth_token'])
+            response = self.refresh_token(login_data['refresh_token'])
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 401)
+            self.assertTrue(data['message'] == 'Token was Blacklisted, Please login In')
+
+    def test_access_token_is_verified_without_a_query(self):
+        """
+        Test that authenticating a request with an access token does not touch the database
+        :return:
+        """
+        with self.client:
+            token = self.register_and_login_in_user()['auth_token']
+            self.client.post('v1/bucketlists/', headers=dict(Authorization='Bearer ' + token),
+                             content_type='application/json', data=json.dumps(dict(name='Travel')))
+            token_cache.clear()
+            with self.count_queries() as statements:
+                response = self.client.get('v1/bucketlists/1', headers=dict(Authorization='Bearer ' + token))
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(statements), 1)
+            self.assertNotIn('users', statements[0])
+
+    def test_signing_keys_can_be_rotated(self):
+        """
+        Test that tokens signed with a previous key stay valid while the key is in the key ring
+        and that tokens are signed with the current key
+        :return:
+        """
+        keys, key_id = self.app.config['AUTH_SIGNING_KEYS'], self.app.config['AUTH_SIGNING_KEY_ID']
+        try:
+            with self.client:
+                old_token = self.register_and_login_in_user()['auth_token']
+                self.app.config['AUTH_SIGNING_KEYS'] = dict(keys, next='next-secret')
+                self.app.config['AUTH_SIGNING_KEY_ID'] = 'next'
+                new_token = json.loads(self.login_user('john@gmail.com', '123456').data.decode())['auth_token']
+                self.assertEqual(jwt.get_unverified_header(new_token)['kid'], 'next')
+                for token in (old_token, new_token):
+                    response = self.client.get('v1/bucketlists/', headers=dict(Authorization='Bearer ' + token))
+                    self.assertEqual(response.status_code, 200)
+                token_cache.clear()
+                self.app.config['AUTH_SIGNING_KEYS'] = {'next': 'next-secret'}
+                response = self.client.get('v1/bucketlists/', headers=dict(Authorization='Bearer ' + old_token))
+                self.assertEqual(response.status_code, 401)
+        finally:
+            self.app.config['AUTH_SIGNING_KEYS'], self.app.config['AUTH_SIGNING_KEY_ID'] = keys, key_id
+
     def register_and_login_in_user(self):
         """
         Helper method to sign up and login a user
@@ -314,6 +776,32 @@ class TestAuthBluePrint(BaseTestCase):
         self.assertTrue(login_response.content_type == 'application/json')
         return login_data
 
+    def get_legacy_token(self, jti):
+        """
+        Helper method to make a token for user 1 as issued before token epochs were introduced
+        :param jti: Whether the token has a jti claim
+        :return: Auth token
+        """
+        payload = {
+            'exp': datetime.datetime.utcnow() + datetime.timedelta(minutes=5),
+            'iat': datetime.datetime.utcnow(),
+            'sub': 1
+        }
+        if jti:
+            payload['jti'] = 'legacy-jti'
+        return jwt.encode(payload, self.app.config['SECRET_KEY'], algorithm='HS256').decode('utf-8')
+
+    def refresh_token(self, token):
+        """
+        Helper method to exchange a refresh token for an access token
+        :param token: Refresh token
+        :return:
+        """
+        return self.client.post(
+            'v1/auth/refresh',
+            headers=dict(Authorization='Bearer ' + token)
+        )
+
     def logout_user(self, token):
         """
         Helper method to log out a user
@@ -1,4 +1,6 @@
 from tests.base import BaseTestCase
+from app import app, db
+from app.models import User, Bucket
 import unittest
 import json
 
@@ -364,6 +366,435 @@ class TestBucketBluePrint(BaseTestCase):
             self.assertEqual(data['previous'], 'http://localhost/v1/bucketlists/?q=T&page=1')
             self.assertEqual(response.status_code, 200)
 
+    def test_get_bucket_with_a_cached_token_costs_one_query(self):
+        """
+        Test that getting a bucket with an already verified token does not load the user
+        :return:
+        """
+        with self.client:
+            token = self.get_user_token()
+            self.create_bucket(token)
+            with self.count_queries() as statements:
+                response = self.client.get(
+                    'v1/bucketlists/1',
+                    headers=dict(Authorization='Bearer ' + token)
+                )
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(statements), 1)
+            self.assertNotIn('users', statements[0])
+
+    def test_buckets_are_paged_by_cursor(self):
+        """
+        Test that the cursor pages walk the buckets in creation order and the previous url leads back
+        :return:
+        """
+        with self.client:
+            token = self.get_user_token()
+            self.create_buckets(token)
+            headers = dict(Authorization='Bearer ' + token)
+            response = self.client.get('v1/bucketlists/?pagination=cursor', headers=headers)
+            first = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual([bucket['id'] for bucket in first['buckets']], [1, 2, 3])
+            self.assertEqual(first['count'], 6)
+            self.assertIsNone(first['previous'])
+            self.assertIn('cursor=', first['next'])
+
+            response = self.client.get(first['next'], headers=headers)
+            second = json.loads(response.data.decode())
+            self.assertEqual([bucket['id'] for bucket in second['buckets']], [4, 5, 6])
+            self.assertIsNone(second['next'])
+
+            response = self.client.get(second['previous'], headers=headers)
+            back = json.loads(response.data.decode())
+            self.assertEqual([bucket['id'] for bucket in back['buckets']], [1, 2, 3])
+            self.assertIsNone(back['previous'])
+            self.assertIsNotNone(back['next'])
+
+    def test_invalid_bucket_cursor_is_rejected(self):
+        """
+        Test that a malformed cursor gets a 400 response
+        :return:
+        """
+        with self.client:
+            response = self.client.get(
+                'v1/bucketlists/?cursor=notacursor',
+                headers=dict(Authorization='Bearer ' + self.get_user_token())
+            )
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(data['message'], 'Invalid cursor')
+
+    def test_token_of_a_deleted_user_is_rejected(self):
+        """
+        Test that a valid token whose user no longer exists is rejected when listing, getting and creating buckets
+        :return:
+        """
+        with self.client:
+            token = self.get_user_token()
+            User.query.filter_by(id=1).delete()
+            db.session.commit()
+            headers = dict(Authorization='Bearer ' + token)
+            for response in (self.client.get('v1/bucketlists/', headers=headers),
+                             self.client.get('v1/bucketlists/1', headers=headers),
+                             self.client.post('v1/bucketlists/', headers=headers, content_type='application/json',
+                                              data=json.dumps(dict(name='Travel')))):
+                data = json.loads(response.data.decode())
+                self.assertEqual(response.status_code, 401)
+                self.assertEqual(data['message'], 'Invalid token')
+
+    def test_bucket_total_comes_from_the_user_counter(self):
+        """
+        Test that the bucket counter follows creations and deletions and no count query is sent for it
+        :return:
+        """
+        with self.client:
+            token = self.get_user_token()
+            self.create_buckets(token)
+            headers = dict(Authorization='Bearer ' + token)
+            self.client.delete('v1/bucketlists/1', headers=headers)
+            self.assertEqual(User.query.filter_by(email='example@gmail.com').first().bucket_count, 5)
+            with self.count_queries() as statements:
+                response = self.client.get('v1/bucketlists/?total=counter', headers=headers)
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(data['count'], 5)
+            self.assertFalse(data['countEstimated'])
+            self.assertFalse([statement for statement in statements if 'count(' in statement.lower()])
+
+    def test_bucket_total_can_be_left_out(self):
+        """
+        Test that total=none returns no count and total=estimate falls back to an exact count on small lists
+        :return:
+        """
+        with self.client:
+            token = self.get_user_token()
+            self.create_buckets(token)
+            headers = dict(Authorization='Bearer ' + token)
+            data = json.loads(self.client.get('v1/bucketlists/?total=none', headers=headers).data.decode())
+            self.assertIsNone(data['count'])
+            self.assertEqual(len(data['buckets']), 3)
+            data = json.loads(self.client.get('v1/bucketlists/?total=estimate&q=tr', headers=headers).data.decode())
+            self.assertEqual(data['count'], 5)
+            self.assertFalse(data['countEstimated'])
+
+    def test_invalid_total_is_rejected(self):
+        """
+        Test that an unknown total mode gets a 400 response
+        :return:
+        """
+        with self.client:
+            response = self.client.get(
+                'v1/bucketlists/?total=all',
+                headers=dict(Authorization='Bearer ' + self.get_user_token())
+            )
+            self.assertEqual(response.status_code, 400)
+
+    def test_bucket_search_ranks_the_closest_names_first(self):
+        """
+        Test that searching with a term of three or more characters goes through the search index,
+        returns the closest names first and follows renamed and deleted buckets
+        :return:
+        """
+        with self.client:
+            token = self.get_user_token()
+            self.create_buckets(token)
+            headers = dict(Authorization='Bearer ' + token)
+            data = json.loads(self.client.get('v1/bucketlists/?q=RAV', headers=headers).data.decode())
+            self.assertEqual([bucket['name'] for bucket in data['buckets']], ['travl', 'trave', 'travel'])
+            self.assertEqual(data['count'], 3)
+
+            self.client.put('v1/bucketlists/5', headers=headers, content_type='application/json',
+                            data=json.dumps(dict(name='Cooking')))
+            self.client.delete('v1/bucketlists/6', headers=headers)
+            data = json.loads(self.client.get('v1/bucketlists/?q=rav', headers=headers).data.decode())
+            self.assertEqual([bucket['id'] for bucket in data['buckets']], [1])
+            data = json.loads(self.client.get('v1/bucketlists/?q=cook', headers=headers).data.decode())
+            self.assertEqual([bucket['id'] for bucket in data['buckets']], [5])
+
+    def test_bucket_listings_read_through_the_user_indexes(self):
+        """
+        Test that the numbered and cursor bucket pages are served in order by the user indexes
+        :return:
+        """
+        with self.client:
+            token = self.get_user_token()
+            self.create_buckets(token)
+            plan = self.list_query_plan('v1/bucketlists/?page=2', token, 'buckets')
+            self.assertIn('ix_buckets_user_id_id', plan)
+            self.assertNotIn('TEMP B-TREE', plan)
+            self.assertNotIn('Sort', plan)
+
+            first = json.loads(self.client.get('v1/bucketlists/?pagination=cursor',
+                                               headers=dict(Authorization='Bearer ' + token)).data.decode())
+            plan = self.list_query_plan(first['next'], token, 'buckets')
+            self.assertIn('ix_buckets_user_id_create_at_id', plan)
+            self.assertNotIn('TEMP B-TREE', plan)
+            self.assertNotIn('Sort', plan)
+
+    def test_buckets_are_created_in_bulk(self):
+        """
+        Test that a json array creates all the buckets in one request and returns their ids in order
+        :return:
+        """
+        with self.client:
+            token = self.get_user_token()
+            headers = dict(Authorization='Bearer ' + token)
+            response = self.client.post('v1/bucketlists/', headers=headers, content_type='application/json',
+                                        data=json.dumps([dict(name='Travel'), dict(name='Cooking'), dict(name='Diving')]))
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 201)
+            self.assertEqual(data['buckets'], [{'id': 1, 'name': 'travel'}, {'id': 2, 'name': 'cooking'},
+                                               {'id': 3, 'name': 'diving'}])
+            data = json.loads(self.client.get('v1/bucketlists/?total=counter', headers=headers).data.decode())
+            self.assertEqual(data['count'], 3)
+
+    def test_bulk_bucket_errors_are_reported_per_element(self):
+        """
+        Test that invalid elements are reported by index, nothing is created and the size cap is enforced
+        :return:
+        """
+        with self.client:
+            token = self.get_user_token()
+            headers = dict(Authorization='Bearer ' + token)
+            response = self.client.post('v1/bucketlists/', headers=headers, content_type='application/json',
+                                        data=json.dumps([dict(name='Travel'), dict(title='Cooking'), 'Diving']))
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(data['errors'], [{'index': 1, 'message': 'Missing name attribute'},
+                                              {'index': 2, 'message': 'Bucket must be a json object'}])
+            self.assertEqual(Bucket.query.count(), 0)
+
+            app.config['BULK_CREATE_LIMIT'] = 2
+            try:
+                response = self.client.post('v1/bucketlists/', headers=headers, content_type='application/json',
+                                            data=json.dumps([dict(name='a'), dict(name='b'), dict(name='c')]))
+            finally:
+                app.config['BULK_CREATE_LIMIT'] = 100
+            self.assertEqual(response.status_code, 413)
+
+    def test_bucket_list_includes_the_newest_items_in_one_query(self):
+        """
+        Test that include=items nests the newest items of every bucket of the page with a single extra query
+        :return:
+        """
+        with self.client:
+            token = self.get_user_token()
+            headers = dict(Authorization='Bearer ' + token)
+            self.client.post('v1/bucketlists/', headers=headers, content_type='application/json',
+                             data=json.dumps([{'name': 'Travel'}, {'name': 'Food'}, {'name': 'Empty'}]))
+            self.client.post('v1/bucketlists/1/items/batch', headers=headers, content_type='application/json',
+                             data=json.dumps({'create': [dict(name='Kampala'), dict(name='Nairobi'),
+                                                         dict(name='Kigali')]}))
+            self.client.post('v1/bucketlists/2/items/batch', headers=headers, content_type='application/json',
+                             data=json.dumps({'create': [dict(name='Rolex')]}))
+
+            with self.count_queries() as plain:
+                self.client.get('v1/bucketlists/', headers=headers)
+            with self.count_queries() as included:
+                response = self.client.get('v1/bucketlists/?include=items&items_limit=2', headers=headers)
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(included), len(plain) + 1)
+            self.assertEqual([[item['name'] for item in bucket['items']] for bucket in data['buckets']],
+                             [['kigali', 'nairobi'], ['rolex'], []])
+
+            data = json.loads(self.client.get('v1/bucketlists/', headers=headers).data.decode())
+            self.assertNotIn('items', data['buckets'][0])
+
+    def test_invalid_bucket_includes_are_rejected(self):
+        """
+        Test that unknown includes and out of range item limits are rejected
+        :return:
+        """
+        with self.client:
+            headers = dict(Authorization='Bearer ' + self.get_user_token())
+            response = self.client.get('v1/bucketlists/?include=owner', headers=headers)
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(json.loads(response.data.decode())['message'], 'Invalid include, use items')
+            response = self.client.get('v1/bucketlists/?include=items&items_limit=0', headers=headers)
+            self.assertEqual(response.status_code, 400)
+            response = self.client.get('v1/bucketlists/?include=items&items_limit=51', headers=headers)
+            self.assertEqual(response.status_code, 400)
+
+    def test_bucket_fields_select_only_the_requested_columns(self):
+        """
+        Test that fields limits the buckets of the list and detail endpoints to the requested attributes
+        and that only their columns are read
+        :return:
+        """
+        with self.client:
+            token = self.get_user_token()
+            headers = dict(Authorization='Bearer ' + token)
+            self.create_buckets(token)
+            with self.capture_queries() as queries:
+                response = self.client.get('v1/bucketlists/?fields=name,id&pagination=cursor', headers=headers)
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(data['buckets'][0], {'id': 1, 'name': 'travel'})
+            self.assertIn('fields=id%2Cname', data['next'])
+            listing = [statement for statement, _ in queries if 'FROM buckets' in statement][0]
+            self.assertNotIn('buckets.modified_at', listing)
+
+            data = json.loads(self.client.get(data['next'], headers=headers).data.decode())
+            self.assertEqual(set(data['buckets'][0]), {'id', 'name'})
+
+            response = self.client.get('v1/bucketlists/1?fields=modifiedAt', headers=headers)
+            data = json.loads(response.data.decode())
+            self.assertEqual(set(data['bucket']), {'modifiedAt'})
+
+            response = self.client.get('v1/bucketlists/?fields=id,owner', headers=headers)
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(json.loads(response.data.decode())['message'],
+                             'Invalid fields, use any of id, name, createdAt, modifiedAt, itemCount')
+
+    def test_unchanged_bucket_list_gets_not_modified(self):
+        """
+        Test that a bucket list request with the current ETag gets 304 after reading only the user version,
+        and that writes to the buckets or their items change the ETag
+        :return:
+        """
+        with self.client:
+            token = self.get_user_token()
+            headers = dict(Authorization='Bearer ' + token)
+            self.create_bucket(token)
+            response = self.client.get('v1/bucketlists/', headers=headers)
+            etag = response.headers['ETag']
+            self.assertEqual(response.status_code, 200)
+            self.assertIn('Last-Modified', response.headers)
+
+            with self.count_queries() as statements:
+                response = self.client.get('v1/bucketlists/', headers=dict(headers, **{'If-None-Match': etag}))
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response.headers['ETag'], etag)
+            self.assertEqual(len(statements), 1)
+            self.assertNotIn('FROM buckets', statements[0])
+
+            response = self.client.get('v1/bucketlists/?page=1', headers=dict(headers, **{'If-None-Match': etag}))
+            self.assertEqual(response.status_code, 200)
+
+            self.client.post('v1/bucketlists/1/items/', headers=headers, content_type='application/json',
+                             data=json.dumps(dict(name='Kampala')))
+            response = self.client.get('v1/bucketlists/', headers=dict(headers, **{'If-None-Match': etag}))
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response.headers['ETag'], etag)
+
+    def test_bucket_update_changes_its_modified_time_and_etag(self):
+        """
+        Test that renaming a bucket moves its modified time and invalidates its ETag
+        :return:
+        """
+        with self.client:
+            token = self.get_user_token()
+            headers = dict(Authorization='Bearer ' + token)
+            self.create_bucket(token)
+            response = self.client.get('v1/bucketlists/1', headers=headers)
+            etag = response.headers['ETag']
+            modified_at = json.loads(response.data.decode())['bucket']['modifiedAt']
+            response = self.client.get('v1/bucketlists/1', headers=dict(headers, **{'If-None-Match': etag}))
+            self.assertEqual(response.status_code, 304)
+
+            self.client.put('v1/bucketlists/1', headers=headers, content_type='application/json',
+                            data=json.dumps(dict(name='Holiday')))
+            response = self.client.get('v1/bucketlists/1', headers=dict(headers, **{'If-None-Match': etag}))
+            self.assertEqual(response.status_code, 200)
+            self.assertGreater(json.loads(response.data.decode())['bucket']['modifiedAt'], modified_at)
+            self.assertEqual(Bucket.query.get(1).version, 1)
+
+    def test_bucket_pages_are_served_from_the_response_cache(self):
+        """
+        Test that a repeated bucket list request is answered from the cache after reading only the user version,
+        that writes invalidate it and that users never get each other's pages
+        :return:
+        """
+        with self.client:
+            token = self.get_user_token()
+            headers = dict(Authorization='Bearer ' + token)
+            self.create_bucket(token)
+            first = self.client.get('v1/bucketlists/?page=1', headers=headers)
+            with self.count_queries() as statements:
+                second = self.client.get('v1/bucketlists/?page=1', headers=headers)
+            self.assertEqual(second.status_code, 200)
+            self.assertEqual(second.data, first.data)
+            self.assertEqual(second.headers['ETag'], first.headers['ETag'])
+            self.assertEqual(len(statements), 1)
+            self.assertNotIn('FROM buckets', statements[0])
+
+            self.client.put('v1/bucketlists/1', headers=headers, content_type='application/json',
+                            data=json.dumps(dict(name='Holiday')))
+            data = json.loads(self.client.get('v1/bucketlists/?page=1', headers=headers).data.decode())
+            self.assertEqual(data['buckets'][0]['name'], 'Holiday')
+
+            other = json.loads(self.register_user('other@gmail.com', '123456').data.decode())['auth_token']
+            data = json.loads(self.client.get('v1/bucketlists/?page=1',
+                                              headers=dict(Authorization='Bearer ' + other)).data.decode())
+            self.assertEqual(data['buckets'], [])
+
+    def test_response_cache_can_be_disabled(self):
+        """
+        Test that every request runs the list query when the response cache is disabled
+        :return:
+        """
+        app.config['RESPONSE_CACHE_ENABLED'] = False
+        try:
+            with self.client:
+                token = self.get_user_token()
+                headers = dict(Authorization='Bearer ' + token)
+                self.create_bucket(token)
+                self.client.get('v1/bucketlists/', headers=headers)
+                with self.count_queries() as statements:
+                    self.client.get('v1/bucketlists/', headers=headers)
+                self.assertTrue([statement for statement in statements if 'FROM buckets' in statement])
+        finally:
+            app.config['RESPONSE_CACHE_ENABLED'] = True
+
+    def test_bucket_json_carries_the_item_count(self):
+        """
+        Test that the bucket list shows the item count of every bucket without counting the items
+        :return:
+        """
+        with self.client:
+            token = self.get_user_token()
+            headers = dict(Authorization='Bearer ' + token)
+            self.client.post('v1/bucketlists/', headers=headers, content_type='application/json',
+                             data=json.dumps([{'name': 'Travel'}, {'name': 'Food'}]))
+            self.client.post('v1/bucketlists/1/items/batch', headers=headers, content_type='application/json',
+                             data=json.dumps({'create': [dict(name='Kampala'), dict(name='Nairobi')]}))
+            with self.count_queries() as statements:
+                response = self.client.get('v1/bucketlists/', headers=headers)
+            data = json.loads(response.data.decode())
+            self.assertEqual([bucket['itemCount'] for bucket in data['buckets']], [2, 0])
+            self.assertFalse([statement for statement in statements if 'bucketitems' in statement])
+            data = json.loads(self.client.get('v1/bucketlists/1?fields=itemCount', headers=headers).data.decode())
+            self.assertEqual(data['bucket'], {'itemCount': 2})
+
+    def test_counter_drift_is_found_and_repaired(self):
+        """
+        Test that counters out of step with the rows are reported and repaired, bumping the data versions
+        :return:
+        """
+        with self.client:
+            token = self.get_user_token()
+            self.create_bucket(token)
+            self.client.post('v1/bucketlists/1/items/batch', headers=dict(Authorization='Bearer ' + token),
+                             content_type='application/json',
+                             data=json.dumps({'create': [dict(name='Kampala'), dict(name='Nairobi')]}))
+            Bucket.query.filter_by(id=1).update({Bucket.item_count: 7})
+            User.query.filter_by(id=1).update({User.bucket_count: 0})
+            db.session.commit()
+            version = User.query.get(1).version
+
+            self.assertEqual(Bucket.check_item_counts(1), [(1, 7, 2)])
+            self.assertEqual(User.check_bucket_counts(1), [(1, 0, 1)])
+            self.assertEqual(Bucket.check_item_counts(1, repair=True), [(1, 7, 2)])
+            self.assertEqual(User.check_bucket_counts(1, repair=True), [(1, 0, 1)])
+            self.assertEqual(Bucket.check_item_counts(1), [])
+            self.assertEqual(User.check_bucket_counts(1), [])
+            db.session.expire_all()
+            self.assertEqual(Bucket.query.get(1).item_count, 2)
+            self.assertEqual(User.query.get(1).bucket_count, 1)
+            self.assertGreater(User.query.get(1).version, version)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -1,4 +1,8 @@
 from tests.base import BaseTestCase
+from app import app, db
+from app.bucket.purge import bucket_purger
+from app.cache import MemoryBackend
+from app.models import User, Bucket, BucketItem
 import unittest
 import json
 
@@ -424,6 +428,377 @@ class TestBucketItem(BaseTestCase):
             self.assertTrue(data['message'] == 'Item not found')
             self.assertEqual(response.status_code, 404)
 
+    def test_items_are_paged_by_cursor(self):
+        """
+        Test that the cursor pages return the newest items first and keep the search query
+        :return:
+        """
+        with self.client:
+            token = self.get_user_token()
+            self.create_bucket(token)
+            self.create_items(token)
+            headers = dict(Authorization='Bearer ' + token)
+            response = self.client.get('v1/bucketlists/1/items/?pagination=cursor&q=f', headers=headers)
+            first = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual([item['id'] for item in first['items']], [6, 5, 4])
+            self.assertIsNone(first['previous'])
+            self.assertIn('q=f', first['next'])
+
+            response = self.client.get(first['next'], headers=headers)
+            second = json.loads(response.data.decode())
+            self.assertEqual([item['id'] for item in second['items']], [3, 2, 1])
+            self.assertIsNone(second['next'])
+            self.assertIsNotNone(second['previous'])
+
+    def test_item_total_comes_from_the_bucket_counter(self):
+        """
+        Test that the item counter of the bucket follows creations and deletions
+        :return:
+        """
+        with self.client:
+            token = self.get_user_token()
+            self.create_bucket(token)
+            self.create_items(token)
+            headers = dict(Authorization='Bearer ' + token)
+            self.client.delete('v1/bucketlists/1/items/2/', headers=headers)
+            self.assertEqual(Bucket.query.get(1).item_count, 5)
+            response = self.client.get('v1/bucketlists/1/items/?pagination=cursor', headers=headers)
+            data = json.loads(response.data.decode())
+            self.assertEqual(data['count'], 5)
+            self.assertFalse(data['countEstimated'])
+
+    def test_items_are_searched_by_name_and_description(self):
+        """
+        Test that the search parameter matches words in the item descriptions, returns a highlighted
+        snippet and follows edited items
+        :return:
+        """
+        with self.client:
+            token = self.get_user_token()
+            self.create_bucket(token)
+            headers = dict(Authorization='Bearer ' + token)
+            for name, description in (('hiking', 'Climb the mountain at sunrise'),
+                                      ('diving', 'Dive the great barrier reef'),
+                                      ('skiing', None)):
+                self.client.post('v1/bucketlists/1/items/', headers=headers, content_type='application/json',
+                                 data=json.dumps(dict(name=name, description=description)))
+            response = self.client.get('v1/bucketlists/1/items/?search=Mountain', headers=headers)
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual([item['name'] for item in data['items']], ['hiking'])
+            self.assertIn('<b>mountain</b>', data['items'][0]['snippet'].lower())
+            self.assertEqual(data['count'], 1)
+
+            self.client.put('v1/bucketlists/1/items/3/', headers=headers, content_type='application/json',
+                            data=json.dumps(dict(name='skiing', description='Ski down the mountain')))
+            data = json.loads(self.client.get('v1/bucketlists/1/items/?search=mountain', headers=headers).data.decode())
+            self.assertEqual(sorted(item['id'] for item in data['items']), [1, 3])
+            data = json.loads(self.client.get('v1/bucketlists/1/items/?search=skiing', headers=headers).data.decode())
+            self.assertEqual([item['id'] for item in data['items']], [3])
+
+    def test_search_snippet_escapes_the_item_text(self):
+        """
+        Test that markup in an item is escaped in the snippet and only the matches are wrapped in <b> tags
+        :return:
+        """
+        with self.client:
+            token = self.get_user_token()
+            self.create_bucket(token)
+            headers = dict(Authorization='Bearer ' + token)
+            self.client.post('v1/bucketlists/1/items/', headers=headers, content_type='application/json',
+                             data=json.dumps(dict(name='capital <script>x</script> city')))
+            data = json.loads(self.client.get('v1/bucketlists/1/items/?search=capital', headers=headers).data.decode())
+            snippet = data['items'][0]['snippet']
+            self.assertEqual(snippet, '<b>capital</b> &lt;script&gt;x&lt;/script&gt; city')
+
+    def test_items_are_searched_across_the_user_buckets(self):
+        """
+        Test that the user wide search covers all the buckets of the user and no one else`s
+        :return:
+        """
+        with self.client:
+            token = self.get_user_token()
+            headers = dict(Authorization='Bearer ' + token)
+            self.create_bucket(token)
+            self.create_bucket(token)
+            self.client.post('v1/bucketlists/1/items/', headers=headers, content_type='application/json',
+                             data=json.dumps(dict(name='reef', description='Dive the reef')))
+            self.client.post('v1/bucketlists/2/items/', headers=headers, content_type='application/json',
+                             data=json.dumps(dict(name='snorkel', description='Snorkel over the reef')))
+            other = json.loads(self.register_user('other@gmail.com', '123456').data.decode())['auth_token']
+            self.create_bucket(other)
+            self.client.post('v1/bucketlists/3/items/', content_type='application/json',
+                             headers=dict(Authorization='Bearer ' + other),
+                             data=json.dumps(dict(name='reef', description='Not yours')))
+
+            response = self.client.get('v1/items/search?search=reef', headers=headers)
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(sorted(item['bucketId'] for item in data['items']), [1, 2])
+            self.assertEqual(data['count'], 2)
+
+            response = self.client.get('v1/items/search', headers=headers)
+            self.assertEqual(response.status_code, 400)
+
+    def test_item_listings_read_through_the_bucket_index(self):
+        """
+        Test that the numbered and cursor item pages are served newest first by the bucket index
+        :return:
+        """
+        with self.client:
+            token = self.get_user_token()
+            self.create_bucket(token)
+            self.create_items(token)
+            plan = self.list_query_plan('v1/bucketlists/1/items/?page=2', token, 'bucketitems')
+            self.assertIn('ix_bucketitems_bucket_id_create_at_id', plan)
+            self.assertNotIn('TEMP B-TREE', plan)
+            self.assertNotIn('Sort', plan)
+
+            first = json.loads(self.client.get('v1/bucketlists/1/items/?pagination=cursor',
+                                               headers=dict(Authorization='Bearer ' + token)).data.decode())
+            plan = self.list_query_plan(first['next'], token, 'bucketitems')
+            self.assertIn('ix_bucketitems_bucket_id_create_at_id', plan)
+            self.assertNotIn('TEMP B-TREE', plan)
+            self.assertNotIn('Sort', plan)
+
+    def test_item_endpoints_resolve_the_bucket_and_item_in_one_query(self):
+        """
+        Test that the item endpoints find the user bucket and the item with a single query,
+        and only check that the user still exists when the bucket or the item does not
+        :return:
+        """
+        with self.client:
+            token = self.get_user_token()
+            self.create_bucket(token)
+            self.create_item(token)
+            headers = dict(Authorization='Bearer ' + token)
+            requests = [
+                ('get', 'v1/bucketlists/1/items/1/', None, 200, 1),
+                # Lookup and the check that the user still exists
+                ('get', 'v1/bucketlists/1/items/9/', None, 404, 2),
+                ('get', 'v1/bucketlists/9/items/1/', None, 404, 2),
+                # Lookup, update, the versions of the bucket and the user and the reload of the expired item
+                ('put', 'v1/bucketlists/1/items/1/', dict(name='drinks'), 200, 5),
+                # Lookup, delete, the item counter and version of the bucket and the version of the user
+                ('delete', 'v1/bucketlists/1/items/1/', None, 200, 4),
+            ]
+            for method, url, payload, status_code, queries in requests:
+                with self.count_queries() as statements:
+                    response = getattr(self.client, method)(
+                        url, headers=headers, content_type='application/json',
+                        data=json.dumps(payload) if payload else None)
+                self.assertEqual(response.status_code, status_code, url)
+                self.assertEqual(len(statements), queries, method + ' ' + url)
+                self.assertNotIn('FROM users', statements[0])
+
+    def test_items_are_created_and_updated_in_a_batch(self):
+        """
+        Test that a batch creates and updates items in one request and reports the ids in order
+        :return:
+        """
+        with self.client:
+            token = self.get_user_token()
+            self.create_bucket(token)
+            self.create_item(token)
+            headers = dict(Authorization='Bearer ' + token)
+            response = self.client.post('v1/bucketlists/1/items/batch', headers=headers,
+                                        content_type='application/json', data=json.dumps({
+                                            'create': [dict(name='Diving', description='Reef'), dict(name='Hiking')],
+                                            'update': [dict(id=1, name='drinks')]}))
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(data['created'], [{'index': 0, 'id': 2}, {'index': 1, 'id': 3}])
+            self.assertEqual(data['updated'], [{'index': 0, 'id': 1}])
+            item = BucketItem.query.get(1)
+            self.assertEqual(item.name, 'drinks')
+            self.assertEqual(item.description, 'Enjoying the good life')
+            self.assertEqual(BucketItem.query.get(2).name, 'diving')
+            self.assertEqual(Bucket.query.get(1).item_count, 3)
+
+    def test_item_batch_errors_are_reported_per_element(self):
+        """
+        Test that invalid elements and unknown items are reported and nothing is written
+        :return:
+        """
+        with self.client:
+            token = self.get_user_token()
+            self.create_bucket(token)
+            self.create_item(token)
+            headers = dict(Authorization='Bearer ' + token)
+            response = self.client.post('v1/bucketlists/1/items/batch', headers=headers,
+                                        content_type='application/json', data=json.dumps({
+                                            'create': [dict(name='Diving'), dict(description='No name')],
+                                            'update': [dict(id=1, name='drinks'), dict(id=7, name='x'), dict(name='y')]}))
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(data['errors'], [
+                {'operation': 'create', 'index': 1, 'message': 'No name or value attribute found'},
+                {'operation': 'update', 'index': 2, 'message': 'Provide a valid item Id'},
+                {'operation': 'update', 'index': 1, 'message': 'Item not found'}])
+            self.assertEqual(BucketItem.query.count(), 1)
+            self.assertEqual(BucketItem.query.get(1).name, 'food')
+
+            response = self.client.post('v1/bucketlists/2/items/batch', headers=headers,
+                                        content_type='application/json',
+                                        data=json.dumps({'create': [dict(name='Diving')]}))
+            self.assertEqual(response.status_code, 404)
+
+    def test_deleting_a_bucket_removes_its_items_in_the_database(self):
+        """
+        Test that the items of a deleted bucket are removed by the foreign key cascade without being loaded
+        :return:
+        """
+        with self.client:
+            token = self.get_user_token()
+            self.create_bucket(token)
+            self.create_item(token)
+            self.client.post('v1/bucketlists/1/items/batch', headers=dict(Authorization='Bearer ' + token),
+                             content_type='application/json', data=json.dumps({'create': [dict(name='Diving')]}))
+            with self.capture_queries() as queries:
+                response = self.client.delete('v1/bucketlists/1', headers=dict(Authorization='Bearer ' + token))
+            self.assertEqual(response.status_code, 200)
+            self.assertFalse([statement for statement, _ in queries
+                              if statement.startswith('SELECT') and 'FROM bucketitems' in statement])
+            self.assertEqual(BucketItem.query.count(), 0)
+
+    def test_large_buckets_are_purged_in_the_background(self):
+        """
+        Test that a bucket above BUCKET_PURGE_THRESHOLD disappears at once and its items are purged later
+        :return:
+        """
+        threshold, batch_size = app.config['BUCKET_PURGE_THRESHOLD'], app.config['BUCKET_PURGE_BATCH_SIZE']
+        app.config.update(BUCKET_PURGE_THRESHOLD=1, BUCKET_PURGE_BATCH_SIZE=1)
+        try:
+            with self.client:
+                token = self.get_user_token()
+                headers = dict(Authorization='Bearer ' + token)
+                self.create_bucket(token)
+                self.create_item(token)
+                self.client.post('v1/bucketlists/1/items/batch', headers=headers, content_type='application/json',
+                                 data=json.dumps({'create': [dict(name='Diving'), dict(name='Hiking')]}))
+                response = self.client.delete('v1/bucketlists/1', headers=headers)
+                data = json.loads(response.data.decode())
+                self.assertEqual(response.status_code, 202)
+                self.assertEqual(data['message'], 'Bucket is being deleted')
+                self.assertEqual(self.client.get('v1/bucketlists/1', headers=headers).status_code, 404)
+                bucket_purger.join()
+                db.session.expire_all()
+                self.assertEqual(BucketItem.query.count(), 0)
+                self.assertIsNone(Bucket.query.get(1))
+                self.assertEqual(User.query.get(1).bucket_count, 0)
+        finally:
+            app.config.update(BUCKET_PURGE_THRESHOLD=threshold, BUCKET_PURGE_BATCH_SIZE=batch_size)
+
+    def test_item_fields_select_only_the_requested_columns(self):
+        """
+        Test that fields limits the items of the list, search and detail endpoints to the requested attributes
+        and that the descriptions are not read when they are not asked for
+        :return:
+        """
+        with self.client:
+            token = self.get_user_token()
+            headers = dict(Authorization='Bearer ' + token)
+            self.create_bucket(token)
+            self.create_item(token)
+            with self.capture_queries() as queries:
+                response = self.client.get('v1/bucketlists/1/items/?fields=name', headers=headers)
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(data['items'], [{'name': 'food'}])
+            self.assertFalse([statement for statement, _ in queries if 'bucketitems.description' in statement])
+
+            response = self.client.get('v1/bucketlists/1/items/?search=good&fields=id,name', headers=headers)
+            data = json.loads(response.data.decode())
+            self.assertEqual(data['items'], [{'id': 1, 'name': 'food', 'snippet': 'Enjoying the <b>good</b> life'}])
+            response = self.client.get('v1/items/search?search=good&fields=bucketId', headers=headers)
+            data = json.loads(response.data.decode())
+            self.assertEqual(data['items'], [{'bucketId': 1, 'snippet': 'Enjoying the <b>good</b> life'}])
+
+            response = self.client.get('v1/bucketlists/1/items/1/?fields=description', headers=headers)
+            data = json.loads(response.data.decode())
+            self.assertEqual(data['item'], {'description': 'Enjoying the good life'})
+            self.assertEqual(self.client.get('v1/bucketlists/1/items/2/?fields=name', headers=headers).status_code, 404)
+            self.assertEqual(self.client.get('v1/bucketlists/1/items/?fields=snippet', headers=headers).status_code,
+                             400)
+
+    def test_unchanged_item_list_gets_not_modified(self):
+        """
+        Test that an item list request with the current ETag gets 304 without the items being read
+        and that item updates, single or batched, move the modified time and the ETag
+        :return:
+        """
+        with self.client:
+            token = self.get_user_token()
+            headers = dict(Authorization='Bearer ' + token)
+            self.create_bucket(token)
+            self.create_item(token)
+            response = self.client.get('v1/bucketlists/1/items/', headers=headers)
+            etag = response.headers['ETag']
+            modified_at = json.loads(response.data.decode())['items'][0]['modifiedAt']
+
+            with self.count_queries() as statements:
+                response = self.client.get('v1/bucketlists/1/items/', headers=dict(headers, **{'If-None-Match': etag}))
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(len(statements), 1)
+            self.assertNotIn('FROM bucketitems', statements[0])
+
+            self.client.put('v1/bucketlists/1/items/1/', headers=headers, content_type='application/json',
+                            data=json.dumps(dict(name='drinks')))
+            response = self.client.get('v1/bucketlists/1/items/', headers=dict(headers, **{'If-None-Match': etag}))
+            self.assertEqual(response.status_code, 200)
+            item = json.loads(response.data.decode())['items'][0]
+            self.assertGreater(item['modifiedAt'], modified_at)
+
+            etag = self.client.get('v1/bucketlists/1/items/1/', headers=headers).headers['ETag']
+            self.client.post('v1/bucketlists/1/items/batch', headers=headers, content_type='application/json',
+                             data=json.dumps({'update': [dict(id=1, name='water')]}))
+            response = self.client.get('v1/bucketlists/1/items/1/', headers=dict(headers, **{'If-None-Match': etag}))
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response.headers['ETag'], etag)
+            self.assertGreater(json.loads(response.data.decode())['item']['modifiedAt'], item['modifiedAt'])
+
+    def test_item_pages_are_served_from_the_response_cache(self):
+        """
+        Test that a repeated item list request only looks up the bucket and that item writes invalidate the page
+        :return:
+        """
+        with self.client:
+            token = self.get_user_token()
+            headers = dict(Authorization='Bearer ' + token)
+            self.create_bucket(token)
+            self.create_item(token)
+            first = self.client.get('v1/bucketlists/1/items/', headers=headers)
+            with self.count_queries() as statements:
+                second = self.client.get('v1/bucketlists/1/items/', headers=headers)
+            self.assertEqual(second.data, first.data)
+            self.assertEqual(len(statements), 1)
+            self.assertNotIn('FROM bucketitems', statements[0])
+
+            self.client.delete('v1/bucketlists/1/items/1/', headers=headers)
+            data = json.loads(self.client.get('v1/bucketlists/1/items/', headers=headers).data.decode())
+            self.assertEqual(data['items'], [])
+
+    def test_response_cache_evicts_the_least_recently_used_pages(self):
+        """
+        Test that the in process backend keeps at most RESPONSE_CACHE_SIZE bodies and expires them
+        :return:
+        """
+        size = app.config['RESPONSE_CACHE_SIZE']
+        app.config['RESPONSE_CACHE_SIZE'] = 2
+        try:
+            backend = MemoryBackend()
+            backend.set('a', b'1', 60)
+            backend.set('b', b'2', 60)
+            self.assertEqual(backend.get('a'), b'1')
+            backend.set('c', b'3', 60)
+            self.assertIsNone(backend.get('b'))
+            self.assertEqual(backend.get('a'), b'1')
+            backend.set('d', b'4', -1)
+            self.assertIsNone(backend.get('d'))
+        finally:
+            app.config['RESPONSE_CACHE_SIZE'] = size
+
 
 if __name__ == '__main__':
     unittest.main()
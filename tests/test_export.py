@@ -0,0 +1,104 @@
+from tests.base import BaseTestCase
+from app import app
+import unittest
+import gzip
+import json
+
+
+class TestExportBluePrint(BaseTestCase):
+    # The export is streamed with the request context, which a client preserving the context of its last
+    # request would push twice, so these tests do not use the client as a context manager.
+
+    def create_data(self, token):
+        """
+        Helper creating two buckets, the first one with two items and the second one empty
+        :return:
+        """
+        headers = dict(Authorization='Bearer ' + token)
+        self.client.post('v1/bucketlists/', headers=headers, content_type='application/json',
+                         data=json.dumps([{'name': 'Travel'}, {'name': 'Food'}]))
+        self.client.post('v1/bucketlists/1/items/batch', headers=headers, content_type='application/json',
+                         data=json.dumps({'create': [dict(name='Kampala', description='Capital'),
+                                                     dict(name='Nairobi')]}))
+
+    def export(self, token, url='v1/export', **headers):
+        """
+        Helper reading an export and returning its lines
+        :return:
+        """
+        response = self.client.get(url, headers=dict(Authorization='Bearer ' + token, **headers))
+        self.assertEqual(response.status_code, 200)
+        body = response.data
+        response.close()
+        if response.headers.get('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+        return [json.loads(line) for line in body.decode('utf-8').splitlines()]
+
+    def test_export_streams_the_buckets_and_items_of_the_user(self):
+        """
+        Test that the export has every bucket followed by its items and ends with an end line
+        :return:
+        """
+        token = self.get_user_token()
+        self.create_data(token)
+        other = json.loads(self.register_user('other@gmail.com', '123456').data.decode())['auth_token']
+        self.create_bucket(other)
+
+        response = self.client.get('v1/export', headers=dict(Authorization='Bearer ' + token))
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        self.assertTrue(response.is_streamed)
+        response.close()
+        lines = self.export(token)
+        self.assertEqual([line['type'] for line in lines], ['bucket', 'item', 'item', 'bucket', 'end'])
+        self.assertEqual(lines[0]['bucket']['name'], 'travel')
+        self.assertEqual(lines[0]['bucket']['itemCount'], 2)
+        self.assertEqual(lines[1]['item']['description'], 'Capital')
+        self.assertEqual(lines[3]['bucket']['id'], 2)
+
+    def test_export_resumes_after_a_cursor(self):
+        """
+        Test that the cursor of a line resumes the export right after it, with small chunks
+        :return:
+        """
+        batch_size = app.config['EXPORT_BATCH_SIZE']
+        app.config['EXPORT_BATCH_SIZE'] = 2
+        try:
+            token = self.get_user_token()
+            self.create_data(token)
+            lines = self.export(token)
+            rest = self.export(token, 'v1/export?cursor=' + lines[1]['cursor'])
+            self.assertEqual(rest, lines[2:])
+            rest = self.export(token, 'v1/export?cursor=' + lines[0]['cursor'])
+            self.assertEqual(rest, lines[1:])
+            self.assertEqual(self.export(token, 'v1/export?cursor=' + lines[3]['cursor']), [{'type': 'end'}])
+        finally:
+            app.config['EXPORT_BATCH_SIZE'] = batch_size
+
+    def test_export_is_compressed_when_the_client_accepts_gzip(self):
+        """
+        Test that the export is gzip compressed on request and the same once decompressed
+        :return:
+        """
+        token = self.get_user_token()
+        self.create_data(token)
+        response = self.client.get('v1/export', headers={'Authorization': 'Bearer ' + token,
+                                                         'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        response.close()
+        self.assertEqual(self.export(token, **{'Accept-Encoding': 'gzip'}), self.export(token))
+
+    def test_export_rejects_an_invalid_cursor(self):
+        """
+        Test that a malformed cursor is rejected
+        :return:
+        """
+        with self.client:
+            token = self.get_user_token()
+            response = self.client.get('v1/export?cursor=bad', headers=dict(Authorization='Bearer ' + token))
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(data['message'], 'Invalid cursor')
+
+
+if __name__ == '__main__':
+    unittest.main()
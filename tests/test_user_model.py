@@ -1,6 +1,7 @@
 from app import db
 from tests.base import BaseTestCase
 from app.models import User
+from app.auth.hashing import generate_password_hash
 import unittest
 
 
@@ -28,6 +29,26 @@ class TestUserModel(BaseTestCase):
         self.assertTrue(isinstance(auth_token, bytes))
         self.assertTrue(user.decode_auth_token(auth_token.decode('utf-8')) == 1, msg='The user Id should be 1')
 
+    def test_password_is_hashed_with_the_configured_cost(self):
+        """
+        Test that the bcrypt cost of a new password hash comes from the configuration
+        :return:
+        """
+        user = self.create_and_save_user()
+        self.assertTrue(user.password.startswith('$2b$%02d$' % self.app.config['BCRYPT_HASH_PREFIX']))
+
+    def test_hash_cost_distribution(self):
+        """
+        Test that users are counted by the cost of their password hash
+        :return:
+        """
+        user = self.create_and_save_user()
+        other = User(email='other@gmail.com', password='123456')
+        other.password = generate_password_hash('123456', 5)
+        db.session.add(other)
+        db.session.commit()
+        self.assertEqual(User.hash_cost_distribution(), [(self.app.config['BCRYPT_HASH_PREFIX'], 1), (5, 1)])
+
     def create_and_save_user(self):
         """
         Helper method to create and save a user in the database